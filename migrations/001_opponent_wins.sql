@@ -0,0 +1,48 @@
+-- Migration for databases created before player_tournament_register stored
+-- opponent_wins.
+--
+-- Adds the column and standings index, fills the column from the recorded
+-- matches and recreates opponent_match_wins without its ORDER BY.
+--
+-- Run from psql while connected to the tournament database:
+--         \i migrations/001_opponent_wins.sql
+--
+
+BEGIN;
+
+ALTER TABLE player_tournament_register
+    ADD COLUMN opponent_wins INTEGER DEFAULT 0;
+
+UPDATE player_tournament_register
+   SET opponent_wins = coalesce(
+           (SELECT SUM(opponent.player_wins)
+              FROM tournament_match, player_tournament_register AS opponent
+             WHERE tournament_match.player_id =
+                       player_tournament_register.player_id
+               AND tournament_match.tournament_id =
+                       player_tournament_register.tournament_id
+               AND opponent.player_id = tournament_match.opponent_id
+               AND opponent.tournament_id = tournament_match.tournament_id),
+           0);
+
+CREATE INDEX player_tournament_register_standings
+    ON player_tournament_register (tournament_id, player_wins DESC,
+                                   opponent_wins DESC);
+
+CREATE OR REPLACE VIEW opponent_match_wins AS
+    SELECT player_tournament_register.player_id, 
+       player_tournament_register.tournament_id, 
+           opponent_wins.sum AS sum 
+     FROM  player_tournament_register, 
+           (SELECT tournament_match.player_id,
+	  	           tournament_match.tournament_id,
+                   SUM(player_tournament_register.player_wins) AS sum
+              FROM tournament_match, player_tournament_register
+             WHERE tournament_match.opponent_id = player_tournament_register.player_id
+               AND tournament_match.tournament_id = player_tournament_register.tournament_id
+          GROUP BY tournament_match.player_id, tournament_match.tournament_id)
+                AS opponent_wins    
+     WHERE opponent_wins.tournament_id = player_tournament_register.tournament_id
+       AND opponent_wins.player_id = player_tournament_register.player_id;
+
+COMMIT;
@@ -0,0 +1,21 @@
+-- Migration adding the indexes for the tournament query access paths.
+--
+-- Run from psql while connected to the tournament database:
+--         \i migrations/002_indexes.sql
+--
+
+BEGIN;
+
+CREATE INDEX tournament_round_ready
+    ON tournament_round (tournament_id, id) WHERE status = 'READY';
+
+CREATE INDEX tournament_match_tournament
+    ON tournament_match (tournament_id, round_id);
+
+CREATE INDEX tournament_match_opponent
+    ON tournament_match (opponent_id, tournament_id);
+
+ANALYZE tournament_round;
+ANALYZE tournament_match;
+
+COMMIT;
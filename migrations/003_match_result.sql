@@ -0,0 +1,74 @@
+-- Migration storing each match once.
+--
+-- Moves the matches from the tournament_match table (two rows per match)
+-- into match_result (one row per match) and replaces tournament_match with
+-- a view giving the same two rows per match.  opponent_match_wins depends
+-- on tournament_match, so it is dropped and recreated unchanged.
+--
+-- The winner of each match is the player with the higher score.  Matches
+-- recorded with equal scores keep the lower player id as the winner.
+--
+-- Run from psql while connected to the tournament database:
+--         \i migrations/003_match_result.sql
+--
+
+BEGIN;
+
+CREATE TABLE match_result (
+    tournament_id   INTEGER,
+    round_id        INTEGER,
+    winner_id       INTEGER REFERENCES player(id),
+    winner_score    INTEGER DEFAULT 0,
+    loser_id        INTEGER REFERENCES player(id),
+    loser_score     INTEGER DEFAULT 0,
+    PRIMARY KEY(tournament_id, round_id, winner_id),
+    UNIQUE(tournament_id, round_id, loser_id),
+    FOREIGN KEY (tournament_id, round_id) REFERENCES tournament_round(tournament_id, id)
+);
+
+INSERT INTO match_result
+     SELECT tournament_id, round_id, player_id, player_score,
+            opponent_id, opponent_score
+       FROM tournament_match
+      WHERE player_score > opponent_score
+         OR (player_score = opponent_score AND player_id < opponent_id);
+
+DROP VIEW opponent_match_wins;
+DROP TABLE tournament_match;
+
+CREATE INDEX match_result_winner
+    ON match_result (winner_id, tournament_id);
+
+CREATE INDEX match_result_loser
+    ON match_result (loser_id, tournament_id);
+
+CREATE VIEW tournament_match AS
+    SELECT winner_id AS player_id, tournament_id, round_id,
+           winner_score AS player_score,
+           loser_id AS opponent_id, loser_score AS opponent_score
+      FROM match_result
+ UNION ALL
+    SELECT loser_id AS player_id, tournament_id, round_id,
+           loser_score AS player_score,
+           winner_id AS opponent_id, winner_score AS opponent_score
+      FROM match_result;
+
+CREATE VIEW opponent_match_wins AS
+    SELECT player_tournament_register.player_id,
+       player_tournament_register.tournament_id,
+           opponent_wins.sum AS sum
+     FROM  player_tournament_register,
+           (SELECT tournament_match.player_id,
+	  	           tournament_match.tournament_id,
+                   SUM(player_tournament_register.player_wins) AS sum
+              FROM tournament_match, player_tournament_register
+             WHERE tournament_match.opponent_id = player_tournament_register.player_id
+               AND tournament_match.tournament_id = player_tournament_register.tournament_id
+          GROUP BY tournament_match.player_id, tournament_match.tournament_id)
+                AS opponent_wins
+     WHERE opponent_wins.tournament_id = player_tournament_register.tournament_id
+       AND opponent_wins.player_id = player_tournament_register.player_id;
+
+ANALYZE match_result;
+
+COMMIT;
@@ -0,0 +1,25 @@
+-- Migration adding standings snapshots.
+--
+-- Adds the round_standings table.  Snapshots are taken as rounds are
+-- completed from now on; tournaments in progress are replayed from their
+-- matches for rounds completed before the upgrade.
+--
+-- Run from psql while connected to the tournament database:
+--         \i migrations/004_round_standings.sql
+--
+
+BEGIN;
+
+CREATE TABLE round_standings (
+    tournament_id   INTEGER,
+    round_id        INTEGER,
+    player_id       INTEGER REFERENCES player(id),
+    player_matches  INTEGER DEFAULT 0,
+    player_wins     INTEGER DEFAULT 0,
+    player_losses   INTEGER DEFAULT 0,
+    opponent_wins   INTEGER DEFAULT 0,
+    PRIMARY KEY(tournament_id, round_id, player_id),
+    FOREIGN KEY (tournament_id, round_id) REFERENCES tournament_round(tournament_id, id)
+);
+
+COMMIT;
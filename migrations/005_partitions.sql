@@ -0,0 +1,133 @@
+-- Migration partitioning the tournament tables by tournament.
+--
+-- Needs PostgreSQL 11 or later.  Rebuilds player_tournament_register,
+-- match_result and round_standings as tables partitioned by tournament_id,
+-- creates a partition of each for every existing tournament and copies the
+-- rows across.  The tournament_match and opponent_match_wins views depend
+-- on the tables, so they are dropped and recreated unchanged.
+--
+-- Run from psql while connected to the tournament database:
+--         \i migrations/005_partitions.sql
+--
+
+BEGIN;
+
+DROP VIEW opponent_match_wins;
+DROP VIEW tournament_match;
+
+--  Move the old tables and their indexes out of the way
+ALTER TABLE player_tournament_register RENAME TO player_tournament_register_old;
+ALTER TABLE match_result RENAME TO match_result_old;
+ALTER TABLE round_standings RENAME TO round_standings_old;
+
+ALTER INDEX player_tournament_register_pkey
+    RENAME TO player_tournament_register_old_pkey;
+ALTER INDEX match_result_pkey RENAME TO match_result_old_pkey;
+ALTER INDEX match_result_tournament_id_round_id_loser_id_key
+    RENAME TO match_result_old_loser_key;
+ALTER INDEX round_standings_pkey RENAME TO round_standings_old_pkey;
+
+DROP INDEX player_tournament_register_standings;
+DROP INDEX match_result_winner;
+DROP INDEX match_result_loser;
+
+CREATE TABLE player_tournament_register (
+    player_id       INTEGER REFERENCES player(id),
+    tournament_id   INTEGER REFERENCES tournament(id),
+    player_matches  INTEGER DEFAULT 0,
+    player_wins     INTEGER DEFAULT 0,
+    player_losses   INTEGER DEFAULT 0,
+    opponent_wins   INTEGER DEFAULT 0,
+    PRIMARY KEY(player_id, tournament_id)
+) PARTITION BY LIST (tournament_id);
+
+CREATE INDEX player_tournament_register_standings
+    ON player_tournament_register (tournament_id, player_wins DESC,
+                                   opponent_wins DESC);
+
+CREATE TABLE match_result (
+    tournament_id   INTEGER,
+    round_id        INTEGER,
+    winner_id       INTEGER REFERENCES player(id),
+    winner_score    INTEGER DEFAULT 0,
+    loser_id        INTEGER REFERENCES player(id),
+    loser_score     INTEGER DEFAULT 0,
+    PRIMARY KEY(tournament_id, round_id, winner_id),
+    UNIQUE(tournament_id, round_id, loser_id),
+    FOREIGN KEY (tournament_id, round_id) REFERENCES tournament_round(tournament_id, id)
+) PARTITION BY LIST (tournament_id);
+
+CREATE INDEX match_result_winner
+    ON match_result (winner_id, tournament_id);
+
+CREATE INDEX match_result_loser
+    ON match_result (loser_id, tournament_id);
+
+CREATE TABLE round_standings (
+    tournament_id   INTEGER,
+    round_id        INTEGER,
+    player_id       INTEGER REFERENCES player(id),
+    player_matches  INTEGER DEFAULT 0,
+    player_wins     INTEGER DEFAULT 0,
+    player_losses   INTEGER DEFAULT 0,
+    opponent_wins   INTEGER DEFAULT 0,
+    PRIMARY KEY(tournament_id, round_id, player_id),
+    FOREIGN KEY (tournament_id, round_id) REFERENCES tournament_round(tournament_id, id)
+) PARTITION BY LIST (tournament_id);
+
+CREATE FUNCTION create_tournament_partitions(tournament INTEGER)
+RETURNS void AS $$
+DECLARE
+    parent TEXT;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['player_tournament_register',
+                                  'match_result', 'round_standings'] LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES IN (%s)',
+                       parent || '_' || tournament, parent, tournament);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_tournament_partitions(id) FROM tournament;
+
+INSERT INTO player_tournament_register
+     SELECT * FROM player_tournament_register_old;
+INSERT INTO match_result SELECT * FROM match_result_old;
+INSERT INTO round_standings SELECT * FROM round_standings_old;
+
+DROP TABLE round_standings_old;
+DROP TABLE match_result_old;
+DROP TABLE player_tournament_register_old;
+
+CREATE VIEW tournament_match AS
+    SELECT winner_id AS player_id, tournament_id, round_id,
+           winner_score AS player_score,
+           loser_id AS opponent_id, loser_score AS opponent_score
+      FROM match_result
+ UNION ALL
+    SELECT loser_id AS player_id, tournament_id, round_id,
+           loser_score AS player_score,
+           winner_id AS opponent_id, winner_score AS opponent_score
+      FROM match_result;
+
+CREATE VIEW opponent_match_wins AS
+    SELECT player_tournament_register.player_id,
+       player_tournament_register.tournament_id,
+           opponent_wins.sum AS sum
+     FROM  player_tournament_register,
+           (SELECT tournament_match.player_id,
+	  	           tournament_match.tournament_id,
+                   SUM(player_tournament_register.player_wins) AS sum
+              FROM tournament_match, player_tournament_register
+             WHERE tournament_match.opponent_id = player_tournament_register.player_id
+               AND tournament_match.tournament_id = player_tournament_register.tournament_id
+          GROUP BY tournament_match.player_id, tournament_match.tournament_id)
+                AS opponent_wins
+     WHERE opponent_wins.tournament_id = player_tournament_register.tournament_id
+       AND opponent_wins.player_id = player_tournament_register.player_id;
+
+ANALYZE player_tournament_register;
+ANALYZE match_result;
+ANALYZE round_standings;
+
+COMMIT;
@@ -0,0 +1,28 @@
+-- Migration keying matches by pairing.
+--
+-- Adds match_result.pairing_id (the lower of the two player ids) and makes
+-- (tournament_id, round_id, pairing_id) the primary key, so a result
+-- reported more than once is only recorded once.  The old primary key on
+-- the winner is kept as a unique constraint.
+--
+-- Run from psql while connected to the tournament database:
+--         \i migrations/006_pairing_key.sql
+--
+
+BEGIN;
+
+ALTER TABLE match_result ADD COLUMN pairing_id INTEGER;
+
+UPDATE match_result SET pairing_id = LEAST(winner_id, loser_id);
+
+ALTER TABLE match_result ALTER COLUMN pairing_id SET NOT NULL;
+
+ALTER TABLE match_result DROP CONSTRAINT match_result_pkey;
+
+ALTER TABLE match_result
+    ADD PRIMARY KEY (tournament_id, round_id, pairing_id);
+
+ALTER TABLE match_result
+    ADD UNIQUE (tournament_id, round_id, winner_id);
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Migration ordering tied standings by player id.
+--
+-- Standings are ordered by wins, opponent wins and then player id, so tied
+-- players always come back in the same order.  Rebuilds the standings index
+-- with player_id as its last column, so the whole order is read from it.
+--
+-- Run from psql while connected to the tournament database:
+--         \i migrations/007_standings_order.sql
+--
+
+BEGIN;
+
+DROP INDEX player_tournament_register_standings;
+
+CREATE INDEX player_tournament_register_standings
+    ON player_tournament_register (tournament_id, player_wins DESC,
+                                   opponent_wins DESC, player_id);
+
+COMMIT;
@@ -11,45 +11,1602 @@
 
 
 import psycopg2
-import math
+import psycopg2.extensions
+import psycopg2.pool
+import collections
+import itertools
+import multiprocessing
 import random
 import sys
+import threading
 import time
-from random import randint
+from contextlib import contextmanager
+from io import BytesIO
+from tournament_engine import numberOfRounds, pairPlayers
+from tournament_stats import instrumentCursor, instrumented, recordConnection
+
+
+#  Connection settings.  Call configurePool to change these before the
+#  first database call (or to rebuild the pool with new settings).
+DSN = "dbname=tournament"
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 10
+
+#  Seconds a pooled connection may sit idle before it is pinged on checkout
+POOL_CHECK_INTERVAL = 30
+
+#  Extra keyword arguments for psycopg2.connect (eg. cursor_factory)
+POOL_CONNECT_ARGS = {}
+
+#  Number of names registerPlayers sends to the database in one COPY
+REGISTER_BATCH_SIZE = 5000
+
+#  Number of tournaments whose standings are kept in the standings cache
+STANDINGS_CACHE_SIZE = 128
+
+#  Number of tournaments whose score brackets are kept in the bracket index
+BRACKET_INDEX_SIZE = 32
+
+#  Number of rows the streaming functions fetch from the server at a time
+STREAM_BATCH_SIZE = 1000
+
+#  Prepare the hot path statements (see _PreparedStatement) on each pooled
+#  connection.  Turn off behind poolers that do not keep sessions, such as
+#  pgbouncer in transaction mode.
+PREPARED_STATEMENTS = True
+
+#  The random setup strategy samples this many times the pages it expects
+#  to need, so the sample is rarely short of players
+SETUP_SAMPLE_MARGIN = 2
+
+#  Times a transaction that fails with a serialization failure or deadlock
+#  (see _retry) is run before giving up, and the delay before the first
+#  retry in seconds.  The delay doubles with each retry.
+TRANSACTION_RETRIES = 5
+TRANSACTION_RETRY_DELAY = 0.01
+
+#  Snapshot the standings every SNAPSHOT_INTERVAL completed rounds (see
+#  standingsAsOf).  Rounds between snapshots are replayed from the matches.
+SNAPSHOT_INTERVAL = 1
+
+#  Tables with a partition for each tournament (see tournament.sql)
+_PARTITIONED_TABLES = ("player_tournament_register", "match_result",
+                       "round_standings")
+
+_pool = None
+_poolLock = threading.Lock()
+
+#  Names for server-side cursors, unique within the process
+_cursorNames = itertools.count(1)
+
+# Order standings by wins and opponent match wins, then id so that tied
+# players always come back in the same order.  Opponent match wins are kept
+# up to date in the register as results are reported
+_STANDINGS_SQL = """
+    SELECT player.id, player.name,
+           player_tournament_register.player_wins,
+           player_tournament_register.player_matches
+      FROM player, player_tournament_register
+     WHERE player.id = player_tournament_register.player_id
+       AND player_tournament_register.tournament_id = ( %s )
+  ORDER BY player_tournament_register.player_wins desc,
+           player_tournament_register.opponent_wins desc,
+           player.id;"""
+
+#  Register the first players by id for a tournament.  The field size is
+#  read from the tournament, so setup is this one statement
+_SETUP_BY_ID_SQL = """
+    INSERT INTO player_tournament_register (player_id, tournament_id)
+    SELECT player.id, %(tournament_id)s
+      FROM player
+  ORDER BY player.id
+     LIMIT (SELECT num_players FROM tournament
+             WHERE tournament.id = %(tournament_id)s);"""
+
+#  Players in score bracket order, as pairPlayers expects them.  Ordering
+#  each bracket by id means a seeded shuffle always gives the same pairs.
+_PAIRING_SQL = """
+    SELECT player.id, player.name, player_tournament_register.player_wins
+      FROM player, player_tournament_register
+     WHERE player.id = player_tournament_register.player_id
+       AND player_tournament_register.tournament_id = %(tournament_id)s
+  ORDER BY player_tournament_register.player_wins desc, player.id;"""
+
+
+class _PreparedStatement(object):
+    """  A hot path statement that is prepared once on each connection and
+         then run with EXECUTE.
+
+    sql uses %(name)s placeholders, so it can also be run as it is (by
+    tournament_async, or when PREPARED_STATEMENTS is off).  params lists the
+    (name, type) of each placeholder in the order of the prepared
+    statement's parameters.
+    """
+
+    __slots__ = ("name", "sql", "prepare", "execute")
+
+    def __init__(self, name, sql, params):
+        self.name = name
+        self.sql = sql
+
+        text = sql.strip()
+
+        for position, (param, pgtype) in enumerate(params, 1):
+            text = text.replace("%%(%s)s" % param, "$%d" % position)
+
+        self.prepare = "PREPARE %s (%s) AS %s" % (
+            name, ", ".join(pgtype for (param, pgtype) in params), text)
+        self.execute = "EXECUTE %s (%s);" % (
+            name, ", ".join("%%(%s)s" % param for (param, pgtype) in params))
+
+
+_PAIRING = _PreparedStatement("tournament_pairing", _PAIRING_SQL,
+                              [("tournament_id", "int")])
+
+#  The number of players registered for a tournament, the number of its
+#  matches and a checksum of their results, to check the bracket index
+#  against (see _Brackets.tally)
+_BRACKET_TALLY = _PreparedStatement(
+    "tournament_bracket_tally", """
+    SELECT (SELECT count(*) FROM player_tournament_register
+             WHERE tournament_id = %(tournament_id)s),
+           count(*),
+           coalesce(sum(round_id::bigint * winner_id), 0)
+      FROM match_result
+     WHERE tournament_id = %(tournament_id)s;""",
+    [("tournament_id", "int")])
+
+_CURRENT_ROUND = _PreparedStatement(
+    "tournament_current_round", """
+    SELECT tournament_round.id FROM tournament_round
+     WHERE status = 'READY'
+       AND tournament_round.tournament_id = %(tournament_id)s
+  ORDER BY id
+     LIMIT 1;""",
+    [("tournament_id", "int")])
+
+#  Lock a round against completion while results are recorded for it, if
+#  it is still being played.  Reports share the lock; completing the round
+#  takes it exclusively (see _completeStatements), so it waits for reports
+#  in flight to commit and a report that waited sees the round complete
+_LOCK_ROUND = _PreparedStatement(
+    "tournament_lock_round", """
+    SELECT 1 FROM tournament_round
+     WHERE tournament_id = %(tournament_id)s
+       AND id = %(round_id)s
+       AND status = 'READY'
+       FOR SHARE;""",
+    [("tournament_id", "int"), ("round_id", "int")])
+
+#  Record a batch of matches in a round locked by _LOCK_ROUND.  Matches
+#  already recorded (by an earlier or a concurrent report) are skipped; the
+#  ones recorded are returned
+_RECORD_MATCHES = _PreparedStatement(
+    "tournament_record_matches", """
+    INSERT INTO match_result
+           (tournament_id, round_id, winner_id, winner_score,
+            loser_id, loser_score, pairing_id)
+    SELECT %(tournament_id)s, %(round_id)s,
+           result.winner_id, result.winner_score,
+           result.loser_id, result.loser_score,
+           LEAST(result.winner_id, result.loser_id)
+      FROM unnest(%(match_winners)s::int[], %(winner_scores)s::int[],
+                  %(losers)s::int[], %(loser_scores)s::int[])
+           AS result (winner_id, winner_score, loser_id, loser_score)
+        ON CONFLICT DO NOTHING
+ RETURNING winner_id, loser_id;""",
+    [("tournament_id", "int"), ("round_id", "int"),
+     ("match_winners", "int[]"), ("winner_scores", "int[]"),
+     ("losers", "int[]"), ("loser_scores", "int[]")])
+
+#  Matches already recorded for a set of pairings
+_REPORTED_MATCHES = _PreparedStatement(
+    "tournament_reported_matches", """
+    SELECT winner_id, winner_score, loser_id, loser_score
+      FROM match_result
+     WHERE tournament_id = %(tournament_id)s
+       AND round_id = %(round_id)s
+       AND pairing_id = ANY(%(pairings)s::int[]);""",
+    [("tournament_id", "int"), ("round_id", "int"), ("pairings", "int[]")])
+
+#  Lock, in id order, the register records that recording a batch updates:
+#  the players in the batch and every earlier opponent of its winners.
+#  Concurrent reports lock in the same order, so they queue rather than
+#  deadlock
+_LOCK_PLAYERS = _PreparedStatement(
+    "tournament_lock_players", """
+    SELECT player_id
+      FROM player_tournament_register
+     WHERE tournament_id = %(tournament_id)s
+       AND (player_id = ANY(%(tallied)s::int[])
+            OR player_id IN (SELECT opponent_id
+                               FROM tournament_match
+                              WHERE tournament_id = %(tournament_id)s
+                                AND player_id = ANY(%(winners)s::int[])))
+  ORDER BY player_id
+       FOR UPDATE;""",
+    [("tournament_id", "int"), ("tallied", "int[]"), ("winners", "int[]")])
+
+#  Apply every player's match, win and loss counts in one statement
+_RECORD_COUNTERS = _PreparedStatement(
+    "tournament_record_counters", """
+    UPDATE player_tournament_register
+       SET player_matches = player_matches + result.matches,
+           player_wins = player_wins + result.wins,
+           player_losses = player_losses + result.losses
+      FROM (SELECT unnest(%(tallied)s::int[]) AS player_id,
+                   unnest(%(matches)s::int[]) AS matches,
+                   unnest(%(wins)s::int[]) AS wins,
+                   unnest(%(losses)s::int[]) AS losses) AS result
+     WHERE player_tournament_register.player_id = result.player_id
+       AND player_tournament_register.tournament_id = %(tournament_id)s;""",
+    [("tournament_id", "int"), ("tallied", "int[]"), ("matches", "int[]"),
+     ("wins", "int[]"), ("losses", "int[]")])
+
+#  Keep opponent_wins (the total wins of every opponent a player has faced)
+#  current without re-aggregating the match history.  A player gains the
+#  full win total of the opponent met in this batch, plus one for each
+#  earlier opponent who won in this batch.
+_RECORD_OPPONENT_WINS = _PreparedStatement(
+    "tournament_record_opponent_wins", """
+    UPDATE player_tournament_register
+       SET opponent_wins = opponent_wins + delta.wins
+      FROM (SELECT tournament_match.player_id,
+                   SUM(CASE WHEN tournament_match.round_id = %(round_id)s
+                             AND tournament_match.player_id =
+                                     ANY(%(tallied)s::int[])
+                            THEN opponent.player_wins
+                            ELSE 1 END) AS wins
+              FROM tournament_match, player_tournament_register AS opponent
+             WHERE opponent.player_id = tournament_match.opponent_id
+               AND opponent.tournament_id = tournament_match.tournament_id
+               AND tournament_match.tournament_id = %(tournament_id)s
+               AND ((tournament_match.round_id = %(round_id)s
+                     AND tournament_match.player_id =
+                             ANY(%(tallied)s::int[]))
+                    OR tournament_match.opponent_id =
+                             ANY(%(winners)s::int[]))
+          GROUP BY tournament_match.player_id) AS delta
+     WHERE player_tournament_register.player_id = delta.player_id
+       AND player_tournament_register.tournament_id = %(tournament_id)s;""",
+    [("tournament_id", "int"), ("round_id", "int"), ("tallied", "int[]"),
+     ("winners", "int[]")])
+
+#  Names of the statements prepared on each pooled connection, by id of the
+#  connection: (backend process id, set of names).  A connection that was
+#  replaced has a new backend, so its statements are prepared again.
+_prepared = {}
+
+
+class _ConnectionPool(object):
+    """  Thread safe pool of psycopg2 connections.
+
+    Wraps psycopg2's ThreadedConnectionPool so that a checkout blocks while
+    all connections are in use (instead of raising PoolError) and so that
+    dead or stale connections are replaced before they are handed out.
+    """
+
+    def __init__(self, dsn, minconn, maxconn, check_interval,
+                 **connect_args):
+        self.dsn = dsn
+        self.check_interval = check_interval
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn,
+                                                         dsn, **connect_args)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.lastUsed = {}
+
+    def getconn(self):
+        """  Check out a healthy connection, waiting for a free slot. """
+
+        self.slots.acquire()
+
+        try:
+            conn = self.pool.getconn()
+
+            if not self._healthy(conn):
+                self.discard(conn)
+                conn = self.pool.getconn()
+
+            #  Connections are only timestamped once returned, so one
+            #  without a timestamp has just been opened
+            if id(conn) not in self.lastUsed:
+                recordConnection()
+        except:
+            self.slots.release()
+            raise
+
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """  Return a connection to the pool.  Broken connections (or ones
+             the caller asks to discard) are closed instead of reused. """
+
+        try:
+            if discard or conn.closed:
+                self.discard(conn)
+            else:
+                self.lastUsed[id(conn)] = time.time()
+                self.pool.putconn(conn)
+        finally:
+            self.slots.release()
+
+    def discard(self, conn):
+        self.lastUsed.pop(id(conn), None)
+        _prepared.pop(id(conn), None)
+        self.pool.putconn(conn, close=True)
+
+    def closeall(self):
+        self.lastUsed.clear()
+        _prepared.clear()
+        self.pool.closeall()
+
+    def _healthy(self, conn):
+        """  A connection is healthy if it is open and, when it has been
+             idle longer than check_interval, still answers a ping. """
+
+        if conn.closed:
+            return False
+
+        lastUsed = self.lastUsed.get(id(conn))
+
+        if lastUsed is not None and \
+                time.time() - lastUsed < self.check_interval:
+            return True
+
+        try:
+            c = conn.cursor()
+            c.execute("""SELECT 1;""")
+            conn.rollback()
+        except psycopg2.DatabaseError:
+            return False
+
+        return True
+
+
+@instrumented
+def connect():
+    """Connect to the PostgreSQL database.  Returns a database connection.
+       or exit the program if a connection cannot be established.
+
+       Note: the tournament functions use pooled connections (see
+       getConnection).  This returns a new, unpooled connection."""
+
+    conn = None
+
+    try:
+        conn = psycopg2.connect(DSN)
+
+        recordConnection()
+    except psycopg2.DatabaseError, e:
+
+        print ("System Error: " + str(e))
+        print ("Terminating Program")
+
+        sys.exit(1)
+
+    return conn
+
+
+def configurePool(dsn=None, minconn=None, maxconn=None, check_interval=None,
+                  **connect_args):
+    """  Set the connection pool parameters.  Any existing pool is closed
+         and a new one is created on the next database call.
+
+    Args:
+      dsn: PostgreSQL connection string (default "dbname=tournament")
+      minconn: number of connections opened when the pool is created
+      maxconn: maximum number of connections held by the pool
+      check_interval: idle seconds after which a connection is pinged
+                      before it is handed out
+      connect_args: any other keyword arguments are passed on to
+                    psycopg2.connect (eg. cursor_factory) and replace the
+                    ones given to earlier calls
+    """
+
+    global DSN, POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS
+    global POOL_CHECK_INTERVAL, POOL_CONNECT_ARGS
+
+    if dsn is not None:
+        DSN = dsn
+    if minconn is not None:
+        POOL_MIN_CONNECTIONS = minconn
+    if maxconn is not None:
+        POOL_MAX_CONNECTIONS = maxconn
+    if check_interval is not None:
+        POOL_CHECK_INTERVAL = check_interval
+
+    POOL_CONNECT_ARGS = connect_args
+
+    closePool()
+
+
+def closePool():
+    """  Close every connection in the connection pool. """
+
+    global _pool
+
+    with _poolLock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def _getPool():
+    """  Return the connection pool, creating it on first use.  Exit the
+         program if the pool cannot connect to the database. """
+
+    global _pool
+
+    with _poolLock:
+        if _pool is None:
+            try:
+                _pool = _ConnectionPool(DSN, POOL_MIN_CONNECTIONS,
+                                        POOL_MAX_CONNECTIONS,
+                                        POOL_CHECK_INTERVAL,
+                                        **POOL_CONNECT_ARGS)
+            except psycopg2.DatabaseError, e:
+
+                print ("System Error: " + str(e))
+                print ("Terminating Program")
+
+                sys.exit(1)
+
+        return _pool
+
+
+@contextmanager
+def getConnection():
+    """  Check a connection out of the pool for the duration of a with block.
+
+    The transaction is committed when the block completes and rolled back
+    if it raises.  Either way the connection goes back to the pool.
+
+        with getConnection() as conn:
+            c = conn.cursor()
+            ...
+    """
+
+    pool = _getPool()
+
+    conn = pool.getconn()
+
+    try:
+        yield conn
+
+        conn.commit()
+    except:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+class _StandingsCache(object):
+    """  Least recently used cache of playerStandings results by tournament.
+
+    Every tournament has a version that is bumped when its results change.
+    A standings read remembers the version it started with and its result is
+    only kept if no change was committed in the meantime, so a slow read can
+    never overwrite the cache with standings older than the latest change.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+        #  Version of each changed tournament, and a version shared by all
+        #  of them that is bumped when everything is invalidated
+        self.versions = {}
+        self.epoch = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, tournament_id):
+        """  Return (version, standings), with standings None on a miss. """
+
+        with self.lock:
+            version = (self.epoch, self.versions.get(tournament_id, 0))
+            standings = self.entries.pop(tournament_id, None)
+
+            if standings is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries[tournament_id] = standings
+
+            return version, standings
+
+    def store(self, tournament_id, version, standings):
+        """  Keep standings read at version, unless they are out of date. """
+
+        with self.lock:
+            if version != (self.epoch, self.versions.get(tournament_id, 0)):
+                return
+
+            self.entries.pop(tournament_id, None)
+            self.entries[tournament_id] = standings
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tournament_ids):
+        """  Bump the version of each tournament and drop its standings.
+             A tournament_id of None invalidates every tournament. """
+
+        with self.lock:
+            for tournament_id in tournament_ids:
+                if tournament_id is None:
+                    self.epoch += 1
+                    self.entries.clear()
+                else:
+                    self.versions[tournament_id] = \
+                        self.versions.get(tournament_id, 0) + 1
+                    self.entries.pop(tournament_id, None)
+
+    def clear(self, size):
+        """  Drop every entry, reset the counters and set the size. """
+
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+            self.size = size
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """  Return the cache counters as a dict. """
+
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self.entries), "size": self.size}
+
+
+_standingsCache = _StandingsCache(STANDINGS_CACHE_SIZE)
+
+
+def standingsCacheInfo():
+    """  Return the standings cache counters.
+
+    Returns:
+      A dict with the number of cache hits and misses since the cache was
+      last cleared, the number of tournaments cached and the cache size.
+    """
+
+    return _standingsCache.info()
+
+
+def clearStandingsCache(size=None):
+    """  Empty the standings cache and reset its counters.
+
+    Args:
+      size: number of tournaments to keep from now on (default: unchanged)
+    """
+
+    _standingsCache.clear(_standingsCache.size if size is None else size)
+
+
+class _Brackets(object):
+    """  The score brackets of one tournament: its players bucketed by wins
+         and the opponents each has met.
+
+    A result moves its winner up one bracket, a removal from one set and an
+    insertion into another, so the brackets keep up with the results
+    without sorting anything.  Wins are counted from the matches and each
+    match is applied once (by round and pairing), so applying a result
+    again changes nothing.  Each player's opponents are a frozenset that a
+    result replaces rather than changes, so a copy of opponents is a
+    snapshot that later results leave alone.
+    """
+
+    __slots__ = ("names", "wins", "brackets", "opponents", "matches",
+                 "checksum")
+
+    def __init__(self, players, matches):
+        self.names = dict(players)
+        self.wins = dict.fromkeys(self.names, 0)
+        self.brackets = {0: set(self.names)} if self.names else {}
+        self.opponents = {}
+        self.matches = set()
+        self.checksum = 0
+
+        for (round_id, winner, loser) in matches:
+            self.record(round_id, winner, loser)
+
+    def record(self, round_id, winner, loser):
+        """  Apply a match result, unless it has been applied already. """
+
+        match = (round_id, min(winner, loser))
+
+        if match in self.matches:
+            return
+
+        self.matches.add(match)
+        self.checksum += round_id * winner
+
+        self.opponents[winner] = \
+            self.opponents.get(winner, frozenset()) | frozenset([loser])
+        self.opponents[loser] = \
+            self.opponents.get(loser, frozenset()) | frozenset([winner])
+
+        wins = self.wins.get(winner)
+
+        if wins is None:
+            return
+
+        bracket = self.brackets[wins]
+        bracket.discard(winner)
+
+        if not bracket:
+            del self.brackets[wins]
+
+        self.wins[winner] = wins + 1
+        self.brackets.setdefault(wins + 1, set()).add(winner)
+
+    def tally(self):
+        """  Return the (players, matches, checksum) row that _BRACKET_TALLY
+             reads for the same tournament. """
+
+        return (len(self.names), len(self.matches), self.checksum)
+
+    def players(self):
+        """  Return (id, name, wins) rows in _PAIRING_SQL order: brackets
+             from most wins down, players in id order inside each one. """
+
+        return [(player_id, self.names[player_id], wins)
+                for wins in sorted(self.brackets, reverse=True)
+                for player_id in sorted(self.brackets[wins])]
+
+
+class _BracketIndex(object):
+    """  Least recently used index of _Brackets by tournament.
+
+    Committed results are applied to the brackets as they are (see
+    TournamentSession.commit), so pairing the next round only reads a tally
+    of the tournament from the database.  Any other change to a tournament
+    drops its brackets, to be read again when next needed.  Versions work
+    as in _StandingsCache, so brackets read before a change are never kept
+    after it.  Changes made by other processes are caught by the tally (see
+    TournamentSession.swissPairings).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+        self.versions = {}
+        self.epoch = 0
+
+        self.lock = threading.Lock()
+
+    def _version(self, tournament_id):
+        return (self.epoch, self.versions.get(tournament_id, 0))
+
+    def _bump(self, tournament_id):
+        self.versions[tournament_id] = self.versions.get(tournament_id, 0) + 1
+
+    def lookup(self, tournament_id):
+        """  Return (version, players, opponents, tally) for pairPlayers, with
+             players None on a miss.  They are copies taken under the lock,
+             so results committed while pairing do not change them. """
+
+        with self.lock:
+            version = self._version(tournament_id)
+            brackets = self.entries.pop(tournament_id, None)
+
+            if brackets is None:
+                return version, None, None, None
+
+            self.entries[tournament_id] = brackets
+
+            return (version, brackets.players(), dict(brackets.opponents),
+                    brackets.tally())
+
+    def store(self, tournament_id, version, brackets):
+        """  Keep brackets read at version, unless they are out of date. """
+
+        with self.lock:
+            if version != self._version(tournament_id):
+                return
+
+            self.entries.pop(tournament_id, None)
+            self.entries[tournament_id] = brackets
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def apply(self, recorded):
+        """  Apply committed results.
+
+        Args:
+          recorded: dict of tournament id to (round_id, winner, loser) lists
+        """
+
+        with self.lock:
+            for tournament_id in recorded:
+                self._bump(tournament_id)
+
+                brackets = self.entries.get(tournament_id)
+
+                if brackets is None:
+                    continue
+
+                for (round_id, winner, loser) in recorded[tournament_id]:
+                    brackets.record(round_id, winner, loser)
+
+    def invalidate(self, tournament_ids):
+        """  Drop the brackets of each tournament.  A tournament_id of None
+             drops every tournament's. """
+
+        with self.lock:
+            for tournament_id in tournament_ids:
+                if tournament_id is None:
+                    self.epoch += 1
+                    self.entries.clear()
+                else:
+                    self._bump(tournament_id)
+                    self.entries.pop(tournament_id, None)
+
+    def clear(self):
+        """  Drop every entry. """
+
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+
+
+_bracketIndex = _BracketIndex(BRACKET_INDEX_SIZE)
+
+
+def clearBracketIndex():
+    """  Empty the bracket index. """
+
+    _bracketIndex.clear()
+
+
+class TournamentSession(object):
+    """  A unit of work: one pooled connection and one transaction.
+
+    Every tournament operation is available as a method.  Nothing is
+    committed until the caller says so, so a group of operations (such as a
+    whole round) costs a single commit and is rolled back as a whole if any
+    part of it fails.
+
+        with TournamentSession() as session:
+            pairings = session.swissPairings(tournament_id)
+            ...
+            session.completeRound(tournament_id)
+
+    Leaving the with block commits, or rolls back if the block raised.
+    commit() and rollback() may also be called explicitly; the next
+    operation then starts a new transaction on the same connection.
+    """
+
+    def __init__(self):
+        self.pool = _getPool()
+        self.conn = self.pool.getconn()
+        self.c = instrumentCursor(self.conn.cursor())
+
+        #  Tournaments whose standings this transaction has changed (None
+        #  for all of them).  Their cached standings are invalidated on
+        #  commit.
+        self.touched = set()
+
+        self._clearBracketChanges()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self.close()
+
+        return False
+
+    def commit(self):
+        """  Commit the current transaction. """
+
+        self.conn.commit()
+
+        touched, self.touched = self.touched, set()
+        (rebracketed, recorded) = (self.rebracketed, self.recorded)
+        self._clearBracketChanges()
+
+        _standingsCache.invalidate(touched)
+        _bracketIndex.invalidate(rebracketed)
+        _bracketIndex.apply(recorded)
+
+    def rollback(self):
+        """  Roll back the current transaction. """
+
+        self.touched = set()
+        self._clearBracketChanges()
+
+        if not self.conn.closed:
+            self.conn.rollback()
+
+    def _clearBracketChanges(self):
+        #  Results recorded by this transaction, by tournament, and the
+        #  tournaments whose brackets it has changed in any other way (None
+        #  for all of them).  The bracket index is brought up to date with
+        #  them on commit.
+        self.recorded = collections.defaultdict(list)
+        self.rebracketed = set()
+
+    def close(self):
+        """  Return the connection to the pool.  Uncommitted work is lost. """
+
+        if self.conn is not None:
+            self.pool.putconn(self.conn)
+            self.conn = None
+            self.c = None
+
+    def deletePlayers(self):
+        """  See deletePlayers. """
+
+        self.touched.add(None)
+        self.rebracketed.add(None)
+
+        self.c.execute("""DELETE FROM player;""")
+
+    def countPlayers(self):
+        """  See countPlayers. """
+
+        self.c.execute("""SELECT count(*) FROM player;""")
+
+        return self.c.fetchone()[0]
+
+    def registerPlayer(self, name):
+        """  See registerPlayer. """
+
+        self.c.execute("""INSERT INTO player (name) VALUES ( %s );""",
+                       (name,))
+
+    def registerPlayers(self, names, batch_size=REGISTER_BATCH_SIZE):
+        """  See registerPlayers. """
+
+        names = iter(names)
+
+        player_ids = []
+
+        while True:
+            batch = list(itertools.islice(names, batch_size))
+
+            if not batch:
+                break
+
+            #  Reserve the ids up front so the rows can be streamed with
+            #  COPY (which cannot return them) and handed back in order
+            self.c.execute("""SELECT nextval('player_id_seq')
+                                FROM generate_series(1, %s);""",
+                           (len(batch),))
+
+            batch_ids = [row[0] for row in self.c.fetchall()]
+
+            rows = BytesIO()
+
+            for player_id, name in zip(batch_ids, batch):
+                rows.write(b"%d\t%s\n" % (player_id, _copyText(name)))
+
+            rows.seek(0)
+
+            self.c.copy_from(rows, "player", columns=("id", "name"))
+
+            player_ids.extend(batch_ids)
+
+        return player_ids
+
+    def createTournament(self, name, num_players):
+        """  See createTournament. """
+
+        if num_players % 2 != 0:
+            print ("System Error: Odd number of players not allowed")
+            print ("Terminating Program")
+
+            sys.exit(1)
+
+        #  calculate the number of tournament rounds based on number of
+        #  players
+        rounds = numberOfRounds(num_players)
+
+        #  If a tournament with the same name exists then do not create the
+        #  tournament and about the program
+        try:
+
+            self.c.execute("""INSERT INTO tournament
+                              (name, num_players, num_rounds)
+                              VALUES ( %s , %s, %s ) RETURNING id;""",
+                           (name, num_players, rounds,))
+
+            tournament_id = self.c.fetchone()[0]
+
+            for x in range(1, rounds + 1):
+                self.c.execute("""INSERT INTO tournament_round
+                                  (id, tournament_id, status)
+                                  VALUES ( %s, %s, %s );""",
+                               (x, tournament_id, "READY",))
+
+            self.c.execute("""SELECT create_tournament_partitions( %s );""",
+                           (tournament_id,))
+
+        except psycopg2.IntegrityError, e:
+            self.rollback()
+
+            print ("System Error: Tournament with name - " +
+                   name + " - already exists")
+            print ("Terminating Program")
+
+            sys.exit(1)
+
+        return tournament_id
+
+    def setupTournament(self, tournament_id, strategy="id", seed=None,
+                        num_players=None):
+        """  See setupTournament.  num_players saves looking it up. """
+
+        if strategy not in SETUP_STRATEGIES:
+            raise ValueError("Unknown setup strategy: %s" % strategy)
+
+        self.touched.add(tournament_id)
+        self.rebracketed.add(tournament_id)
+
+        self._runSteps(SETUP_STRATEGIES[strategy](tournament_id, num_players,
+                                                  seed))
+
+    def getNumberOfPlayers(self, tournament_id):
+        """  See getNumberOfPlayers. """
+
+        self.c.execute("""SELECT num_players FROM tournament
+                          WHERE id = ( %s )""", (tournament_id,))
+
+        return self.c.fetchone()[0]
+
+    def deleteTournaments(self):
+        """  See deleteTournaments. """
+
+        self.touched.add(None)
+        self.rebracketed.add(None)
+
+        self._runSteps(_deleteTournamentsSteps())
+
+    def deleteMatches(self, tournament_id):
+        """  See deleteMatches. """
+
+        #  A tournament that does not exist has no partitions to empty
+        self.c.execute("""SELECT 1 FROM tournament WHERE id = ( %s );""",
+                       (tournament_id,))
+
+        if self.c.fetchone() is None:
+            return
+
+        self.touched.add(tournament_id)
+        self.rebracketed.add(tournament_id)
+
+        for (sql, params) in _deleteMatchesStatements(tournament_id):
+            self.c.execute(sql, params)
+
+    def getPlayersForTournament(self, num_players):
+        """  See getPlayersForTournament. """
+
+        self.c.execute("""SELECT id FROM player
+                        ORDER BY id LIMIT ( %s ) ;""",
+                       (num_players,))
+
+        return self.c.fetchall()
+
+    def playerStandings(self, tournament_id):
+        """  See playerStandings. """
+
+        #  Standings this transaction has changed are not committed yet, so
+        #  they are neither served from nor stored in the cache
+        if tournament_id in self.touched or None in self.touched:
+            return self._readStandings(tournament_id)
+
+        version, standings = _standingsCache.lookup(tournament_id)
+
+        if standings is None:
+            standings = self._readStandings(tournament_id)
+
+            _standingsCache.store(tournament_id, version, standings)
+
+        return list(standings)
+
+    def _readStandings(self, tournament_id):
+        """  Read a tournament's standings from the database. """
+
+        self.c.execute(_STANDINGS_SQL, (tournament_id,))
+
+        return self.c.fetchall()
+
+    def iterPlayerStandings(self, tournament_id,
+                            batch_size=STREAM_BATCH_SIZE):
+        """  See iterPlayerStandings. """
+
+        return self._stream(_STANDINGS_SQL, (tournament_id,), batch_size)
+
+    def iterSwissPairings(self, tournament_id, batch_size=STREAM_BATCH_SIZE):
+        """  See iterSwissPairings. """
+
+        opponents = self.getOpponents(tournament_id)
+
+        return pairPlayers(
+            self._stream(_PAIRING_SQL, {"tournament_id": tournament_id},
+                         batch_size),
+            opponents)
+
+    def _stream(self, sql, params, batch_size):
+        """  Yield the rows of a query through a named (server-side) cursor,
+             fetching batch_size rows at a time. """
+
+        cursor = instrumentCursor(
+            self.conn.cursor("tournament_stream_%d" % next(_cursorNames)))
+        cursor.itersize = batch_size
+
+        try:
+            cursor.execute(sql, params)
+
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+    def runMatch(self, tournament_id, player1, player2, round_id=None,
+                 seed=None):
+        """  See runMatch.  round_id saves looking up the current round. """
+
+        #  Imported here so that only simulating matches needs NumPy
+        from tournament_simulation import MatchSimulator
+
+        if round_id is None:
+            round_id = self.getCurrentRound(tournament_id)
+
+        if seed is None:
+            simulator = MatchSimulator()
+        else:
+            simulator = MatchSimulator(seed, tournament_id, round_id,
+                                       min(player1, player2))
+
+        self.reportMatch(tournament_id, round_id,
+                         *simulator.simulateMatch(player1, player2))
+
+    def reportMatch(self, tournament_id, round_id, winner, winner_score,
+                    loser, loser_score):
+        """  See reportMatch. """
+
+        self._recordResults(tournament_id, round_id,
+                            [(winner, winner_score, loser, loser_score)])
+
+    def reportRound(self, tournament_id, round_id, results):
+        """  See reportRound. """
+
+        #  Lock the round for completion before recording, so the round is
+        #  always locked before the players (as reportMatch locks them) and
+        #  concurrent reports queue behind this one rather than deadlock
+        self.c.execute(*_lockRoundStatement(tournament_id, round_id))
+
+        self._recordResults(tournament_id, round_id, results)
+
+        for (sql, params) in _completeStatements(tournament_id, round_id):
+            self.c.execute(sql, params)
+
+    def _recordResults(self, tournament_id, round_id, results):
+        """  Record a batch of (winner, winner_score, loser, loser_score)
+             results with a constant number of statements, whatever the
+             size of the batch (see _recordSteps). """
+
+        self.touched.add(tournament_id)
+
+        results = list(results)
+        steps = _recordSteps(tournament_id, round_id, results)
+        rows = None
+
+        while True:
+            try:
+                (statement, params) = steps.send(rows)
+            except StopIteration:
+                break
+
+            self._execute(statement, params)
+
+            if self.c.description is not None:
+                rows = self.c.fetchall()
+            else:
+                rows = None
+
+        self.recorded[tournament_id].extend(
+            (round_id, result[0], result[2]) for result in results)
+
+    def _execute(self, statement, params):
+        """  Run a _PreparedStatement, preparing it on this connection
+             first if it has not been yet. """
+
+        if not PREPARED_STATEMENTS:
+            self.c.execute(statement.sql, params)
+            return
+
+        backend = self.conn.get_backend_pid()
+        prepared = _prepared.get(id(self.conn))
+
+        if prepared is None or prepared[0] != backend:
+            prepared = _prepared[id(self.conn)] = (backend, set())
+
+        if statement.name not in prepared[1]:
+            self.c.execute(statement.prepare)
+            prepared[1].add(statement.name)
+
+        self.c.execute(statement.execute, params)
+
+    def _runSteps(self, steps):
+        """  Run the (sql, params) statements a steps generator yields.  It
+             is sent the rows of each, or the row count of a statement that
+             returns none, as tournament_async operations are. """
+
+        result = None
+
+        while True:
+            try:
+                (sql, params) = steps.send(result)
+            except StopIteration:
+                return
+
+            self.c.execute(sql, params)
+
+            if self.c.description is not None:
+                result = self.c.fetchall()
+            else:
+                result = self.c.rowcount
+
+    def getCurrentRound(self, tournament_id):
+        """  See getCurrentRound. """
+
+        self._execute(_CURRENT_ROUND, {"tournament_id": tournament_id})
+
+        return self.c.fetchone()[0]
+
+    def getTournament(self, tournament_id):
+        """  See getTournament. """
+
+        self.c.execute("""SELECT tournament.id, tournament.name,
+                                 tournament.num_players, tournament.num_rounds,
+                                 (SELECT tournament_round.id
+                                    FROM tournament_round
+                                   WHERE tournament_round.tournament_id =
+                                             tournament.id
+                                     AND status = 'READY'
+                                ORDER BY tournament_round.id
+                                   LIMIT 1)
+                            FROM tournament
+                           WHERE tournament.id = ( %s );""",
+                       (tournament_id,))
+
+        row = self.c.fetchone()
+
+        if row is None:
+            return None
+
+        return Tournament(*row)
+
+    def getNumberOfRounds(self, tournament_id):
+        """  See getNumberOfRounds. """
+
+        self.c.execute("""SELECT num_rounds FROM tournament
+                           WHERE id = ( %s );""",
+                       (tournament_id,))
+
+        return self.c.fetchone()[0]
+
+    def completeRound(self, tournament_id, round_id=None):
+        """  See completeRound.  round_id saves looking up the current
+             round. """
+
+        self.touched.add(tournament_id)
+
+        if round_id is None:
+            round_id = self.getCurrentRound(tournament_id)
+
+        for (sql, params) in _completeStatements(tournament_id, round_id):
+            self.c.execute(sql, params)
+
+    def standingsAsOf(self, tournament_id, round_id):
+        """  See standingsAsOf. """
+
+        records = self._replay(tournament_id, round_id)
+
+        self.c.execute("""SELECT player.id, player.name
+                            FROM player, player_tournament_register
+                           WHERE player.id =
+                                     player_tournament_register.player_id
+                             AND player_tournament_register.tournament_id =
+                                     ( %s );""",
+                       (tournament_id,))
+
+        standings = [(player_id, name, records[player_id][1],
+                      records[player_id][0])
+                     for (player_id, name) in self.c.fetchall()]
+
+        standings.sort(key=lambda player: (-player[2],
+                                           -records[player[0]][3],
+                                           player[0]))
+
+        return standings
+
+    def undoRound(self, tournament_id, round_id=None):
+        """  See undoRound. """
+
+        self.touched.add(tournament_id)
+        self.rebracketed.add(tournament_id)
+
+        if round_id is None:
+            self.c.execute("""SELECT max(id) FROM tournament_round
+                               WHERE tournament_id = ( %s )
+                                 AND (status = 'COMPLETE'
+                                      OR EXISTS
+                                         (SELECT 1 FROM match_result
+                                           WHERE match_result.tournament_id =
+                                                     tournament_round
+                                                         .tournament_id
+                                             AND match_result.round_id =
+                                                     tournament_round.id));""",
+                           (tournament_id,))
+
+            round_id = self.c.fetchone()[0]
+
+            if round_id is None:
+                return None
+
+        records = self._replay(tournament_id, round_id - 1)
+
+        self.c.execute("""DELETE FROM match_result
+                           WHERE tournament_id = ( %s )
+                             AND round_id >= ( %s );""",
+                       (tournament_id, round_id,))
+
+        self.c.execute("""DELETE FROM round_standings
+                           WHERE tournament_id = ( %s )
+                             AND round_id >= ( %s );""",
+                       (tournament_id, round_id,))
+
+        self.c.execute("""UPDATE tournament_round
+                             SET status = %s
+                           WHERE tournament_id = ( %s ) AND id >= ( %s );""",
+                       ("READY", tournament_id, round_id,))
+
+        self._writeRecords(tournament_id, records)
+
+        return round_id
+
+    def rebuildStandings(self, tournament_id):
+        """  See rebuildStandings. """
+
+        self.touched.add(tournament_id)
+
+        #  The last round with matches or a snapshot
+        self.c.execute("""SELECT greatest(
+                                 (SELECT max(round_id) FROM match_result
+                                   WHERE tournament_id = ( %s )),
+                                 (SELECT max(round_id) FROM round_standings
+                                   WHERE tournament_id = ( %s )));""",
+                       (tournament_id, tournament_id,))
+
+        round_id = self.c.fetchone()[0] or 0
+
+        self._writeRecords(tournament_id,
+                           self._replay(tournament_id, round_id))
+
+    def _replay(self, tournament_id, round_id):
+        """  Return every player's record as of the end of round_id: the
+             nearest snapshot at or before round_id with the matches played
+             since replayed on top.
+
+        Returns:
+          A dict mapping each player ID to a [matches, wins, losses,
+          opponent_wins] list
+        """
+
+        self.c.execute("""SELECT coalesce(max(round_id), 0)
+                            FROM round_standings
+                           WHERE tournament_id = ( %s )
+                             AND round_id <= ( %s );""",
+                       (tournament_id, round_id,))
+
+        snapshot = self.c.fetchone()[0]
+
+        if snapshot:
+            self.c.execute("""SELECT player_id, player_matches, player_wins,
+                                     player_losses, opponent_wins
+                                FROM round_standings
+                               WHERE tournament_id = ( %s )
+                                 AND round_id = ( %s );""",
+                           (tournament_id, snapshot,))
+        else:
+            self.c.execute("""SELECT player_id, 0, 0, 0, 0
+                                FROM player_tournament_register
+                               WHERE tournament_id = ( %s );""",
+                           (tournament_id,))
+
+        records = dict((row[0], list(row[1:])) for row in self.c.fetchall())
+        snapshotWins = dict((player_id, record[1])
+                            for (player_id, record) in records.items())
+
+        self.c.execute("""SELECT winner_id, loser_id
+                            FROM match_result
+                           WHERE tournament_id = ( %s )
+                             AND round_id > ( %s ) AND round_id <= ( %s );""",
+                       (tournament_id, snapshot, round_id,))
+
+        matches = self.c.fetchall()
+
+        for (winner, loser) in matches:
+            records[winner][0] += 1
+            records[winner][1] += 1
+            records[loser][0] += 1
+            records[loser][2] += 1
+
+        #  Wins gained since the snapshot also count for every earlier
+        #  opponent of the winner.  Only those players' earlier matches are
+        #  read.
+        gained = dict((player_id, record[1] - snapshotWins[player_id])
+                      for (player_id, record) in records.items()
+                      if record[1] != snapshotWins[player_id])
+
+        if snapshot and gained:
+            self.c.execute("""SELECT winner_id, loser_id
+                                FROM match_result
+                               WHERE tournament_id = %(tournament_id)s
+                                 AND round_id <= %(round_id)s
+                                 AND (winner_id = ANY(%(players)s)
+                                      OR loser_id = ANY(%(players)s));""",
+                           {"tournament_id": tournament_id,
+                            "round_id": snapshot,
+                            "players": list(gained)})
+
+            for (winner, loser) in self.c.fetchall():
+                records[winner][3] += gained.get(loser, 0)
+                records[loser][3] += gained.get(winner, 0)
+
+        #  Opponents met since the snapshot count with all their wins
+        for (winner, loser) in matches:
+            records[winner][3] += records[loser][1]
+            records[loser][3] += records[winner][1]
+
+        return records
+
+    def _writeRecords(self, tournament_id, records):
+        """  Overwrite the register records of a tournament's players with
+             records, as returned by _replay. """
+
+        records = records.items()
+
+        self.c.execute("""UPDATE player_tournament_register
+                             SET player_matches = record.matches,
+                                 player_wins = record.wins,
+                                 player_losses = record.losses,
+                                 opponent_wins = record.opponent_wins
+                            FROM (SELECT unnest(%(players)s::int[])
+                                             AS player_id,
+                                         unnest(%(matches)s::int[]) AS matches,
+                                         unnest(%(wins)s::int[]) AS wins,
+                                         unnest(%(losses)s::int[]) AS losses,
+                                         unnest(%(opponent_wins)s::int[])
+                                             AS opponent_wins) AS record
+                           WHERE player_tournament_register.player_id =
+                                     record.player_id
+                             AND player_tournament_register.tournament_id =
+                                     %(tournament_id)s;""",
+                       {"tournament_id": tournament_id,
+                        "players": [player_id for (player_id, r) in records],
+                        "matches": [r[0] for (player_id, r) in records],
+                        "wins": [r[1] for (player_id, r) in records],
+                        "losses": [r[2] for (player_id, r) in records],
+                        "opponent_wins": [r[3] for (player_id, r) in records]})
+
+    def swissPairings(self, tournament_id, rng=random):
+        """  See swissPairings.  rng shuffles the score brackets (see
+             tournament_engine.pairPlayers). """
+
+        #  Players are paired within their score bracket, in random order,
+        #  avoiding rematches (see tournament_engine.pairPlayers).  Results
+        #  this transaction has recorded are not in the bracket index yet,
+        #  so then the brackets and the opponent history are read from the
+        #  database.
+        if tournament_id in self.touched or None in self.touched:
+            self._execute(_PAIRING, {"tournament_id": tournament_id})
+
+            return list(pairPlayers(self.c.fetchall(),
+                                    self.getOpponents(tournament_id), rng))
+
+        version, players, opponents, tally = \
+            _bracketIndex.lookup(tournament_id)
+
+        #  Other processes' changes are not applied to the index, so indexed
+        #  brackets are used only if they tally with the database
+        if players is not None:
+            self._execute(_BRACKET_TALLY, {"tournament_id": tournament_id})
+
+            if tuple(self.c.fetchone()) != tally:
+                players = None
+
+        if players is None:
+            brackets = self._readBrackets(tournament_id)
+            (players, opponents) = (brackets.players(),
+                                    dict(brackets.opponents))
+
+            _bracketIndex.store(tournament_id, version, brackets)
+
+        return list(pairPlayers(players, opponents, rng))
+
+    def _readBrackets(self, tournament_id):
+        """  Read a tournament's score brackets from the database. """
+
+        self.c.execute("""SELECT player.id, player.name
+                            FROM player, player_tournament_register
+                           WHERE player.id =
+                                     player_tournament_register.player_id
+                             AND player_tournament_register.tournament_id =
+                                     ( %s );""",
+                       (tournament_id,))
+
+        players = self.c.fetchall()
+
+        self.c.execute("""SELECT round_id, winner_id, loser_id
+                            FROM match_result
+                           WHERE tournament_id = ( %s );""",
+                       (tournament_id,))
+
+        return _Brackets(players, self.c.fetchall())
+
+    def getOpponents(self, tournament_id):
+        """  See getOpponents. """
+
+        self.c.execute("""SELECT winner_id, loser_id
+                            FROM match_result
+                           WHERE tournament_id = ( %s );""",
+                       (tournament_id,))
+
+        opponents = {}
+
+        for (winner_id, loser_id) in self.c:
+            opponents.setdefault(winner_id, set()).add(loser_id)
+            opponents.setdefault(loser_id, set()).add(winner_id)
+
+        return opponents
+
+
+class Tournament(object):
+    """  A handle on one tournament that holds its fixed details and current
+         round, so operations on it need not look them up again.
+
+    Get one with getTournament(tournament_id).  The handle moves on to the
+    next round when a round is completed through it (reportRound or
+    completeRound); call refresh() if rounds are completed elsewhere.
+
+        tournament = getTournament(tournament_id)
+        tournament.setup()
+        for (id1, name1, id2, name2) in tournament.swissPairings():
+            tournament.runMatch(id1, id2)
+        tournament.completeRound()
+
+    Attributes:
+      id: the tournament's unique id
+      name: the tournament's name
+      num_players: number of players in the tournament
+      num_rounds: number of rounds in the tournament
+      current_round: id of the round being played, or None once every
+                     round is complete
+    """
+
+    __slots__ = ("id", "name", "num_players", "num_rounds", "current_round")
+
+    def __init__(self, id, name, num_players, num_rounds, current_round):
+        self.id = id
+        self.name = name
+        self.num_players = num_players
+        self.num_rounds = num_rounds
+        self.current_round = current_round
 
+    def __repr__(self):
+        return "Tournament(%r, %r, %r, %r, %r)" % (
+            self.id, self.name, self.num_players, self.num_rounds,
+            self.current_round)
 
-def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection.
-       or exit the program if a connection cannot be established."""
+    def advance(self):
+        """  Move on from the current round, which has been completed.
+             Rounds are numbered 1..num_rounds and played in order. """
 
-    conn = None
+        if self.current_round is not None:
+            if self.current_round < self.num_rounds:
+                self.current_round += 1
+            else:
+                self.current_round = None
 
-    try:
-        conn = psycopg2.connect("dbname=tournament")
-    except psycopg2.DatabaseError, e:
+    def _playing(self):
+        """  Return the current round.
 
-        print ("System Error: " + str(e))
-        print ("Terminating Program")
+        Raises:
+          ValueError: every round is complete
+        """
 
-        sys.exit(1)
+        if self.current_round is None:
+            raise ValueError("Tournament %s is finished" % self.id)
 
-    return conn
+        return self.current_round
 
+    def refresh(self):
+        """  Reload the current round from the database. """
 
-def deletePlayers():
-    """Remove all the player records from the database."""
+        with TournamentSession() as session:
+            self.current_round = session.getTournament(self.id).current_round
+
+    def setup(self, strategy="id", seed=None):
+        """  See setupTournament. """
+
+        with TournamentSession() as session:
+            session.setupTournament(self.id, strategy, seed,
+                                    self.num_players)
+
+    def playerStandings(self):
+        """  See playerStandings. """
+
+        return playerStandings(self.id)
+
+    def swissPairings(self):
+        """  See swissPairings. """
 
-    conn = connect()
+        return swissPairings(self.id)
 
-    c = conn.cursor()
+    def runMatch(self, player1, player2, seed=None):
+        """  See runMatch.  The match is played in the current round. """
 
-    c.execute("""DELETE FROM player;""")
+        _retry(TournamentSession.runMatch, self.id, player1, player2,
+               self._playing(), seed)
 
-    conn.commit()
+    def reportMatch(self, winner, winner_score, loser, loser_score):
+        """  See reportMatch.  The match is recorded in the current round. """
 
-    conn.close()
+        _retry(TournamentSession.reportMatch, self.id, self._playing(),
+               winner, winner_score, loser, loser_score)
 
+    def reportRound(self, results):
+        """  See reportRound.  Records and completes the current round. """
 
+        _retry(TournamentSession.reportRound, self.id, self._playing(),
+               list(results))
+
+        self.advance()
+
+    def completeRound(self):
+        """  See completeRound. """
+
+        _retry(TournamentSession.completeRound, self.id, self._playing())
+
+        self.advance()
+
+    def undoRound(self):
+        """  See undoRound.  The handle goes back to the round undone. """
+
+        with TournamentSession() as session:
+            round_id = session.undoRound(self.id)
+
+        if round_id is not None:
+            self.current_round = round_id
+
+
+@instrumented
+def deletePlayers():
+    """Remove all the player records from the database."""
+
+    with TournamentSession() as session:
+        session.deletePlayers()
+
+
+@instrumented
 def countPlayers():
     """Count and return the number of players currently registered.
 
@@ -57,19 +1614,13 @@ def countPlayers():
       totalPlayers: number of players registered in the system.
     """
 
-    conn = connect()
-
-    c = conn.cursor()
-
-    c.execute("""SELECT count(*) FROM player;""")
-
-    totalPlayers = c.fetchone()[0]
-
-    conn.close()
+    with TournamentSession() as session:
+        totalPlayers = session.countPlayers()
 
     return totalPlayers
 
 
+@instrumented
 def registerPlayer(name):
     """Adds a player to the tournament database.
 
@@ -80,111 +1631,404 @@ def registerPlayer(name):
       name: the player's full name (need not be unique).
     """
 
-    conn = connect()
+    with TournamentSession() as session:
+        session.registerPlayer(name)
 
-    c = conn.cursor()
 
-    c.execute("""INSERT INTO player (name) VALUES ( %s );""", (name,))
+@instrumented
+def registerPlayers(names, batch_size=REGISTER_BATCH_SIZE):
+    """Adds many players to the tournament database in one transaction.
 
-    conn.commit()
+    Names are streamed to the database with COPY in batches of batch_size,
+    so names may be any iterable (including a generator) and the whole
+    roster never has to be held in memory.
 
-    conn.close()
+    Args:
+      names: iterable of the players' full names
+      batch_size: number of names sent to the database at a time
 
+    Returns:
+      player_ids: list of the ids assigned to the players, in the same
+                  order as names
+    """
 
-def createTournament(name, num_players):
-    """Create a tournament in the tournament database.
+    with TournamentSession() as session:
+        player_ids = session.registerPlayers(names, batch_size)
 
-    This includes a record of the tournament and a record for each round
-    of the tournament.
+    return player_ids
 
-    The database assigns a unique serial id number for the tournament.  (This
-    should be handled by your SQL database schema, not in your Python code.)
 
-    Restriction: Odd number of players is not allowed
+def _retry(work, *args):
+    """  Run work(session, *args) in a TournamentSession and return its
+         result.  The whole transaction is run again, after a short random
+         delay, if it fails with a serialization failure or a deadlock
+         (SQLSTATE 40001 or 40P01), up to TRANSACTION_RETRIES times. """
 
-    Args:
-      name: name of the tournament(should be unique).
-      num_players:  number of players in the tournament.
+    for attempt in range(1, TRANSACTION_RETRIES + 1):
+        try:
+            with TournamentSession() as session:
+                return work(session, *args)
+        except psycopg2.extensions.TransactionRollbackError:
+            if attempt == TRANSACTION_RETRIES:
+                raise
 
-    Returns:
-      tournament_id: ID of the newly created tournament
+        time.sleep(random.uniform(0, TRANSACTION_RETRY_DELAY *
+                                  2 ** (attempt - 1)))
+
+
+def _recordSteps(tournament_id, round_id, results):
+    """  Generator of the (_PreparedStatement, params) steps that record a
+         batch of (winner, winner_score, loser, loser_score) results.  It
+         is sent the rows each step returns (or None).
+
+    Recording is idempotent: a match already recorded for the same pairing
+    (the same two players in the round) is skipped, so a result reported
+    twice, or by two scorekeepers at once, counts once.  A result that
+    differs from the one recorded raises ValueError, and so does a new
+    result for a round that is not being played (complete, or not in the
+    tournament).  The round is locked first (see _LOCK_ROUND), so it cannot
+    be completed until the results recorded with it are committed.
+
+    The statement text never changes: each batch is passed as arrays, so the
+    statements can be prepared and serve tournament_async as well.
+
+    Raises:
+      ValueError: a result conflicts with one already recorded, or its
+                  round is not READY
     """
 
-    if num_players % 2 != 0:
-        print ("System Error: Odd number of players not allowed")
-        print ("Terminating Program")
+    #  Matches go in in pairing order, so that concurrent reports of the
+    #  same matches wait on each other in the same order
+    results = sorted(set(tuple(result) for result in results),
+                     key=lambda result: (min(result[0], result[2]), result))
 
-        sys.exit(1)
+    if not results:
+        return
 
-    #  calculate the number of tournament rounds based on number of players
-    rounds = int(math.ceil(math.log(num_players, 2)))
+    (winners, winner_scores, losers, loser_scores) = zip(*results)
 
-    conn = None
+    params = {"tournament_id": tournament_id,
+              "round_id": round_id,
+              "match_winners": list(winners),
+              "winner_scores": list(winner_scores),
+              "losers": list(losers),
+              "loser_scores": list(loser_scores)}
 
-    #  If a tournament with the same name exists then do not create the
-    #  tournament and about the program
-    try:
+    #  Nothing is recorded for a round that is not being played, but
+    #  results already recorded for it are still accepted as repeats
+    ready = (yield (_LOCK_ROUND, params))
 
-        conn = connect()
+    if ready:
+        recorded = set((yield (_RECORD_MATCHES, params)))
+    else:
+        recorded = set()
 
-        c = conn.cursor()
+    skipped = [result for result in results
+               if (result[0], result[2]) not in recorded]
 
-        c.execute("""INSERT INTO tournament (name, num_players, num_rounds)
-                     VALUES ( %s , %s, %s ) RETURNING id;""",
-                  (name, num_players, rounds,))
+    if skipped:
+        params["pairings"] = [min(result[0], result[2])
+                              for result in skipped]
 
-        tournament_id = c.fetchone()[0]
+        reported = set((yield (_REPORTED_MATCHES, params)))
 
-        for x in range(1, rounds + 1):
-            c.execute("""INSERT INTO tournament_round
-                      (id, tournament_id, status) VALUES ( %s, %s, %s );""",
-                      (x, tournament_id, "READY",))
+        unreported = [result for result in skipped if result not in reported]
 
-        conn.commit()
+        if unreported:
+            if not ready:
+                raise ValueError("Round %s of tournament %s is not being "
+                                 "played" % (round_id, tournament_id))
 
-    except psycopg2.IntegrityError, e:
-        if conn:
-            conn.rollback()
+            raise ValueError("Result %r conflicts with a match already "
+                             "reported in round %s of tournament %s" %
+                             (unreported[0], round_id, tournament_id))
 
-        print ("System Error: Tournament with name - " +
-               name + " - already exists")
-        print ("Terminating Program")
+    if not recorded:
+        return
 
-        sys.exit(1)
-    finally:
-        if conn:
-            conn.close()
+    #  Tally (matches, wins, losses) for each player in the matches recorded
+    counters = {}
+
+    for (winner, loser) in recorded:
+        for player, won in ((winner, 1), (loser, 0)):
+            tally = counters.setdefault(player, [0, 0, 0])
+            tally[0] += 1
+            tally[1] += won
+            tally[2] += 1 - won
+
+    tallies = sorted(counters.items())
+
+    params["tallied"] = [player for player, tally in tallies]
+    params["matches"] = [tally[0] for player, tally in tallies]
+    params["wins"] = [tally[1] for player, tally in tallies]
+    params["losses"] = [tally[2] for player, tally in tallies]
+    params["winners"] = [player for player, tally in tallies if tally[1]]
+
+    yield (_LOCK_PLAYERS, params)
+    yield (_RECORD_COUNTERS, params)
+    yield (_RECORD_OPPONENT_WINS, params)
+
+
+def _setupById(tournament_id, num_players, seed):
+    """  Register the players with the lowest ids.  Reads the primary key
+         index in order and stops after the field is full. """
+
+    yield (_SETUP_BY_ID_SQL, {"tournament_id": tournament_id})
+
+
+def _setupRandom(tournament_id, num_players, seed):
+    """  Register a seeded random sample of players.
+
+    Scanning the whole player table would cost the same for any field size,
+    so a share of its pages is sampled with TABLESAMPLE SYSTEM (seeded with
+    REPEATABLE), sized from the planner's estimate of the number of players
+    with room to spare.  The sample is shuffled by a hash of each id and
+    the seed and cut to the field size.  If the sample falls short, which
+    happens only when the estimate is well out, the rest of the field comes
+    from the whole table.
+    """
+
+    if num_players is None:
+        rows = yield ("""SELECT num_players FROM tournament
+                          WHERE id = ( %s );""", (tournament_id,))
+
+        num_players = rows[0][0]
+
+    if seed is None:
+        seed = random.getrandbits(31)
+
+    rows = yield ("""SELECT reltuples FROM pg_class
+                      WHERE oid = 'player'::regclass;""", None)
+
+    estimate = rows[0][0]
+
+    if estimate > 0:
+        percent = min(100.0, 100.0 * SETUP_SAMPLE_MARGIN * num_players /
+                      estimate)
+    else:
+        percent = 100.0
+
+    params = {"tournament_id": tournament_id, "num_players": num_players,
+              "percent": percent, "seed": seed}
+
+    sampled = yield ("""INSERT INTO player_tournament_register
+                                    (player_id, tournament_id)
+                        SELECT sample.id, %(tournament_id)s
+                          FROM player AS sample
+                               TABLESAMPLE SYSTEM (%(percent)s)
+                               REPEATABLE (%(seed)s)
+                      ORDER BY md5(sample.id || ':' || %(seed)s), sample.id
+                         LIMIT %(num_players)s;""",
+                     params)
+
+    if sampled < num_players:
+        params["num_players"] = num_players - sampled
+
+        yield ("""INSERT INTO player_tournament_register
+                              (player_id, tournament_id)
+                  SELECT player.id, %(tournament_id)s
+                    FROM player
+                   WHERE NOT EXISTS
+                         (SELECT 1
+                            FROM player_tournament_register
+                           WHERE tournament_id = %(tournament_id)s
+                             AND player_id = player.id)
+                ORDER BY md5(player.id || ':' || %(seed)s), player.id
+                   LIMIT %(num_players)s;""",
+               params)
+
+
+#  Ways of choosing a tournament's players, by name (see setupTournament).
+#  Each is called as strategy(tournament_id, num_players, seed), where
+#  num_players may be None, and returns a generator of the (sql, params)
+#  statements that register the players with one INSERT ... SELECT (see
+#  TournamentSession._runSteps), so that tournament_async can run them too.
+SETUP_STRATEGIES = {
+    "id": _setupById,
+    "random": _setupRandom,
+}
+
+
+def _deleteTournamentsSteps():
+    """  Generator of the (sql, params) steps that remove every tournament
+         and everything recorded for it (see TournamentSession._runSteps). """
+
+    #  Drop every tournament's partitions.  Their matches, snapshots
+    #  and registered players go with them
+    rows = yield ("""SELECT inhrelid::regclass::text FROM pg_inherits
+                      WHERE inhparent = ANY( %s::regclass[] );""",
+                  (list(_PARTITIONED_TABLES),))
+
+    partitions = [row[0] for row in rows]
+
+    if partitions:
+        yield ("""DROP TABLE %s;""" % ", ".join(partitions), None)
+
+    #  Finally empty the tournament and round tables
+    yield ("""TRUNCATE %s, tournament_round, tournament;""" %
+           ", ".join(_PARTITIONED_TABLES), None)
+
+
+def _deleteMatchesStatements(tournament_id):
+    """  Return the (sql, params) statements that delete a tournament's
+         matches and reset its players and rounds.  The tournament must
+         exist, as its partitions are truncated by name. """
+
+    return [
+        #  Empty the tournament's match and snapshot partitions
+        ("""TRUNCATE %s, %s;""" % (_partition("match_result", tournament_id),
+                                   _partition("round_standings",
+                                              tournament_id)),
+         None),
+
+        #  Reset the player scores in the register.  The players stay
+        #  registered, so these are updated rather than truncated
+        ("""UPDATE player_tournament_register
+               SET player_matches = 0, player_wins = 0,
+                   player_losses = 0, opponent_wins = 0
+             WHERE player_tournament_register.tournament_id = ( %s );""",
+         (tournament_id,)),
+
+        #  Reset round status so we are ready to begin again
+        ("""UPDATE tournament_round
+               SET status = %s
+             WHERE tournament_round.tournament_id = ( %s );""",
+         ("READY", tournament_id,)),
+    ]
+
+
+def _partition(table, tournament_id):
+    """  Return the name of a tournament's partition of a table. """
+
+    return "%s_%d" % (table, tournament_id)
+
+
+def _lockRoundStatement(tournament_id, round_id):
+    """  Return the (sql, params) statement that locks a round for
+         completion.  It waits for the reports that hold the round (see
+         _LOCK_ROUND) to commit, and makes later reports wait in turn. """
+
+    return ("""SELECT 1 FROM tournament_round
+                WHERE tournament_id = %(tournament_id)s
+                  AND id = %(round_id)s
+                  FOR UPDATE;""",
+            {"tournament_id": tournament_id, "round_id": round_id})
+
+
+def _completeStatements(tournament_id, round_id):
+    """  Return the (sql, params) statements that complete a round, taking a
+         standings snapshot every SNAPSHOT_INTERVAL rounds.
+
+    The round is locked by a statement of its own first, so the reports in
+    flight are committed, and counted in the snapshot, before the
+    statements after it start.  Completing a round that is already
+    complete does nothing, so two scorekeepers completing the same round at
+    once complete it (and take its snapshot) once.
+    """
+
+    lock = _lockRoundStatement(tournament_id, round_id)
+    params = lock[1]
+
+    complete = """UPDATE tournament_round
+                     SET status = 'COMPLETE'
+                   WHERE tournament_id = %(tournament_id)s
+                     AND id = %(round_id)s
+                     AND status = 'READY'
+               RETURNING id"""
+
+    if round_id % SNAPSHOT_INTERVAL != 0:
+        return [lock, (complete + ";", params)]
+
+    return [lock,
+            ("""WITH completed AS (%s)
+                INSERT INTO round_standings
+                SELECT tournament_id, completed.id, player_id,
+                       player_matches, player_wins,
+                       player_losses, opponent_wins
+                  FROM player_tournament_register, completed
+                 WHERE tournament_id = %%(tournament_id)s;""" % complete,
+             params)]
+
+
+def _copyText(value):
+    """  Encode a value for PostgreSQL's COPY text format. """
+
+    if value is None:
+        return b"\\N"
+
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+
+    return (value.replace(b"\\", b"\\\\")
+                 .replace(b"\t", b"\\t")
+                 .replace(b"\n", b"\\n")
+                 .replace(b"\r", b"\\r"))
+
+
+@instrumented
+def createTournament(name, num_players):
+    """Create a tournament in the tournament database.
+
+    This includes a record of the tournament and a record for each round
+    of the tournament.
+
+    The database assigns a unique serial id number for the tournament.  (This
+    should be handled by your SQL database schema, not in your Python code.)
+
+    Restriction: Odd number of players is not allowed
+
+    Args:
+      name: name of the tournament(should be unique).
+      num_players:  number of players in the tournament.
+
+    Returns:
+      tournament_id: ID of the newly created tournament
+    """
+
+    with TournamentSession() as session:
+        tournament_id = session.createTournament(name, num_players)
 
     return tournament_id
 
 
-def setupTournament(tournament_id):
-    """  Assign players to a tournament based on the getPlayersForTournament
-         function.
+@instrumented
+def setupTournament(tournament_id, strategy="id", seed=None):
+    """  Register the tournament's number of players for a tournament.
+
+    The players are chosen and registered by a single INSERT ... SELECT,
+    whatever the size of the field.  strategy names the way they are chosen
+    (see SETUP_STRATEGIES):
+
+      id: the players with the lowest ids, as getPlayersForTournament
+      random: a random sample of players.  The same seed gives the same
+              sample of an unchanged player table.
 
     Args:
       tournament_id: ID of the tournament
-      num_players: number of players expected for this tournament
+      strategy: name of the selection strategy
+      seed: seed for the random strategy (default: a random seed)
     """
 
-    num_players = getNumberOfPlayers(tournament_id)
-
-    playerList = getPlayersForTournament(num_players)
+    with TournamentSession() as session:
+        session.setupTournament(tournament_id, strategy, seed)
 
-    conn = connect()
 
-    c = conn.cursor()
+@instrumented
+def getTournament(tournament_id):
+    """  Return a Tournament handle with the tournament's details and
+         current round, or None if there is no such tournament.
 
-    for player in playerList:
-        c.execute("""INSERT INTO player_tournament_register
-                     VALUES ( %s, %s );""",
-                  (player[0], tournament_id,))
+    Args:
+      tournament_id: ID of the tournament
+    """
 
-    conn.commit()
+    with TournamentSession() as session:
+        tournament = session.getTournament(tournament_id)
 
-    conn.close()
+    return tournament
 
 
+@instrumented
 def getNumberOfPlayers(tournament_id):
     """ Return the number of players for the tournament
 
@@ -196,47 +2040,22 @@ def getNumberOfPlayers(tournament_id):
                        tournment
     """
 
-    conn = connect()
-
-    c = conn.cursor()
-
-    c.execute("""SELECT num_players FROM tournament
-                 WHERE id = ( %s )""", (tournament_id,))
-
-    num_players = c.fetchone()[0]
-
-    conn.commit()
-
-    conn.close()
+    with TournamentSession() as session:
+        num_players = session.getNumberOfPlayers(tournament_id)
 
     return num_players
 
 
+@instrumented
 def deleteTournaments():
     """Remove all the tournament records (and tournament related records)
        from the database."""
 
-    conn = connect()
-
-    c = conn.cursor()
-
-    #  Delete ant tournament matches that have been played
-    c.execute("""DELETE FROM tournament_match;""")
-
-    #  Delete all the tournament round records created
-    c.execute("""DELETE FROM tournament_round;""")
-
-    #  Any players registered?  They are gone now
-    c.execute("""DELETE FROM player_tournament_register;""")
-
-    #  Finally delete the tournament
-    c.execute("""DELETE FROM tournament;""")
-
-    conn.commit()
-
-    conn.close()
+    with TournamentSession() as session:
+        session.deleteTournaments()
 
 
+@instrumented
 def deleteMatches(tournament_id):
     """ Delete all the matches played in a tournament to date.  Used
         if we wish to rerun the tournament.
@@ -246,32 +2065,11 @@ def deleteMatches(tournament_id):
                      deleted
     """
 
-    conn = connect()
-
-    c = conn.cursor()
-
-    #  Delete matches
-    c.execute("""DELETE FROM tournament_match WHERE tournament_id = ( %s );""",
-              (tournament_id,))
-
-    #  Reset the player scores in the register
-    c.execute("""UPDATE player_tournament_register
-                    SET player_matches = 0, player_wins = 0,
-                        player_losses = 0
-                  WHERE player_tournament_register.tournament_id = ( %s );""",
-              (tournament_id,))
-
-    #  Reset round status so we are ready to begin again
-    c.execute("""UPDATE tournament_round
-                    SET status = %s
-                  WHERE tournament_round.tournament_id = ( %s );""",
-              ("READY", tournament_id,))
-
-    conn.commit()
-
-    conn.close()
+    with TournamentSession() as session:
+        session.deleteMatches(tournament_id)
 
 
+@instrumented
 def getPlayersForTournament(num_players):
     """  Return a list of players for a tournament.  Currently returns the
          first player records in 'id' order.  Change this function if you
@@ -283,42 +2081,118 @@ def getPlayersForTournament(num_players):
     Returns:
       playerList: List of player IDs
     """
-    conn = connect()
-
-    c = conn.cursor()
-
-    c.execute("""SELECT id FROM player LIMIT ( %s ) ;""", (num_players,))
-
-    playerList = c.fetchall()
 
-    conn.commit()
-
-    conn.close()
+    with TournamentSession() as session:
+        playerList = session.getPlayersForTournament(num_players)
 
     return playerList
 
 
-def runTournament(tournament_id):
+@instrumented
+def runTournament(tournament_id, seed=None):
     """  Run the tournament.  For each round we will pair up players and
          run the matches.  Once complete the round will be completed.
 
+         Each round runs in a single transaction and its results are
+         reported together (see reportRound), so a round that fails part
+         way through leaves no partial results behind.  All the scores of a
+         round are drawn at once (see tournament_simulation.MatchSimulator).
+
     Args:
       tournament_id: ID of the tournament to run
+      seed: seed for the simulation.  The same tournament run again from
+            the start with the same seed is paired and scored identically.
     """
 
-    num_rounds = getNumberOfRounds(tournament_id)
+    #  Imported here so that only simulating tournaments needs NumPy
+    from tournament_simulation import MatchSimulator
+
+    simulator = MatchSimulator(seed, tournament_id)
+
+    #  The handle keeps track of the current round, so it is looked up
+    #  once rather than every round
+    tournament = getTournament(tournament_id)
+
+    if tournament is None:
+        raise ValueError("No tournament with id %s" % tournament_id)
 
     #  Each round, pair up players and execute matches
-    for currentRound in range(1, num_rounds + 1):
+    while tournament.current_round is not None:
+
+        with TournamentSession() as session:
+
+            pairings = session.swissPairings(tournament_id,
+                                             simulator.pairingRandom())
+
+            session.reportRound(tournament_id, tournament.current_round,
+                                simulator.simulateRound(pairings))
+
+        tournament.advance()
+
+
+@instrumented
+def runTournaments(tournament_ids, workers=None, seed=None):
+    """  Run several independent tournaments at the same time.
+
+    Each tournament is run with runTournament in a pool of worker
+    processes, each with its own database connections.  A tournament that
+    fails does not stop the others; its error is returned instead.
+
+    Args:
+      tournament_ids: IDs of the tournaments to run
+      workers: number of worker processes (default: one per CPU)
+      seed: seed passed to runTournament for every tournament
+
+    Returns:
+      A list of (tournament_id, error) tuples in the order of
+      tournament_ids.  error is None if the tournament ran successfully,
+      otherwise a description of what went wrong.
+    """
+
+    #  Connections must not be shared with the forked workers
+    closePool()
+
+    workerPool = multiprocessing.Pool(workers, initializer=_startWorker)
+
+    try:
+        results = workerPool.map(_runTournamentWorker,
+                                 [(tournament_id, seed)
+                                  for tournament_id in tournament_ids],
+                                 chunksize=1)
+    finally:
+        workerPool.close()
+        workerPool.join()
+
+        #  The workers changed these tournaments behind this process's
+        #  cache and bracket index
+        _standingsCache.invalidate(tournament_ids)
+        _bracketIndex.invalidate(tournament_ids)
+
+    return results
+
+
+def _startWorker():
+    """  Give a new worker process its own connection pool. """
+
+    global _pool
+
+    _pool = None
 
-        pairings = swissPairings(tournament_id)
 
-        for (id1, name1, id2, name2) in pairings:
-            runMatch(tournament_id, id1, id2)
+def _runTournamentWorker(args):
+    """  Run one tournament in a worker process.  See runTournaments. """
 
-        completeRound(tournament_id)
+    (tournament_id, seed) = args
 
+    try:
+        runTournament(tournament_id, seed)
+    except (Exception, SystemExit), e:
+        return (tournament_id, "%s: %s" % (type(e).__name__, e))
+
+    return (tournament_id, None)
 
+
+@instrumented
 def playerStandings(tournament_id):
     """Returns a list of the players and their win records, sorted by wins.
 
@@ -337,91 +2211,116 @@ def playerStandings(tournament_id):
         name: the player's full name (as registered)
         wins: the number of matches the player has won
         matches: the number of matches the player has played
+
+    Standings are cached (see standingsCacheInfo) until the tournament's
+    results next change, so repeated reads cost no database round trips.
     """
 
-    conn = connect()
+    version, standings = _standingsCache.lookup(tournament_id)
 
-    c = conn.cursor()
+    if standings is None:
+        with TournamentSession() as session:
+            standings = session._readStandings(tournament_id)
 
-    # Order standings by wins and opponent match wins.  Uses the VIEW
-    # opponent_match_wins to retrive the wins of each opponent
-    c.execute("""SELECT player.id, player.name,
-                        player_tournament_register.player_wins,
-                        player_tournament_register.player_matches
-                   FROM player, player_tournament_register
-                        LEFT JOIN opponent_match_wins ON
-                            player_tournament_register.tournament_id =
-                                             opponent_match_wins.tournament_id
-                         AND player_tournament_register.player_id =
-                                             opponent_match_wins.player_id
-                  WHERE player.id = player_tournament_register.player_id
-                    AND player_tournament_register.tournament_id = ( %s )
-               ORDER BY player_tournament_register.player_wins desc,
-                        opponent_match_wins.sum desc;""",
-              (tournament_id,))
+        _standingsCache.store(tournament_id, version, standings)
 
-    standings = c.fetchall()
+    return list(standings)
 
-    conn.commit()
 
-    conn.close()
+@instrumented
+def iterPlayerStandings(tournament_id, batch_size=STREAM_BATCH_SIZE):
+    """Yields the players and their win records in playerStandings order.
 
-    return standings
+    Rows are fetched from a server-side cursor batch_size at a time, so
+    memory use does not grow with the number of players.  The connection is
+    held until the generator is exhausted or closed.
+
+    Args:
+      tournament_id: ID of the tournament to report
+      batch_size: number of rows fetched from the server at a time
 
+    Returns:
+      A generator of (id, name, wins, matches) tuples as in playerStandings
+    """
+
+    with TournamentSession() as session:
+        for player in session.iterPlayerStandings(tournament_id, batch_size):
+            yield player
+
+
+@instrumented
+def iterSwissPairings(tournament_id, batch_size=STREAM_BATCH_SIZE):
+    """Yields the pairs of players for the next round, as swissPairings.
+
+    Players are fetched from a server-side cursor batch_size at a time and
+    pairs are yielded score bracket by score bracket.  The opponent history
+    is still read in full.
+
+    Args:
+      tournament_id: ID of the tournament for which players we are pairing
+      batch_size: number of rows fetched from the server at a time
+
+    Returns:
+      A generator of (id1, name1, id2, name2) tuples as in swissPairings
+    """
 
-def reportPlayerStandings(standings):
+    with TournamentSession() as session:
+        for pairing in session.iterSwissPairings(tournament_id, batch_size):
+            yield pairing
+
+
+@instrumented
+def reportPlayerStandings(standings, out=None):
     """  Prints the player standings in a nice format to the screen
 
          Args:
            standings:  The player standings in format (ID, Name, Wins, Matches)
+                       Any iterable will do, eg. iterPlayerStandings
+           out:  File-like object to write to (default: sys.stdout)
     """
 
-    print "ID       Name    Matches   Wins"
-    print "--  ---------    -------   ----"
+    if out is None:
+        out = sys.stdout
+
+    out.write("ID       Name    Matches   Wins\n")
+    out.write("--  ---------    -------   ----\n")
 
     for player in standings:
-        print ("{0:>0}  {1:>8}  {2:>6}   {3:>5}"
-               .format(player[0], player[1], player[3], player[2],))
+        out.write("{0:>0}  {1:>8}  {2:>6}   {3:>5}\n"
+                  .format(player[0], player[1], player[3], player[2],))
 
 
-def runMatch(tournament_id, player1, player2):
+@instrumented
+def runMatch(tournament_id, player1, player2, seed=None):
     """ Run one match in the tournament.
 
-    To simulate a match a random number between 1 and 10 is generated for
-    each player.  The player with the highest score is declared the winner.
-
-    No ties are allowed so if one occurs we will regenerate the the second
-    player's score until it is different than the first player
+    The match is scored as runTournament scores its rounds (see
+    tournament_simulation.MatchSimulator): one draw picks a different score
+    from 1 to 10 for each player, so there are no ties and nothing is
+    drawn again.  The player with the highest score is declared the winner.
 
     Args:
       tournament_id: ID of the tournment for which the match is run
       player1: ID of the first player
       player2: ID of the second player
+      seed: seed for the scores.  The same seed, tournament, round and
+            players always give the same result.  (default: unseeded)
     """
 
-    round_id = getCurrentRound(tournament_id)
-
-    player1_score = randint(1, 10)
-    player2_score = randint(1, 10)
-
-    #  No ties allowed.  Generate score for player 2 until it is
-    #  different from player 1
-    while player1_score == player2_score:
-        player2_score = randint(1, 10)
-
-    #  Report the match based on the winner.
-    if player1_score > player2_score:
-        reportMatch(tournament_id, round_id, player1, player1_score,
-                    player2, player2_score)
-    else:
-        reportMatch(tournament_id, round_id, player2, player2_score,
-                    player1, player1_score)
+    _retry(TournamentSession.runMatch, tournament_id, player1, player2,
+           None, seed)
 
 
+@instrumented
 def reportMatch(tournament_id, round_id, winner, winner_score,
                 loser, loser_score):
     """Records the outcome of a single match between two players.
 
+    Reporting is safe from many scorekeepers at once.  A match is keyed by
+    its tournament, round and pair of players, so reporting the same result
+    again does nothing, and a transaction that hits a deadlock or
+    serialization failure is retried (see TRANSACTION_RETRIES).
+
     Args:
       tournament_id: ID of tournament that this match belongs to
       round_id: Round ID of the tournament
@@ -429,45 +2328,61 @@ def reportMatch(tournament_id, round_id, winner, winner_score,
       winner_score: Score of the winner
       loser:  the id number of the player who lost
       loser_score: Score of the loser
+
+    Raises:
+      ValueError: a different result was already reported for the match,
+                  or the round is not being played (not READY)
     """
 
-    conn = connect()
+    _retry(TournamentSession.reportMatch, tournament_id, round_id, winner,
+           winner_score, loser, loser_score)
+
+
+@instrumented
+def reportRound(tournament_id, round_id, results):
+    """Records the outcome of every match in a round and completes the round.
 
-    c = conn.cursor()
+    All the results are written in one transaction with a constant number of
+    statements (one INSERT for the matches, a lock and two UPDATEs for the
+    player records and one for the round status), so either the whole round
+    is recorded or none of it is.
 
-    #  Record match for the winner
-    c.execute("""INSERT INTO tournament_match
-                 VALUES ( %s, %s, %s, %s, %s, %s );""",
-              (winner, tournament_id, round_id,
-               winner_score, loser, loser_score,))
+    Matches already reported (see reportMatch) are skipped, and a round
+    that is already complete stays as it is.
 
-    #  Record the match for the loser
-    c.execute("""INSERT INTO tournament_match
-                 VALUES ( %s, %s, %s, %s, %s, %s );""",
-              (loser, tournament_id, round_id,
-               loser_score, winner, winner_score,))
+    Args:
+      tournament_id: ID of tournament that the round belongs to
+      round_id: Round ID of the tournament
+      results: iterable of (winner, winner_score, loser, loser_score) tuples,
+               one per match, in the same order as the reportMatch arguments
+
+    Raises:
+      ValueError: a different result was already reported for a match,
+                  or the round is not being played (not READY)
+    """
 
-    #  Update the win column for the winner
-    c.execute("""UPDATE player_tournament_register
-                    SET player_matches = player_matches + 1,
-                        player_wins = player_wins + 1
-                  WHERE player_id = ( %s )
-                    AND tournament_id = ( %s );""",
-              (winner, tournament_id,))
+    _retry(TournamentSession.reportRound, tournament_id, round_id,
+           list(results))
+
+
+@instrumented
+def getOpponents(tournament_id):
+    """  Return the opponents each player has already met in a tournament.
+
+    Args:
+      tournament_id: ID of the tournament
 
-    #  Update the loss column for the loser
-    c.execute("""UPDATE player_tournament_register
-                    SET player_matches = player_matches + 1,
-                        player_losses = player_losses + 1
-                  WHERE player_id = ( %s )
-                    AND tournament_id = ( %s );""",
-              (loser, tournament_id,))
+    Returns:
+      opponents: dict mapping each player ID to the set of opponent IDs
+    """
 
-    conn.commit()
+    with TournamentSession() as session:
+        opponents = session.getOpponents(tournament_id)
 
-    conn.close()
+    return opponents
 
 
+@instrumented
 def getCurrentRound(tournament_id):
     """  Return the current tournament round.
 
@@ -481,26 +2396,13 @@ def getCurrentRound(tournament_id):
       round_id:  Current round ID
     """
 
-    conn = connect()
-
-    c = conn.cursor()
-
-    c.execute("""SELECT tournament_round.id FROM tournament_round
-                  WHERE status = ( %s )
-                    AND tournament_round.tournament_id = ( %s )
-               ORDER BY status, id
-               LIMIT 1;""",
-              ("READY", tournament_id,))
-
-    round_id = c.fetchone()[0]
-
-    conn.commit()
-
-    conn.close()
+    with TournamentSession() as session:
+        round_id = session.getCurrentRound(tournament_id)
 
     return round_id
 
 
+@instrumented
 def getNumberOfRounds(tournament_id):
     """  Return the number of rounds in the tournament.
 
@@ -511,48 +2413,91 @@ def getNumberOfRounds(tournament_id):
       num_rounds: Number of total rounds expected for the tournament
     """
 
-    conn = connect()
+    with TournamentSession() as session:
+        num_rounds = session.getNumberOfRounds(tournament_id)
 
-    c = conn.cursor()
+    return num_rounds
 
-    c.execute("""SELECT num_rounds FROM tournament
-                  WHERE id = ( %s );""",
-              (tournament_id,))
 
-    num_rounds = c.fetchone()[0]
+@instrumented
+def completeRound(tournament_id, round_id=None):
+    """  Complete one round of the tournament.
 
-    conn.commit()
+    Once a round is complete the status is changed from READY to COMPLETE.
+    Completing a round that is already complete does nothing.  When several
+    scorekeepers may complete a round, pass its round_id: without it the
+    current round is completed, which is the next round if someone else
+    completed this one first.
 
-    conn.close()
+    Args:
+      tournament_id:  ID of the tournament
+      round_id: ID of the round (default: the current round)
+    """
 
-    return num_rounds
+    _retry(TournamentSession.completeRound, tournament_id, round_id)
 
 
-def completeRound(tournament_id):
-    """  Complete one round of the tournament.
+@instrumented
+def standingsAsOf(tournament_id, round_id):
+    """  Return a tournament's standings as they were at the end of a round.
 
-    Once a round is complete the status is changed from READY to COMPLETE.
+    The standings are rebuilt from the nearest snapshot taken at or before
+    the round (see SNAPSHOT_INTERVAL) and the matches recorded since, so the
+    cost does not depend on how many rounds came before the snapshot.
 
     Args:
-      tournament_id:  ID of the tournament
+      tournament_id: ID of the tournament to report
+      round_id: last round to include (0 for the standings before any match)
+
+    Returns:
+      A list of (id, name, wins, matches) tuples as in playerStandings.
+      Players tied on wins and opponent wins are in id order.
+    """
+
+    with TournamentSession() as session:
+        standings = session.standingsAsOf(tournament_id, round_id)
+
+    return standings
+
+
+@instrumented
+def undoRound(tournament_id, round_id=None):
+    """  Take back a round and every round after it.
+
+    Their matches and snapshots are deleted, the rounds are READY to be
+    played again and the player records are restored to the standings as of
+    the round before (see standingsAsOf).
+
+    Args:
+      tournament_id: ID of the tournament
+      round_id: first round to take back (default: the last round that is
+                complete or has results)
+
+    Returns:
+      round_id: the round taken back, or None if there was nothing to undo
     """
 
-    round_id = getCurrentRound(tournament_id)
+    with TournamentSession() as session:
+        round_id = session.undoRound(tournament_id, round_id)
 
-    conn = connect()
+    return round_id
 
-    c = conn.cursor()
 
-    c.execute("""UPDATE tournament_round
-                    SET status = %s
-                  WHERE tournament_id = ( %s ) AND id = ( %s );""",
-              ("COMPLETE", tournament_id, round_id,))
+@instrumented
+def rebuildStandings(tournament_id):
+    """  Recalculate the player records of a tournament from its latest
+         snapshot and the matches recorded since.  Use it to recover if the
+         records have drifted from the matches.
 
-    conn.commit()
+    Args:
+      tournament_id: ID of the tournament
+    """
 
-    conn.close()
+    with TournamentSession() as session:
+        session.rebuildStandings(tournament_id)
 
 
+@instrumented
 def swissPairings(tournament_id):
     """Returns a list of pairs of players for the next round of a match.
 
@@ -561,6 +2506,9 @@ def swissPairings(tournament_id):
     player with an equal or nearly-equal win record, that is, a player adjacent
     to him or her in the standings.
 
+    Players are paired at random within their score bracket and never meet
+    the same opponent twice unless there is no other way to pair the round.
+
     Args:
       tournament_id: ID of the tournament for which players we are pairing
 
@@ -570,46 +2518,17 @@ def swissPairings(tournament_id):
         name1: the first player's name
         id2: the second player's unique id
         name2: the second player's name
-    """
-    round_id = getCurrentRound(tournament_id)
-
-    conn = connect()
 
-    c = conn.cursor()
-
-    #  Round 1 pairing is random.  Subsequent rounds are paired based on
-    #  win record.  Players with the same score are randomized before
-    #  pairing.
-    if round_id == 1:
-        c.execute("""SELECT player.id, player.name
-                       FROM player, player_tournament_register
-                      WHERE player.id = player_tournament_register.player_id
-                        AND player_tournament_register.tournament_id = ( %s )
-                   ORDER BY random();""",
-                  (tournament_id,))
-    else:
-        c.execute("""SELECT player.id, player.name
-                       FROM player, player_tournament_register
-                      WHERE player.id = player_tournament_register.player_id
-                        AND player_tournament_register.tournament_id = ( %s )
-                    ORDER BY player_tournament_register.player_wins desc,
-                             random();""",
-                  (tournament_id,))
-
-    standings = c.fetchall()
-
-    conn.commit()
-
-    conn.close()
-
-    pairings = []
+    The score brackets are kept in an in-process index that is updated as
+    results are reported, so once a tournament has been paired the next
+    rounds are paired from a single tally of the tournament's matches
+    rather than by reading them all.  Brackets that do not tally with the
+    database, because another process changed the tournament, are read
+    again.
+    """
 
-    #  Report pairings back based in player ID order
-    for i, k in zip(standings[0::2], standings[1::2]):
-        if i[0] < k[0]:
-            pairings.append(i + k)
-        else:
-            pairings.append(k + i)
+    with TournamentSession() as session:
+        pairings = session.swissPairings(tournament_id)
 
     return pairings
 
@@ -38,6 +38,17 @@ CREATE TABLE tournament_round (
     PRIMARY KEY(id, tournament_id)   
 );
 
+--  getCurrentRound looks up the first READY round of a tournament
+CREATE INDEX tournament_round_ready
+    ON tournament_round (tournament_id, id) WHERE status = 'READY';
+
+--  player_tournament_register, match_result and round_standings are
+--  partitioned by tournament.  Each tournament has its own partition of
+--  each table (named after the table and the tournament id), created with
+--  the tournament by create_tournament_partitions below, so a tournament's
+--  matches can be removed with TRUNCATE and its partitions dropped rather
+--  than deleted row by row.
+
 --  Conatains the players that are registered for the tournament and
 --  their stats
 CREATE TABLE player_tournament_register (
@@ -46,30 +57,102 @@ CREATE TABLE player_tournament_register (
     player_matches  INTEGER DEFAULT 0,
     player_wins     INTEGER DEFAULT 0,
     player_losses   INTEGER DEFAULT 0,
+    opponent_wins   INTEGER DEFAULT 0,
     PRIMARY KEY(player_id, tournament_id)   
-);
+) PARTITION BY LIST (tournament_id);
 
+--  Standings are read in this order.  opponent_wins is the total wins of
+--  every opponent the player has faced.  It is kept current by the
+--  tournament code as results are reported (see opponent_match_wins below)
+CREATE INDEX player_tournament_register_standings
+    ON player_tournament_register (tournament_id, player_wins DESC,
+                                   opponent_wins DESC, player_id);
 
---  Stores the details for each match in the tournament
---  Note that each match should result in two records.  One where the first
---  player is stored in the player_id field and the other where the second
---  player is stored in the player_id field.  Makes it easier to locate
---  all matches for a particular player
-CREATE TABLE tournament_match (
-    player_id       INTEGER REFERENCES player(id),
+
+--  Stores the details for each match in the tournament.  Each match is
+--  stored once, as the winner and loser with their scores.  A player plays
+--  at most one match per round.  pairing_id is the lower of the two player
+--  ids, so a match reported twice (in either order) has the same key and
+--  is only recorded once
+CREATE TABLE match_result (
     tournament_id   INTEGER,
     round_id        INTEGER,
-    player_score    INTEGER DEFAULT 0,
-    opponent_id     INTEGER REFERENCES player(id),
-    opponent_score  INTEGER DEFAULT 0,
-    PRIMARY KEY(player_id, tournament_id, round_id),
+    winner_id       INTEGER REFERENCES player(id),
+    winner_score    INTEGER DEFAULT 0,
+    loser_id        INTEGER REFERENCES player(id),
+    loser_score     INTEGER DEFAULT 0,
+    pairing_id      INTEGER NOT NULL,
+    PRIMARY KEY(tournament_id, round_id, pairing_id),
+    UNIQUE(tournament_id, round_id, winner_id),
+    UNIQUE(tournament_id, round_id, loser_id),
     FOREIGN KEY (tournament_id, round_id) REFERENCES tournament_round(tournament_id, id)
-);
+) PARTITION BY LIST (tournament_id);
+
+--  Matches are looked up by tournament and round through the keys above,
+--  and by either player when joining to the opponent's register record
+CREATE INDEX match_result_winner
+    ON match_result (winner_id, tournament_id);
+
+CREATE INDEX match_result_loser
+    ON match_result (loser_id, tournament_id);
+
+
+--  Snapshot of every player's record at the end of a round, taken as the
+--  round is completed (every SNAPSHOT_INTERVAL rounds, see tournament.py).
+--  match_result is only ever appended to while a tournament is played, so
+--  the standings as of any round are the nearest earlier snapshot plus the
+--  matches recorded since
+CREATE TABLE round_standings (
+    tournament_id   INTEGER,
+    round_id        INTEGER,
+    player_id       INTEGER REFERENCES player(id),
+    player_matches  INTEGER DEFAULT 0,
+    player_wins     INTEGER DEFAULT 0,
+    player_losses   INTEGER DEFAULT 0,
+    opponent_wins   INTEGER DEFAULT 0,
+    PRIMARY KEY(tournament_id, round_id, player_id),
+    FOREIGN KEY (tournament_id, round_id) REFERENCES tournament_round(tournament_id, id)
+) PARTITION BY LIST (tournament_id);
+
+
+--  Creates a tournament's partition of each partitioned table
+CREATE FUNCTION create_tournament_partitions(tournament INTEGER)
+RETURNS void AS $$
+DECLARE
+    parent TEXT;
+BEGIN
+    FOREACH parent IN ARRAY ARRAY['player_tournament_register',
+                                  'match_result', 'round_standings'] LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES IN (%s)',
+                       parent || '_' || tournament, parent, tournament);
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+--  Each match from both players' points of view: one row where the first
+--  player is in the player_id field and another where the second player
+--  is.  Makes it easier to locate all matches for a particular player.
+--  Conditions on the view are applied to both halves, so they use the
+--  match_result indexes
+CREATE VIEW tournament_match AS
+    SELECT winner_id AS player_id, tournament_id, round_id,
+           winner_score AS player_score,
+           loser_id AS opponent_id, loser_score AS opponent_score
+      FROM match_result
+ UNION ALL
+    SELECT loser_id AS player_id, tournament_id, round_id,
+           loser_score AS player_score,
+           winner_id AS opponent_id, winner_score AS opponent_score
+      FROM match_result;
 
 
 --  View to calculate the total wins of all the players that a
 --  single player played against.  Used as a secondary ranking factor 
---  when two players have the same number of tournament points 
+--  when two players have the same number of tournament points.
+--  Note: standings use the stored player_tournament_register.opponent_wins
+--  value.  This view recalculates it from the matches and is kept for
+--  reporting and for checking the stored value
 CREATE VIEW opponent_match_wins AS
     SELECT player_tournament_register.player_id, 
        player_tournament_register.tournament_id, 
@@ -84,9 +167,7 @@ CREATE VIEW opponent_match_wins AS
           GROUP BY tournament_match.player_id, tournament_match.tournament_id)
                 AS opponent_wins    
      WHERE opponent_wins.tournament_id = player_tournament_register.tournament_id
-       AND opponent_wins.player_id = player_tournament_register.player_id
-       ORDER BY player_tournament_register.player_id, 
-                opponent_wins.sum DESC;  
+       AND opponent_wins.player_id = player_tournament_register.player_id;  
 
 
 
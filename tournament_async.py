@@ -0,0 +1,740 @@
+""" Asynchronous API for the Swiss System Tournament """
+# !/usr/bin/env python
+#
+#  Description: Non-blocking versions of the tournament.py functions, for a
+#               server that handles many tournaments at once from a single
+#               thread.
+#
+#               Each async_ function starts the operation and returns a
+#               Future straight away.  The operations run on an EventLoop,
+#               which keeps a small set of psycopg2 asynchronous connections
+#               and waits on all of their sockets at once with select(), so
+#               hundreds of standings and reports can be in flight together.
+#
+#               Operations are written as generators.  They yield a _Query to
+#               run a statement (and are sent its rows back), yield another
+#               operation to call it, and yield Return(value) to finish.
+#
+#                   standings = async_playerStandings(tournament_id)
+#                   pairings = async_swissPairings(other_tournament_id)
+#                   wait([standings, pairings])
+#                   standings.result()
+#
+#               The results are the same as the tournament.py functions.
+#               Errors are raised from Future.result() rather than ending the
+#               program.  async_registerPlayers sends the names as arrays,
+#               as asynchronous connections cannot COPY.  getTournament,
+#               getPlayersForTournament, runMatch, undoRound, standingsAsOf,
+#               rebuildStandings, runTournaments and the streaming functions
+#               have no asynchronous versions.
+
+import collections
+import itertools
+import random
+import select
+import types
+
+import psycopg2
+import psycopg2.extensions
+
+import tournament
+from tournament_engine import numberOfRounds, pairPlayers
+
+
+#  Most database connections the event loop opens
+ASYNC_MAX_CONNECTIONS = 20
+
+_loop = None
+
+
+class Future(object):
+    """  The result of an asynchronous operation. """
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def result(self):
+        """  Return the operation's result, or raise its error.
+
+        Raises:
+          RuntimeError: if the operation has not finished
+        """
+
+        if not self.done:
+            raise RuntimeError("Operation has not finished")
+
+        if self.error is not None:
+            raise self.error
+
+        return self.value
+
+
+class Return(object):
+    """  Yielded by an operation to finish with a value. """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class _Query(object):
+    """  Yielded by an operation to run a statement.  The operation is sent
+         the rows back, or the row count if the statement returns none. """
+
+    __slots__ = ("sql", "params")
+
+    def __init__(self, sql, params=None):
+        self.sql = sql
+        self.params = params
+
+
+class _Task(object):
+    """  An operation in progress and the connection it runs on. """
+
+    __slots__ = ("stack", "future", "conn", "cursor", "value", "error")
+
+    def __init__(self, operation):
+        self.stack = [operation]
+        self.future = Future()
+        self.conn = None
+        self.cursor = None
+        self.value = None
+        self.error = None
+
+
+class EventLoop(object):
+    """  Runs asynchronous operations, each on its own connection, until they
+         finish.  Operations wait for a connection once max_connections are
+         busy. """
+
+    def __init__(self, dsn=None, max_connections=ASYNC_MAX_CONNECTIONS):
+        self.dsn = dsn or tournament.DSN
+        self.max_connections = max_connections
+        self.opened = 0
+        self.idle = []
+
+        #  Tasks waiting for a connection, tasks ready to step and
+        #  connection -> (task, poll state) for tasks waiting on the server
+        self.waiting = collections.deque()
+        self.ready = collections.deque()
+        self.polling = {}
+
+    def spawn(self, operation):
+        """  Start an operation and return its Future. """
+
+        task = _Task(operation)
+
+        self.waiting.append(task)
+
+        return task.future
+
+    def run(self, futures=None):
+        """  Run until the given futures have finished, or until every
+             operation has finished if futures is None. """
+
+        while True:
+            self._assignConnections()
+
+            while self.ready:
+                self._step(self.ready.popleft())
+
+            self._assignConnections()
+
+            if futures is not None and all(f.done for f in futures):
+                return
+
+            if self.ready:
+                continue
+
+            if not self.polling:
+                if not self.waiting:
+                    return
+                continue
+
+            self._wait()
+
+    def close(self):
+        """  Close the idle connections. """
+
+        for conn in self.idle:
+            conn.close()
+
+        self.opened -= len(self.idle)
+        self.idle = []
+
+    def _assignConnections(self):
+        """  Give waiting tasks an idle connection, or open a new one. """
+
+        while self.waiting and (self.idle or
+                                self.opened < self.max_connections):
+            task = self.waiting.popleft()
+
+            if self.idle:
+                task.conn = self.idle.pop()
+                task.cursor = task.conn.cursor()
+
+                self.ready.append(task)
+            else:
+                try:
+                    task.conn = psycopg2.connect(self.dsn, async_=1)
+                except psycopg2.Error, e:
+                    self._finish(task, error=e)
+                    continue
+
+                self.opened += 1
+
+                self._poll(task)
+
+    def _wait(self):
+        """  Block until at least one connection can make progress, then
+             poll the connections that can. """
+
+        readers = [conn for conn, (task, state) in self.polling.items()
+                   if state == psycopg2.extensions.POLL_READ]
+        writers = [conn for conn, (task, state) in self.polling.items()
+                   if state == psycopg2.extensions.POLL_WRITE]
+
+        readable, writable, failed = select.select(readers, writers, [])
+
+        for conn in set(readable) | set(writable):
+            self._poll(self.polling.pop(conn)[0])
+
+    def _poll(self, task):
+        """  Poll a task's connection and make the task ready if the
+             connection or its statement has finished. """
+
+        try:
+            state = task.conn.poll()
+        except psycopg2.Error, e:
+            task.error = e
+            self.ready.append(task)
+            return
+
+        if state != psycopg2.extensions.POLL_OK:
+            self.polling[task.conn] = (task, state)
+            return
+
+        #  A new connection is ready; otherwise a statement has finished
+        if task.cursor is None:
+            task.cursor = task.conn.cursor()
+        elif task.cursor.description is not None:
+            task.value = task.cursor.fetchall()
+        else:
+            task.value = task.cursor.rowcount
+
+        self.ready.append(task)
+
+    def _step(self, task):
+        """  Run a task's current operation up to its next yield. """
+
+        operation = task.stack[-1]
+
+        try:
+            if task.error is not None:
+                error, task.error = task.error, None
+                step = operation.throw(error)
+            else:
+                step = operation.send(task.value)
+        except StopIteration:
+            step = Return()
+        except Exception, e:
+            task.stack.pop()
+
+            #  Hand the error to the calling operation, if there is one
+            if task.stack:
+                task.error = e
+                self.ready.append(task)
+            else:
+                self._finish(task, error=e)
+            return
+
+        task.value = None
+
+        if isinstance(step, _Query):
+            try:
+                task.cursor.execute(step.sql, step.params)
+            except psycopg2.Error, e:
+                task.error = e
+                self.ready.append(task)
+                return
+
+            self._poll(task)
+
+        elif isinstance(step, types.GeneratorType):
+            task.stack.append(step)
+            self.ready.append(task)
+
+        elif isinstance(step, Return):
+            task.stack.pop()
+
+            if task.stack:
+                task.value = step.value
+                self.ready.append(task)
+            else:
+                self._finish(task, value=step.value)
+
+        else:
+            task.error = TypeError("Operations must yield a _Query, an "
+                                   "operation or Return")
+            self.ready.append(task)
+
+    def _finish(self, task, value=None, error=None):
+        """  Settle a task's Future and release its connection.  After an
+             error the connection is closed, which rolls back any open
+             transaction. """
+
+        if task.conn is not None:
+            if error is None:
+                self.idle.append(task.conn)
+            else:
+                task.conn.close()
+                self.opened -= 1
+
+        task.future.value = value
+        task.future.error = error
+        task.future.done = True
+
+
+def configureLoop(dsn=None, max_connections=ASYNC_MAX_CONNECTIONS):
+    """  Replace the event loop used by the async_ functions.
+
+    Args:
+      dsn: connection string (default: tournament.DSN)
+      max_connections: most connections the loop opens
+    """
+
+    global _loop
+
+    closeLoop()
+
+    _loop = EventLoop(dsn, max_connections)
+
+
+def closeLoop():
+    """  Close the event loop's idle connections. """
+
+    global _loop
+
+    if _loop is not None:
+        _loop.close()
+        _loop = None
+
+
+def getLoop():
+    """  Return the event loop used by the async_ functions, creating it on
+         first use. """
+
+    global _loop
+
+    if _loop is None:
+        _loop = EventLoop()
+
+    return _loop
+
+
+def wait(futures):
+    """  Run the event loop until every future has finished and return their
+         results in order.
+
+    Raises:
+      The first error among the futures.
+    """
+
+    futures = list(futures)
+
+    getLoop().run(futures)
+
+    return [future.result() for future in futures]
+
+
+def _transaction(tournament_id, operation, *args):
+    """  Run operation(*args) in one transaction that changes a tournament's
+         standings.  Asynchronous connections are in autocommit mode, so the
+         transaction is explicit.  As in tournament._retry, a transaction
+         that fails with a serialization failure or deadlock is run again,
+         straight away, up to tournament.TRANSACTION_RETRIES times. """
+
+    for attempt in range(1, tournament.TRANSACTION_RETRIES + 1):
+        yield _Query("""BEGIN;""")
+
+        try:
+            value = yield operation(*args)
+
+            yield _Query("""COMMIT;""")
+        except psycopg2.extensions.TransactionRollbackError:
+            if attempt == tournament.TRANSACTION_RETRIES:
+                raise
+        else:
+            tournament._standingsCache.invalidate([tournament_id])
+            tournament._bracketIndex.invalidate([tournament_id])
+
+            yield Return(value)
+
+        yield _Query("""ROLLBACK;""")
+
+
+def _statements(statements):
+    """  Run (sql, params) statements in order. """
+
+    for (sql, params) in statements:
+        yield _Query(sql, params)
+
+
+def _steps(function, *args):
+    """  Run the (sql, params) statements of the steps generator returned by
+         function(*args) (see tournament.TournamentSession._runSteps).  The
+         generator is made here, so a retried transaction starts afresh. """
+
+    steps = function(*args)
+    result = None
+
+    while True:
+        try:
+            (sql, params) = steps.send(result)
+        except StopIteration:
+            return
+
+        result = yield _Query(sql, params)
+
+
+def _deletePlayers():
+    yield _transaction(None, _statements, [("""DELETE FROM player;""", None)])
+
+
+def _deleteTournaments():
+    yield _transaction(None, _steps, tournament._deleteTournamentsSteps)
+
+
+def _countPlayers():
+    rows = yield _Query("""SELECT count(*) FROM player;""")
+
+    yield Return(rows[0][0])
+
+
+def _registerPlayer(name):
+    yield _Query("""INSERT INTO player (name) VALUES ( %s );""", (name,))
+
+
+def _registerPlayers(names, batch_size):
+    names = iter(names)
+
+    player_ids = []
+
+    yield _Query("""BEGIN;""")
+
+    while True:
+        batch = list(itertools.islice(names, batch_size))
+
+        if not batch:
+            break
+
+        #  Reserve the ids up front so they are handed back in order
+        rows = yield _Query("""SELECT nextval('player_id_seq')
+                                 FROM generate_series(1, %s);""",
+                            (len(batch),))
+
+        batch_ids = [row[0] for row in rows]
+
+        yield _Query("""INSERT INTO player (id, name)
+                        SELECT * FROM unnest(%s::int[], %s::text[]);""",
+                     (batch_ids, batch))
+
+        player_ids.extend(batch_ids)
+
+    yield _Query("""COMMIT;""")
+
+    yield Return(player_ids)
+
+
+def _createTournament(name, num_players):
+    if num_players % 2 != 0:
+        raise ValueError("Odd number of players not allowed")
+
+    rounds = numberOfRounds(num_players)
+
+    yield _Query("""BEGIN;""")
+
+    rows = yield _Query("""INSERT INTO tournament
+                           (name, num_players, num_rounds)
+                           VALUES ( %s , %s, %s ) RETURNING id;""",
+                        (name, num_players, rounds,))
+
+    tournament_id = rows[0][0]
+
+    yield _Query("""INSERT INTO tournament_round (id, tournament_id, status)
+                    SELECT round_id, %s, %s
+                      FROM generate_series(1, %s) AS round_id;""",
+                 (tournament_id, "READY", rounds,))
+
+    yield _Query("""SELECT create_tournament_partitions( %s );""",
+                 (tournament_id,))
+
+    yield _Query("""COMMIT;""")
+
+    yield Return(tournament_id)
+
+
+def _setupTournament(tournament_id, strategy, seed):
+    if strategy not in tournament.SETUP_STRATEGIES:
+        raise ValueError("Unknown setup strategy: %s" % strategy)
+
+    yield _transaction(tournament_id, _steps,
+                       tournament.SETUP_STRATEGIES[strategy], tournament_id,
+                       None, seed)
+
+
+def _getNumberOfPlayers(tournament_id):
+    rows = yield _Query("""SELECT num_players FROM tournament
+                            WHERE id = ( %s );""", (tournament_id,))
+
+    yield Return(rows[0][0])
+
+
+def _getNumberOfRounds(tournament_id):
+    rows = yield _Query("""SELECT num_rounds FROM tournament
+                            WHERE id = ( %s );""", (tournament_id,))
+
+    yield Return(rows[0][0])
+
+
+def _getCurrentRound(tournament_id):
+    rows = yield _Query(tournament._CURRENT_ROUND.sql,
+                        {"tournament_id": tournament_id})
+
+    yield Return(rows[0][0])
+
+
+def _getOpponents(tournament_id):
+    rows = yield _Query("""SELECT winner_id, loser_id
+                             FROM match_result
+                            WHERE tournament_id = ( %s );""",
+                        (tournament_id,))
+
+    opponents = {}
+
+    for (winner_id, loser_id) in rows:
+        opponents.setdefault(winner_id, set()).add(loser_id)
+        opponents.setdefault(loser_id, set()).add(winner_id)
+
+    yield Return(opponents)
+
+
+def _playerStandings(tournament_id, version):
+    rows = yield _Query(tournament._STANDINGS_SQL, (tournament_id,))
+
+    tournament._standingsCache.store(tournament_id, version, rows)
+
+    yield Return(list(rows))
+
+
+def _swissPairings(tournament_id, rng=random):
+    standings = yield _Query(tournament._PAIRING_SQL,
+                             {"tournament_id": tournament_id})
+
+    opponents = yield _getOpponents(tournament_id)
+
+    yield Return(list(pairPlayers(standings, opponents, rng)))
+
+
+def _recordResults(tournament_id, round_id, results):
+    """  Record a batch of results with the steps TournamentSession
+         prepares (see tournament._recordSteps), run unprepared. """
+
+    steps = tournament._recordSteps(tournament_id, round_id, results)
+    rows = None
+
+    while True:
+        try:
+            (statement, params) = steps.send(rows)
+        except StopIteration:
+            return
+
+        rows = yield _Query(statement.sql, params)
+
+
+def _recordRound(tournament_id, round_id, results):
+    yield _statements([tournament._lockRoundStatement(tournament_id,
+                                                      round_id)])
+
+    yield _recordResults(tournament_id, round_id, results)
+
+    yield _statements(tournament._completeStatements(tournament_id,
+                                                     round_id))
+
+
+def _reportMatch(tournament_id, round_id, winner, winner_score,
+                 loser, loser_score):
+    yield _transaction(tournament_id, _recordResults, tournament_id,
+                       round_id, [(winner, winner_score, loser, loser_score)])
+
+
+def _reportRound(tournament_id, round_id, results):
+    yield _transaction(tournament_id, _recordRound, tournament_id, round_id,
+                       list(results))
+
+
+def _completeRound(tournament_id, round_id=None):
+    if round_id is None:
+        round_id = yield _getCurrentRound(tournament_id)
+
+    yield _transaction(tournament_id, _statements,
+                       tournament._completeStatements(tournament_id,
+                                                      round_id))
+
+
+def _deleteMatches(tournament_id):
+    rows = yield _Query("""SELECT 1 FROM tournament WHERE id = ( %s );""",
+                        (tournament_id,))
+
+    if not rows:
+        return
+
+    yield _transaction(tournament_id, _statements,
+                       tournament._deleteMatchesStatements(tournament_id))
+
+
+def _runTournament(tournament_id, seed):
+    #  Imported here so that only simulating tournaments needs NumPy
+    from tournament_simulation import MatchSimulator
+
+    simulator = MatchSimulator(seed, tournament_id)
+
+    num_rounds = yield _getNumberOfRounds(tournament_id)
+
+    for x in range(num_rounds):
+        round_id = yield _getCurrentRound(tournament_id)
+
+        pairings = yield _swissPairings(tournament_id,
+                                        simulator.pairingRandom())
+
+        yield _reportRound(tournament_id, round_id,
+                           simulator.simulateRound(pairings))
+
+
+def async_deletePlayers():
+    """  Asynchronous deletePlayers.  Returns a Future. """
+
+    return getLoop().spawn(_deletePlayers())
+
+
+def async_deleteTournaments():
+    """  Asynchronous deleteTournaments.  Returns a Future. """
+
+    return getLoop().spawn(_deleteTournaments())
+
+
+def async_countPlayers():
+    """  Asynchronous countPlayers.  Returns a Future. """
+
+    return getLoop().spawn(_countPlayers())
+
+
+def async_registerPlayer(name):
+    """  Asynchronous registerPlayer.  Returns a Future. """
+
+    return getLoop().spawn(_registerPlayer(name))
+
+
+def async_registerPlayers(names, batch_size=tournament.REGISTER_BATCH_SIZE):
+    """  Asynchronous registerPlayers.  Returns a Future of the new players'
+         ids, in the same order as names. """
+
+    return getLoop().spawn(_registerPlayers(names, batch_size))
+
+
+def async_createTournament(name, num_players):
+    """  Asynchronous createTournament.  Returns a Future of the new
+         tournament's id.  An odd number of players raises ValueError and a
+         duplicate name raises psycopg2.IntegrityError. """
+
+    return getLoop().spawn(_createTournament(name, num_players))
+
+
+def async_setupTournament(tournament_id, strategy="id", seed=None):
+    """  Asynchronous setupTournament.  Returns a Future.  An unknown
+         strategy raises ValueError. """
+
+    return getLoop().spawn(_setupTournament(tournament_id, strategy, seed))
+
+
+def async_getNumberOfPlayers(tournament_id):
+    """  Asynchronous getNumberOfPlayers.  Returns a Future. """
+
+    return getLoop().spawn(_getNumberOfPlayers(tournament_id))
+
+
+def async_getNumberOfRounds(tournament_id):
+    """  Asynchronous getNumberOfRounds.  Returns a Future. """
+
+    return getLoop().spawn(_getNumberOfRounds(tournament_id))
+
+
+def async_getCurrentRound(tournament_id):
+    """  Asynchronous getCurrentRound.  Returns a Future. """
+
+    return getLoop().spawn(_getCurrentRound(tournament_id))
+
+
+def async_getOpponents(tournament_id):
+    """  Asynchronous getOpponents.  Returns a Future. """
+
+    return getLoop().spawn(_getOpponents(tournament_id))
+
+
+def async_playerStandings(tournament_id):
+    """  Asynchronous playerStandings.  Returns a Future, which has already
+         finished if the standings are in the standings cache. """
+
+    version, standings = tournament._standingsCache.lookup(tournament_id)
+
+    if standings is None:
+        return getLoop().spawn(_playerStandings(tournament_id, version))
+
+    future = Future()
+    future.value = list(standings)
+    future.done = True
+
+    return future
+
+
+def async_swissPairings(tournament_id):
+    """  Asynchronous swissPairings.  Returns a Future. """
+
+    return getLoop().spawn(_swissPairings(tournament_id))
+
+
+def async_reportMatch(tournament_id, round_id, winner, winner_score,
+                      loser, loser_score):
+    """  Asynchronous reportMatch.  Returns a Future. """
+
+    return getLoop().spawn(_reportMatch(tournament_id, round_id, winner,
+                                        winner_score, loser, loser_score))
+
+
+def async_reportRound(tournament_id, round_id, results):
+    """  Asynchronous reportRound.  Returns a Future. """
+
+    return getLoop().spawn(_reportRound(tournament_id, round_id, results))
+
+
+def async_completeRound(tournament_id, round_id=None):
+    """  Asynchronous completeRound.  Returns a Future. """
+
+    return getLoop().spawn(_completeRound(tournament_id, round_id))
+
+
+def async_deleteMatches(tournament_id):
+    """  Asynchronous deleteMatches.  Returns a Future. """
+
+    return getLoop().spawn(_deleteMatches(tournament_id))
+
+
+def async_runTournament(tournament_id, seed=None):
+    """  Asynchronous runTournament.  Returns a Future. """
+
+    return getLoop().spawn(_runTournament(tournament_id, seed))
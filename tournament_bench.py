@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py and the in-process backends
+#
+# Times the main tournament operations (registerPlayer, registerPlayers,
+# setupTournament, playerStandings, swissPairings, reportMatch and a full
+# runTournament) at several field sizes on each backend, saves the timings
+# as JSON and compares them with a stored baseline.  The run fails if an
+# operation is more than --tolerance slower than in the baseline.
+#
+# The PostgreSQL benchmarks need a local PostgreSQL server on which the
+# current user may create databases.  The scratch database is dropped and
+# recreated on every run:
+#
+#           python tournament_bench.py --save-baseline    (first run)
+#           python tournament_bench.py                    (later runs)
+#           python tournament_bench.py --backends memory,sqlite --sizes 16,256
+#
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+import psycopg2
+
+import tournament
+from tournament_engine import MemoryBackend, SQLiteBackend
+
+
+#  Scratch database for the PostgreSQL benchmarks
+BENCH_DATABASE = "tournament_bench"
+
+BENCH_SIZES = (16, 256, 4096, 65536)
+BENCH_BACKENDS = ("memory", "sqlite", "postgres")
+
+#  Most single-row calls timed for registerPlayer and reportMatch
+BENCH_CALLS = 200
+
+#  Times each read is repeated; the fastest run is kept
+BENCH_REPEATS = 3
+
+BENCH_RESULTS = "tournament_bench_results.json"
+BENCH_BASELINE = "tournament_bench_baseline.json"
+
+#  An operation regresses if it is this much slower than the baseline (as a
+#  fraction) and slower by at least BENCH_MIN_DIFFERENCE seconds per call
+BENCH_TOLERANCE = 0.25
+BENCH_MIN_DIFFERENCE = 0.001
+
+
+def createDatabase():
+    """  Create the scratch database, load tournament.sql and point the
+         tournament connection pool at it. """
+
+    conn = psycopg2.connect("dbname=postgres")
+    conn.autocommit = True
+    c = conn.cursor()
+    c.execute("""DROP DATABASE IF EXISTS %s;""" % BENCH_DATABASE)
+    c.execute("""CREATE DATABASE %s;""" % BENCH_DATABASE)
+    conn.close()
+
+    conn = psycopg2.connect("dbname=" + BENCH_DATABASE)
+
+    with open("tournament.sql") as schema:
+        conn.cursor().execute(schema.read())
+
+    conn.commit()
+    conn.close()
+
+    tournament.configurePool(dsn="dbname=" + BENCH_DATABASE)
+
+
+def clearCaches():
+    """  Empty the standings cache and the bracket index. """
+
+    tournament.clearStandingsCache()
+    tournament.clearBracketIndex()
+
+
+def makeBackend(name):
+    """  Return (backend, clear) for a backend name.  clear() empties any
+         cache that would hide the cost of a read. """
+
+    if name == "memory":
+        return MemoryBackend(), lambda: None
+
+    if name == "sqlite":
+        return SQLiteBackend(), lambda: None
+
+    if name == "postgres":
+        createDatabase()
+
+        #  The tournament.py functions themselves, rather than the engine
+        #  over PostgresBackend, so their caches and SQL are what is timed
+        return tournament, clearCaches
+
+    raise ValueError("Unknown backend: " + name)
+
+
+def timeCalls(calls):
+    """  Run each function in calls and return its timing as a dict. """
+
+    start = timeit.default_timer()
+
+    for call in calls:
+        call()
+
+    seconds = timeit.default_timer() - start
+
+    return {"calls": len(calls), "seconds": seconds,
+            "per_call": seconds / max(len(calls), 1)}
+
+
+def timeBest(function, repeats=BENCH_REPEATS, before=None):
+    """  Time function repeats times and return the fastest run. """
+
+    best = None
+
+    for x in range(repeats):
+        if before is not None:
+            before()
+
+        timing = timeCalls([function])
+
+        if best is None or timing["seconds"] < best["seconds"]:
+            best = timing
+
+    return best
+
+
+def benchSize(backend, clear, size):
+    """  Time every operation for a field of size players. """
+
+    timings = {}
+
+    backend.deleteTournaments()
+    backend.deletePlayers()
+
+    timings["registerPlayers"] = timeCalls(
+        [lambda: backend.registerPlayers("Player %d" % i
+                                         for i in range(size))])
+
+    #  Extra players beyond the field; setupTournament takes the first
+    #  size players
+    timings["registerPlayer"] = timeCalls(
+        [lambda i=i: backend.registerPlayer("Extra %d" % i)
+         for i in range(min(size, BENCH_CALLS))])
+
+    tournament_id = backend.createTournament("Bench %d" % size, size)
+
+    timings["setupTournament"] = timeCalls(
+        [lambda: backend.setupTournament(tournament_id)])
+
+    timings["playerStandings"] = timeBest(
+        lambda: backend.playerStandings(tournament_id), before=clear)
+
+    timings["swissPairings"] = timeBest(
+        lambda: backend.swissPairings(tournament_id), before=clear)
+
+    round_id = backend.getCurrentRound(tournament_id)
+    pairings = backend.swissPairings(tournament_id)[:BENCH_CALLS]
+
+    timings["reportMatch"] = timeCalls(
+        [lambda p=p: backend.reportMatch(tournament_id, round_id,
+                                         p[0], 10, p[2], 5)
+         for p in pairings])
+
+    run_id = backend.createTournament("Bench run %d" % size, size)
+    backend.setupTournament(run_id)
+
+    timings["runTournament"] = timeCalls(
+        [lambda: backend.runTournament(run_id)])
+
+    return timings
+
+
+def runBenchmarks(backends, sizes):
+    """  Return the timings of every backend and size, printing each. """
+
+    results = {}
+
+    for name in backends:
+        backend, clear = makeBackend(name)
+
+        results[name] = {}
+
+        for size in sizes:
+            timings = benchSize(backend, clear, size)
+
+            results[name][str(size)] = timings
+
+            for operation in sorted(timings):
+                print ("   %-8s %6d  %-16s %10.6f s/call  (%d calls)" %
+                       (name, size, operation,
+                        timings[operation]["per_call"],
+                        timings[operation]["calls"]))
+
+        backend.deleteTournaments()
+        backend.deletePlayers()
+
+    if "postgres" in backends:
+        tournament.closePool()
+
+    return results
+
+
+def compareResults(results, baseline, tolerance=BENCH_TOLERANCE):
+    """  Compare results with a baseline and return the regressions as a
+         list of (backend, size, operation, per_call, baseline_per_call). """
+
+    regressions = []
+
+    for backend, sizes in sorted(results.items()):
+        for size, timings in sorted(sizes.items(), key=lambda s: int(s[0])):
+            for operation, timing in sorted(timings.items()):
+                try:
+                    before = baseline[backend][size][operation]["per_call"]
+                except KeyError:
+                    continue
+
+                now = timing["per_call"]
+
+                if (now > before * (1 + tolerance) and
+                        now - before > BENCH_MIN_DIFFERENCE):
+                    regressions.append((backend, int(size), operation,
+                                        now, before))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tournament operations.")
+    parser.add_argument("--backends", default=",".join(BENCH_BACKENDS),
+                        help="comma separated backends to run")
+    parser.add_argument("--sizes",
+                        default=",".join(str(s) for s in BENCH_SIZES),
+                        help="comma separated field sizes")
+    parser.add_argument("--output", default=BENCH_RESULTS,
+                        help="file to save the results to")
+    parser.add_argument("--baseline", default=BENCH_BASELINE,
+                        help="baseline file to compare with")
+    parser.add_argument("--tolerance", type=float, default=BENCH_TOLERANCE,
+                        help="fraction slower than the baseline allowed")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="save the results as the new baseline")
+    args = parser.parse_args()
+
+    backends = [name for name in args.backends.split(",") if name]
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    results = {"python": platform.python_version(),
+               "platform": platform.platform(),
+               "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "results": runBenchmarks(backends, sizes)}
+
+    with open(args.output, "w") as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+    print "Results saved to " + args.output
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+        print "Baseline saved to " + args.baseline
+        return
+
+    if not os.path.exists(args.baseline):
+        print ("No baseline to compare with.  Run with --save-baseline to "
+               "create " + args.baseline)
+        return
+
+    with open(args.baseline) as saved:
+        baseline = json.load(saved)
+
+    regressions = compareResults(results["results"], baseline["results"],
+                                 args.tolerance)
+
+    for (backend, size, operation, now, before) in regressions:
+        print ("   %s %d %s: %.6f s/call, baseline %.6f s/call" %
+               (backend, size, operation, now, before))
+
+    if regressions:
+        print ("System Error: %d operations are slower than the baseline" %
+               len(regressions))
+
+        sys.exit(1)
+
+    print "No regressions against " + args.baseline
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,921 @@
+""" Swiss System Tournament Engine and Storage Backends """
+# !/usr/bin/env python
+#
+#  Description: The tournament logic (round setup, pairing, standings order,
+#               match simulation and round progression) written against a
+#               small storage interface, plus the backends that implement
+#               it:
+#
+#                   MemoryBackend   - compact in-process arrays, no database
+#                   SQLiteBackend   - sqlite3 database (file or in memory)
+#                   PostgresBackend - the PostgreSQL database of
+#                                     tournament.py
+#
+#               Every backend offers the same operations as tournament.py
+#               (registerPlayer, createTournament, setupTournament,
+#               swissPairings, reportMatch, playerStandings, runTournament,
+#               ...) as methods, so a tournament can be simulated or tested
+#               without a PostgreSQL server:
+#
+#                   backend = MemoryBackend()
+#                   backend.registerPlayers(names)
+#                   tournament_id = backend.createTournament("Test", 1024)
+#                   backend.setupTournament(tournament_id)
+#                   backend.runTournament(tournament_id)
+#                   standings = backend.playerStandings(tournament_id)
+
+
+import collections
+import itertools
+import math
+import random
+import sqlite3
+import sys
+from array import array
+from random import randint
+
+
+def numberOfRounds(num_players):
+    """  Return the number of rounds needed for a tournament.
+
+    Args:
+      num_players: number of players in the tournament
+
+    Returns:
+      num_rounds: log2 of the number of players, rounded up
+    """
+
+    return int(math.ceil(math.log(num_players, 2)))
+
+
+def simulateMatch(player1, player2):
+    """ Simulate one match between two players.
+
+    To simulate a match a score between 1 and 10 is drawn for each player.
+    The player with the highest score is declared the winner.  No ties are
+    allowed: the second player's score is drawn from the nine scores left,
+    which is the same as drawing again until it differs, without the loop.
+
+    Args:
+      player1: ID of the first player
+      player2: ID of the second player
+
+    Returns:
+      A (winner, winner_score, loser, loser_score) tuple
+    """
+
+    player1_score = randint(1, 10)
+    player2_score = randint(1, 9)
+
+    #  No ties allowed.  Scores from player 1's up move up by one, so
+    #  player 2 gets any other score with the same chance
+    if player2_score >= player1_score:
+        player2_score += 1
+
+    #  Report the match based on the winner.
+    if player1_score > player2_score:
+        return (player1, player1_score, player2, player2_score)
+    else:
+        return (player2, player2_score, player1, player1_score)
+
+
+#  Cost added for pairing two players who have already met.  Any pairing
+#  without rematches is preferred over one with a rematch.
+REMATCH_COST = 1000
+
+#  Number of the most recent pairs that the weighted matching fallback may
+#  break up, and how many search steps it may take
+PAIRING_REPAIR_PAIRS = 8
+PAIRING_SEARCH_LIMIT = 20000
+
+
+def pairPlayers(players, opponents, rng=random):
+    """  Pair players for the next round of a Swiss tournament.
+
+    Players are paired inside their score bracket (players with the same
+    number of wins) in random order, avoiding rematches.  A player who
+    cannot be paired inside the bracket (an odd player out, or one who has
+    already met everyone left) floats down and is paired first in the next
+    bracket.  Players still unpaired after the last bracket are matched
+    with a weighted (minimum cost) matching together with the last
+    PAIRING_REPAIR_PAIRS pairs made, where a rematch costs REMATCH_COST and
+    a pairing across brackets costs the difference in wins.
+
+    With an odd number of players one player sits the round out (a bye)
+    and appears in no pair: one of the players left over with the fewest
+    wins, preferring a player who has not had a bye.
+
+    Pairs are generated bracket by bracket, so players may be streamed in.
+
+    Args:
+      players: iterable of (id, name, wins) tuples in descending wins order
+      opponents: mapping of player id to the set of ids already played
+      rng: random.Random instance (or the random module) for shuffling
+
+    Returns:
+      A generator of (id1, name1, id2, name2) tuples with id1 < id2
+    """
+
+    floaters = []
+    held = collections.deque()
+
+    for wins, bracket in itertools.groupby(players, key=lambda p: p[2]):
+        bracket = list(bracket)
+        rng.shuffle(bracket)
+
+        pairs, floaters = _pairBracket(floaters + bracket, opponents)
+
+        #  Hold back the latest pairs in case the fallback needs to break
+        #  them up
+        held.extend(pairs)
+
+        while len(held) > PAIRING_REPAIR_PAIRS:
+            yield _pairTuple(held.popleft())
+
+    if floaters:
+        group = floaters + [player for pair in held for player in pair]
+
+        #  An odd field always leaves a floater.  The bye goes to a player
+        #  with the fewest wins, preferring one who has played the most
+        #  (so has not had a bye yet), and the rest are paired again
+        if len(group) % 2 != 0:
+            bye = min(group, key=lambda player: (
+                player[2], -len(opponents.get(player[0], ()))))
+            group = [player for player in group if player is not bye]
+
+        held = _weightedPairs(group, opponents)
+
+    for pair in held:
+        yield _pairTuple(pair)
+
+
+def _pairTuple(pair):
+    """  Return a pair of players as (id1, name1, id2, name2) in id order. """
+
+    (p, q) = pair
+
+    if p[0] > q[0]:
+        (p, q) = (q, p)
+
+    return (p[0], p[1], q[0], q[1])
+
+
+def _pairBracket(group, opponents):
+    """  Greedily pair a score bracket in order without rematches.
+
+    Returns:
+      A (pairs, floaters) tuple: the pairs made and the players left over
+    """
+
+    pairs = []
+    floaters = []
+
+    paired = [False] * len(group)
+
+    for i, player in enumerate(group):
+        if paired[i]:
+            continue
+
+        played = opponents.get(player[0], ())
+
+        for j in range(i + 1, len(group)):
+            if not paired[j] and group[j][0] not in played:
+                paired[j] = True
+                pairs.append((player, group[j]))
+                break
+        else:
+            floaters.append(player)
+
+    return pairs, floaters
+
+
+def _pairingCost(p, q, opponents):
+    cost = abs(p[2] - q[2])
+
+    if q[0] in opponents.get(p[0], ()):
+        cost += REMATCH_COST
+
+    return cost
+
+
+def _weightedPairs(group, opponents):
+    """  Minimum cost perfect matching of a small group of players.  The
+         group must have an even number of players.
+
+    A depth first branch and bound search that tries the cheapest partner
+    first, so the first complete matching is the greedy one and the search
+    only improves on it.  Gives up after PAIRING_SEARCH_LIMIT steps and
+    returns the best matching found so far.
+    """
+
+    best = [None, None]
+    steps = [0]
+
+    def search(remaining, pairs, cost):
+        if best[1] is not None and (cost >= best[1] or
+                                    steps[0] >= PAIRING_SEARCH_LIMIT):
+            return
+
+        steps[0] += 1
+
+        if not remaining:
+            best[0] = list(pairs)
+            best[1] = cost
+            return
+
+        player = remaining[0]
+
+        candidates = sorted(remaining[1:], key=lambda other:
+                            _pairingCost(player, other, opponents))
+
+        for other in candidates:
+            pairs.append((player, other))
+            search([p for p in remaining[1:] if p is not other], pairs,
+                   cost + _pairingCost(player, other, opponents))
+            pairs.pop()
+
+    if len(group) % 2 != 0:
+        raise ValueError("Cannot pair an odd number of players")
+
+    search(list(group), [], 0)
+
+    return best[0]
+
+
+class TournamentBackend(object):
+    """  Tournament engine over an abstract storage backend.
+
+    Subclasses implement the storage methods (those that raise
+    NotImplementedError below).  The tournament operations are built on top
+    of them here and behave like the functions of the same name in
+    tournament.py.
+    """
+
+    #  Storage interface
+
+    def addPlayers(self, names):
+        """  Store new players.
+
+        Args:
+          names: iterable of player names
+
+        Returns:
+          player_ids: list of the new player ids, in the same order as names
+        """
+
+        raise NotImplementedError
+
+    def countPlayers(self):
+        """  Return the number of stored players. """
+
+        raise NotImplementedError
+
+    def deletePlayers(self):
+        """  Remove every player. """
+
+        raise NotImplementedError
+
+    def addTournament(self, name, num_players, num_rounds):
+        """  Store a new tournament with num_rounds rounds in status READY.
+             Raise ValueError if a tournament called name already exists.
+
+        Returns:
+          tournament_id: ID of the new tournament
+        """
+
+        raise NotImplementedError
+
+    def getTournament(self, tournament_id):
+        """  Return a (num_players, num_rounds) tuple for the tournament. """
+
+        raise NotImplementedError
+
+    def enrolPlayers(self, tournament_id, num_players):
+        """  Register the first num_players players (in id order) for the
+             tournament with no matches played. """
+
+        raise NotImplementedError
+
+    def getCurrentRound(self, tournament_id):
+        """  Return the ID of the first round in status READY. """
+
+        raise NotImplementedError
+
+    def setRoundComplete(self, tournament_id, round_id):
+        """  Change the status of a round from READY to COMPLETE. """
+
+        raise NotImplementedError
+
+    def recordResults(self, tournament_id, round_id, results):
+        """  Store a batch of match results and update the win, loss and
+             match counts of the players involved.
+
+        Args:
+          results: list of (winner, winner_score, loser, loser_score) tuples
+        """
+
+        raise NotImplementedError
+
+    def getOpponents(self, tournament_id):
+        """  Return a dict mapping each player id of a tournament to the set
+             of ids of the players they have already met. """
+
+        raise NotImplementedError
+
+    def getPlayerRecords(self, tournament_id):
+        """  Return the registered players of a tournament as a list of
+             (id, name, wins, matches, opponent_wins) tuples, in id order.
+             opponent_wins is the total wins of every opponent faced. """
+
+        raise NotImplementedError
+
+    def resetMatches(self, tournament_id):
+        """  Remove the results of a tournament, reset the player counts and
+             set every round back to READY. """
+
+        raise NotImplementedError
+
+    def deleteTournaments(self):
+        """  Remove every tournament and everything recorded for it. """
+
+        raise NotImplementedError
+
+    #  Tournament operations
+
+    def registerPlayer(self, name):
+        """  See tournament.registerPlayer. """
+
+        self.addPlayers([name])
+
+    def registerPlayers(self, names):
+        """  See tournament.registerPlayers. """
+
+        return self.addPlayers(names)
+
+    def createTournament(self, name, num_players):
+        """  See tournament.createTournament. """
+
+        if num_players % 2 != 0:
+            print ("System Error: Odd number of players not allowed")
+            print ("Terminating Program")
+
+            sys.exit(1)
+
+        try:
+            return self.addTournament(name, num_players,
+                                      numberOfRounds(num_players))
+        except ValueError:
+            print ("System Error: Tournament with name - " +
+                   name + " - already exists")
+            print ("Terminating Program")
+
+            sys.exit(1)
+
+    def setupTournament(self, tournament_id):
+        """  See tournament.setupTournament. """
+
+        self.enrolPlayers(tournament_id,
+                          self.getNumberOfPlayers(tournament_id))
+
+    def getNumberOfPlayers(self, tournament_id):
+        """  See tournament.getNumberOfPlayers. """
+
+        return self.getTournament(tournament_id)[0]
+
+    def getNumberOfRounds(self, tournament_id):
+        """  See tournament.getNumberOfRounds. """
+
+        return self.getTournament(tournament_id)[1]
+
+    def deleteMatches(self, tournament_id):
+        """  See tournament.deleteMatches. """
+
+        self.resetMatches(tournament_id)
+
+    def playerStandings(self, tournament_id):
+        """  See tournament.playerStandings. """
+
+        records = self.getPlayerRecords(tournament_id)
+
+        #  Order standings by wins and opponent match wins
+        records.sort(key=lambda record: (-record[2], -record[4]))
+
+        return [record[:4] for record in records]
+
+    def swissPairings(self, tournament_id):
+        """  See tournament.swissPairings. """
+
+        records = self.getPlayerRecords(tournament_id)
+
+        records.sort(key=lambda record: -record[2])
+
+        return list(pairPlayers([record[:3] for record in records],
+                                self.getOpponents(tournament_id)))
+
+    def reportMatch(self, tournament_id, round_id, winner, winner_score,
+                    loser, loser_score):
+        """  See tournament.reportMatch. """
+
+        self.recordResults(tournament_id, round_id,
+                           [(winner, winner_score, loser, loser_score)])
+
+    def reportRound(self, tournament_id, round_id, results):
+        """  See tournament.reportRound. """
+
+        self.recordResults(tournament_id, round_id, list(results))
+
+        self.setRoundComplete(tournament_id, round_id)
+
+    def runMatch(self, tournament_id, player1, player2):
+        """  See tournament.runMatch. """
+
+        self.reportMatch(tournament_id, self.getCurrentRound(tournament_id),
+                         *simulateMatch(player1, player2))
+
+    def completeRound(self, tournament_id):
+        """  See tournament.completeRound. """
+
+        self.setRoundComplete(tournament_id,
+                              self.getCurrentRound(tournament_id))
+
+    def runTournament(self, tournament_id):
+        """  See tournament.runTournament. """
+
+        num_rounds = self.getNumberOfRounds(tournament_id)
+
+        #  Each round, pair up players and execute matches
+        for currentRound in range(1, num_rounds + 1):
+
+            round_id = self.getCurrentRound(tournament_id)
+
+            pairings = self.swissPairings(tournament_id)
+
+            results = [simulateMatch(id1, id2)
+                       for (id1, name1, id2, name2) in pairings]
+
+            self.reportRound(tournament_id, round_id, results)
+
+
+class _MemoryTournament(object):
+    """  One tournament held by the MemoryBackend.
+
+    The registered players are numbered 0..n-1 (their slot) and every
+    per-player value is kept in an array indexed by slot.  opponents holds
+    one array per played round with the slot of each player's opponent
+    (-1 if the player has not played that round).
+    """
+
+    __slots__ = ("name", "num_players", "num_rounds", "current_round",
+                 "player_ids", "slots", "wins", "losses", "matches",
+                 "opponents")
+
+    def __init__(self, name, num_players, num_rounds):
+        self.name = name
+        self.num_players = num_players
+        self.num_rounds = num_rounds
+        self.current_round = 1
+        self.enrol(array("l"))
+
+    def enrol(self, player_ids):
+        size = len(player_ids)
+
+        self.player_ids = player_ids
+        self.slots = dict((player_id, slot)
+                          for slot, player_id in enumerate(player_ids))
+        self.wins = array("i", [0]) * size
+        self.losses = array("i", [0]) * size
+        self.matches = array("i", [0]) * size
+        self.opponents = {}
+
+
+class MemoryBackend(TournamentBackend):
+    """  Keeps everything in process memory.  Nothing is persisted. """
+
+    def __init__(self):
+        self.player_ids = array("l")
+        self.player_names = []
+        self.next_player_id = 1
+        self.tournaments = {}
+        self.next_tournament_id = 1
+
+    def addPlayers(self, names):
+        first_id = self.next_player_id
+
+        for name in names:
+            self.player_ids.append(self.next_player_id)
+            self.player_names.append(name)
+            self.next_player_id += 1
+
+        return list(range(first_id, self.next_player_id))
+
+    def countPlayers(self):
+        return len(self.player_ids)
+
+    def deletePlayers(self):
+        self.player_ids = array("l")
+        self.player_names = []
+
+    def addTournament(self, name, num_players, num_rounds):
+        for tournament in self.tournaments.values():
+            if tournament.name == name:
+                raise ValueError(name)
+
+        tournament_id = self.next_tournament_id
+        self.next_tournament_id += 1
+
+        self.tournaments[tournament_id] = _MemoryTournament(name, num_players,
+                                                            num_rounds)
+
+        return tournament_id
+
+    def getTournament(self, tournament_id):
+        tournament = self.tournaments[tournament_id]
+
+        return (tournament.num_players, tournament.num_rounds)
+
+    def enrolPlayers(self, tournament_id, num_players):
+        self.tournaments[tournament_id].enrol(self.player_ids[:num_players])
+
+    def getCurrentRound(self, tournament_id):
+        tournament = self.tournaments[tournament_id]
+
+        if tournament.current_round > tournament.num_rounds:
+            return None
+
+        return tournament.current_round
+
+    def setRoundComplete(self, tournament_id, round_id):
+        tournament = self.tournaments[tournament_id]
+
+        if round_id == tournament.current_round:
+            tournament.current_round += 1
+
+    def recordResults(self, tournament_id, round_id, results):
+        tournament = self.tournaments[tournament_id]
+
+        slots = tournament.slots
+
+        opponents = tournament.opponents.get(round_id)
+
+        if opponents is None:
+            opponents = array("l", [-1]) * len(tournament.player_ids)
+            tournament.opponents[round_id] = opponents
+
+        for (winner, winner_score, loser, loser_score) in results:
+            winner_slot = slots[winner]
+            loser_slot = slots[loser]
+
+            tournament.wins[winner_slot] += 1
+            tournament.losses[loser_slot] += 1
+            tournament.matches[winner_slot] += 1
+            tournament.matches[loser_slot] += 1
+
+            opponents[winner_slot] = loser_slot
+            opponents[loser_slot] = winner_slot
+
+    def getOpponents(self, tournament_id):
+        tournament = self.tournaments[tournament_id]
+
+        player_ids = tournament.player_ids
+
+        opponents = dict((player_id, set()) for player_id in player_ids)
+
+        for round_opponents in tournament.opponents.values():
+            for slot, opponent in enumerate(round_opponents):
+                if opponent >= 0:
+                    opponents[player_ids[slot]].add(player_ids[opponent])
+
+        return opponents
+
+    def getPlayerRecords(self, tournament_id):
+        tournament = self.tournaments[tournament_id]
+
+        wins = tournament.wins
+
+        opponent_wins = array("i", [0]) * len(wins)
+
+        for opponents in tournament.opponents.values():
+            for slot, opponent in enumerate(opponents):
+                if opponent >= 0:
+                    opponent_wins[slot] += wins[opponent]
+
+        names = dict(zip(self.player_ids, self.player_names))
+
+        return [(player_id, names.get(player_id), wins[slot],
+                 tournament.matches[slot], opponent_wins[slot])
+                for slot, player_id in enumerate(tournament.player_ids)]
+
+    def resetMatches(self, tournament_id):
+        tournament = self.tournaments[tournament_id]
+
+        tournament.enrol(tournament.player_ids)
+        tournament.current_round = 1
+
+    def deleteTournaments(self):
+        self.tournaments = {}
+
+
+class SQLiteBackend(TournamentBackend):
+    """  Stores the tournament in a sqlite3 database.
+
+    Args:
+      database: sqlite3 database file name.  Defaults to a private in-memory
+                database.
+    """
+
+    #  Same tables as tournament.sql (AUTOINCREMENT keeps ids from being
+    #  reused, like a PostgreSQL serial)
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS player (
+            id      INTEGER PRIMARY KEY AUTOINCREMENT,
+            name    VARCHAR(40)
+        );
+
+        CREATE TABLE IF NOT EXISTS tournament (
+            id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            name            VARCHAR(40) UNIQUE,
+            num_players     INTEGER,
+            num_rounds      INTEGER
+        );
+
+        CREATE TABLE IF NOT EXISTS tournament_round (
+            id              INTEGER,
+            tournament_id   INTEGER REFERENCES tournament(id),
+            status          VARCHAR(10),
+            PRIMARY KEY(id, tournament_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS player_tournament_register (
+            player_id       INTEGER REFERENCES player(id),
+            tournament_id   INTEGER REFERENCES tournament(id),
+            player_matches  INTEGER DEFAULT 0,
+            player_wins     INTEGER DEFAULT 0,
+            player_losses   INTEGER DEFAULT 0,
+            PRIMARY KEY(player_id, tournament_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS tournament_match (
+            player_id       INTEGER REFERENCES player(id),
+            tournament_id   INTEGER,
+            round_id        INTEGER,
+            player_score    INTEGER DEFAULT 0,
+            opponent_id     INTEGER REFERENCES player(id),
+            opponent_score  INTEGER DEFAULT 0,
+            PRIMARY KEY(player_id, tournament_id, round_id)
+        );
+    """
+
+    def __init__(self, database=":memory:"):
+        self.conn = sqlite3.connect(database)
+        self.conn.executescript(self.SCHEMA)
+
+    def addPlayers(self, names):
+        c = self.conn.cursor()
+
+        player_ids = []
+
+        for name in names:
+            c.execute("""INSERT INTO player (name) VALUES ( ? );""", (name,))
+            player_ids.append(c.lastrowid)
+
+        self.conn.commit()
+
+        return player_ids
+
+    def countPlayers(self):
+        return self.conn.execute("""SELECT count(*) FROM player;""")\
+                        .fetchone()[0]
+
+    def deletePlayers(self):
+        self.conn.execute("""DELETE FROM player;""")
+        self.conn.commit()
+
+    def addTournament(self, name, num_players, num_rounds):
+        c = self.conn.cursor()
+
+        try:
+            c.execute("""INSERT INTO tournament (name, num_players, num_rounds)
+                         VALUES ( ?, ?, ? );""",
+                      (name, num_players, num_rounds))
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            raise ValueError(name)
+
+        tournament_id = c.lastrowid
+
+        c.executemany("""INSERT INTO tournament_round
+                         (id, tournament_id, status) VALUES ( ?, ?, ? );""",
+                      [(x, tournament_id, "READY")
+                       for x in range(1, num_rounds + 1)])
+
+        self.conn.commit()
+
+        return tournament_id
+
+    def getTournament(self, tournament_id):
+        return self.conn.execute("""SELECT num_players, num_rounds
+                                      FROM tournament WHERE id = ( ? );""",
+                                 (tournament_id,)).fetchone()
+
+    def enrolPlayers(self, tournament_id, num_players):
+        self.conn.execute("""INSERT INTO player_tournament_register
+                                    (player_id, tournament_id)
+                             SELECT id, ? FROM player
+                              ORDER BY id LIMIT ( ? );""",
+                          (tournament_id, num_players))
+        self.conn.commit()
+
+    def getCurrentRound(self, tournament_id):
+        return self.conn.execute("""SELECT min(id) FROM tournament_round
+                                     WHERE status = ( ? )
+                                       AND tournament_id = ( ? );""",
+                                 ("READY", tournament_id)).fetchone()[0]
+
+    def setRoundComplete(self, tournament_id, round_id):
+        self.conn.execute("""UPDATE tournament_round SET status = ?
+                              WHERE tournament_id = ( ? ) AND id = ( ? );""",
+                          ("COMPLETE", tournament_id, round_id))
+        self.conn.commit()
+
+    def recordResults(self, tournament_id, round_id, results):
+        matches = []
+        counters = []
+
+        for (winner, winner_score, loser, loser_score) in results:
+            matches.append((winner, tournament_id, round_id,
+                            winner_score, loser, loser_score))
+            matches.append((loser, tournament_id, round_id,
+                            loser_score, winner, winner_score))
+
+            counters.append((1, 0, winner, tournament_id))
+            counters.append((0, 1, loser, tournament_id))
+
+        c = self.conn.cursor()
+
+        c.executemany("""INSERT INTO tournament_match
+                         VALUES ( ?, ?, ?, ?, ?, ? );""", matches)
+
+        c.executemany("""UPDATE player_tournament_register
+                            SET player_matches = player_matches + 1,
+                                player_wins = player_wins + ?,
+                                player_losses = player_losses + ?
+                          WHERE player_id = ( ? )
+                            AND tournament_id = ( ? );""", counters)
+
+        self.conn.commit()
+
+    def getOpponents(self, tournament_id):
+        opponents = {}
+
+        for (player_id, opponent_id) in self.conn.execute(
+                """SELECT player_id, opponent_id FROM tournament_match
+                    WHERE tournament_id = ( ? );""", (tournament_id,)):
+            opponents.setdefault(player_id, set()).add(opponent_id)
+
+        return opponents
+
+    def getPlayerRecords(self, tournament_id):
+        return self.conn.execute(
+            """SELECT player.id, player.name,
+                      register.player_wins, register.player_matches,
+                      coalesce(opponent_wins.total, 0)
+                 FROM player_tournament_register AS register
+                 JOIN player ON player.id = register.player_id
+                 LEFT JOIN (SELECT tournament_match.player_id,
+                                   SUM(opponent.player_wins) AS total
+                              FROM tournament_match
+                              JOIN player_tournament_register AS opponent
+                                ON opponent.player_id =
+                                       tournament_match.opponent_id
+                               AND opponent.tournament_id =
+                                       tournament_match.tournament_id
+                             WHERE tournament_match.tournament_id = ( ? )
+                          GROUP BY tournament_match.player_id)
+                        AS opponent_wins
+                   ON opponent_wins.player_id = register.player_id
+                WHERE register.tournament_id = ( ? )
+             ORDER BY player.id;""",
+            (tournament_id, tournament_id)).fetchall()
+
+    def resetMatches(self, tournament_id):
+        self.conn.execute("""DELETE FROM tournament_match
+                              WHERE tournament_id = ( ? );""",
+                          (tournament_id,))
+        self.conn.execute("""UPDATE player_tournament_register
+                                SET player_matches = 0, player_wins = 0,
+                                    player_losses = 0
+                              WHERE tournament_id = ( ? );""",
+                          (tournament_id,))
+        self.conn.execute("""UPDATE tournament_round SET status = ?
+                              WHERE tournament_id = ( ? );""",
+                          ("READY", tournament_id))
+        self.conn.commit()
+
+    def deleteTournaments(self):
+        self.conn.executescript("""DELETE FROM tournament_match;
+                                   DELETE FROM tournament_round;
+                                   DELETE FROM player_tournament_register;
+                                   DELETE FROM tournament;""")
+
+
+class PostgresBackend(TournamentBackend):
+    """  Stores the tournament in the PostgreSQL database of tournament.py.
+
+    Each storage method runs in a tournament.TournamentSession, so it uses
+    the connection pool and keeps the standings cache and bracket index of
+    tournament.py up to date.  Results are recorded as tournament.py
+    records them (a retried transaction that refuses results for a round
+    that is not READY).
+    """
+
+    def __init__(self):
+        #  Imported here so the other backends work without psycopg2
+        import tournament
+
+        self.tournament = tournament
+
+    def _run(self, operation, *args):
+        """  Run the TournamentSession method operation in a session of its
+             own and return its result. """
+
+        with self.tournament.TournamentSession() as session:
+            return getattr(session, operation)(*args)
+
+    def addPlayers(self, names):
+        return self._run("registerPlayers", names)
+
+    def countPlayers(self):
+        return self._run("countPlayers")
+
+    def deletePlayers(self):
+        self._run("deletePlayers")
+
+    def addTournament(self, name, num_players, num_rounds):
+        import psycopg2
+
+        with self.tournament.TournamentSession() as session:
+            try:
+                session.c.execute("""INSERT INTO tournament
+                                     (name, num_players, num_rounds)
+                                     VALUES ( %s, %s, %s ) RETURNING id;""",
+                                  (name, num_players, num_rounds))
+            except psycopg2.IntegrityError:
+                raise ValueError(name)
+
+            tournament_id = session.c.fetchone()[0]
+
+            session.c.execute("""INSERT INTO tournament_round
+                                        (id, tournament_id, status)
+                                 SELECT x, %s, 'READY'
+                                   FROM generate_series(1, %s) AS x;""",
+                              (tournament_id, num_rounds))
+
+            session.c.execute("""SELECT create_tournament_partitions( %s );""",
+                              (tournament_id,))
+
+        return tournament_id
+
+    def getTournament(self, tournament_id):
+        tournament = self._run("getTournament", tournament_id)
+
+        return (tournament.num_players, tournament.num_rounds)
+
+    def enrolPlayers(self, tournament_id, num_players):
+        self._run("setupTournament", tournament_id, "id", None, num_players)
+
+    def getCurrentRound(self, tournament_id):
+        return self._run("getCurrentRound", tournament_id)
+
+    def setRoundComplete(self, tournament_id, round_id):
+        self._run("completeRound", tournament_id, round_id)
+
+    def recordResults(self, tournament_id, round_id, results):
+        tournament = self.tournament
+
+        tournament._retry(tournament.TournamentSession._recordResults,
+                          tournament_id, round_id, results)
+
+    def getOpponents(self, tournament_id):
+        return self._run("getOpponents", tournament_id)
+
+    def getPlayerRecords(self, tournament_id):
+        with self.tournament.TournamentSession() as session:
+            session.c.execute("""SELECT player.id, player.name,
+                                        register.player_wins,
+                                        register.player_matches,
+                                        register.opponent_wins
+                                   FROM player_tournament_register
+                                            AS register
+                                   JOIN player
+                                     ON player.id = register.player_id
+                                  WHERE register.tournament_id = ( %s )
+                               ORDER BY player.id;""",
+                              (tournament_id,))
+
+            return session.c.fetchall()
+
+    def resetMatches(self, tournament_id):
+        self._run("deleteMatches", tournament_id)
+
+    def deleteTournaments(self):
+        self._run("deleteTournaments")
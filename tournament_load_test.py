@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+#
+# Concurrent reporting load test for tournament.py
+#
+# Plays a tournament at a time with several scorekeeper processes reporting
+# the results of each round at once, as table judges would.  Every result
+# is reported by more than one scorekeeper and every scorekeeper completes
+# each round, so the duplicates have to be absorbed.  Prints the reports
+# per second for each number of scorekeepers, then checks that every
+# player's record matches the matches recorded: no win lost or counted
+# twice.
+#
+# Each number of scorekeepers then plays a racing tournament, in which the
+# scorekeepers complete each round while results for it are still being
+# reported.  The reports that lose the race are refused, and the check
+# also compares each round's standings snapshot with the matches recorded
+# up to that round, so no result can land in a round after its snapshot.
+#
+# Needs a local PostgreSQL server on which the current user may create
+# databases.  The scratch database is dropped and recreated on every run:
+#
+#           python tournament_load_test.py
+#           python tournament_load_test.py --clients 1,4,16 --players 2048
+#
+
+import argparse
+import multiprocessing
+import random
+import sys
+import timeit
+
+import psycopg2
+
+import tournament
+
+
+#  Scratch database for the load test
+LOAD_DATABASE = "tournament_load_test"
+
+LOAD_CLIENTS = (1, 2, 4, 8, 16)
+LOAD_PLAYERS = 1024
+
+#  Times each result is reported
+LOAD_DUPLICATES = 2
+
+
+def createDatabase():
+    """  Create the scratch database, load tournament.sql and point the
+         tournament connection pool at it. """
+
+    conn = psycopg2.connect("dbname=postgres")
+    conn.autocommit = True
+    c = conn.cursor()
+    c.execute("""DROP DATABASE IF EXISTS %s;""" % LOAD_DATABASE)
+    c.execute("""CREATE DATABASE %s;""" % LOAD_DATABASE)
+    conn.close()
+
+    conn = psycopg2.connect("dbname=" + LOAD_DATABASE)
+
+    with open("tournament.sql") as schema:
+        conn.cursor().execute(schema.read())
+
+    conn.commit()
+    conn.close()
+
+    tournament.configurePool(dsn="dbname=" + LOAD_DATABASE)
+
+
+def reportResult(args):
+    """  Report one result from a scorekeeper process.  Returns False if
+         the result was refused because its round was complete. """
+
+    (tournament_id, round_id, result) = args
+
+    try:
+        tournament.reportMatch(tournament_id, round_id, *result)
+    except ValueError:
+        return False
+
+    return True
+
+
+def completeRound(args):
+    """  Complete a round from a scorekeeper process. """
+
+    (tournament_id, round_id) = args
+
+    tournament.completeRound(tournament_id, round_id)
+
+
+def scorekeeperTask(args):
+    """  Run a reportResult or completeRound task from a scorekeeper
+         process. """
+
+    (task, task_args) = args
+
+    return task(task_args)
+
+
+def playTournament(clients, players, duplicates, rng, racing=False):
+    """  Play a tournament with clients scorekeepers and return
+         (tournament_id, reports, seconds spent reporting, matches
+         recorded).  If racing, the scorekeepers complete each round while
+         its results are still being reported. """
+
+    tournament_id = tournament.createTournament(
+        "Load %d%s" % (clients, " racing" if racing else ""), players)
+    tournament.setupTournament(tournament_id)
+
+    num_rounds = tournament.getNumberOfRounds(tournament_id)
+
+    reports = 0
+    seconds = 0.0
+    matches = 0
+
+    for round_id in range(1, num_rounds + 1):
+        results = []
+
+        for (id1, name1, id2, name2) in \
+                tournament.swissPairings(tournament_id):
+            if rng.random() < 0.5:
+                (id1, id2) = (id2, id1)
+
+            results.append((id1, rng.randint(6, 10), id2, rng.randint(0, 5)))
+
+        tasks = [(reportResult, (tournament_id, round_id, result))
+                 for result in results for x in range(duplicates)]
+        rng.shuffle(tasks)
+
+        completions = [(completeRound, (tournament_id, round_id))] * clients
+
+        #  Racing scorekeepers complete the round somewhere in the second
+        #  half of the reports, while the rest are in flight
+        if racing:
+            for completion in completions:
+                tasks.insert(rng.randint(len(tasks) // 2, len(tasks)),
+                             completion)
+
+            completions = []
+
+        #  Connections must not be shared with the forked scorekeepers
+        tournament.closePool()
+
+        scorekeepers = multiprocessing.Pool(clients)
+
+        try:
+            start = timeit.default_timer()
+
+            accepted = scorekeepers.map(scorekeeperTask, tasks, chunksize=1)
+            scorekeepers.map(scorekeeperTask, completions, chunksize=1)
+
+            seconds += timeit.default_timer() - start
+        finally:
+            scorekeepers.close()
+            scorekeepers.join()
+
+        #  A result is recorded if any of its reports was accepted
+        matches += len(set(report[2] for ((task, report), ok)
+                           in zip(tasks, accepted)
+                           if task is reportResult and ok))
+
+        reports += len(results) * duplicates
+
+    #  The scorekeepers changed the standings behind this process's cache
+    tournament.clearStandingsCache()
+
+    return (tournament_id, reports, seconds, matches)
+
+
+def checkTournament(tournament_id, expected):
+    """  Return a list of the ways a tournament's records are wrong, given
+         the number of matches expected to be recorded. """
+
+    problems = []
+
+    with tournament.TournamentSession() as session:
+        c = session.c
+
+        num_rounds = session.getNumberOfRounds(tournament_id)
+
+        c.execute("""SELECT count(*) FROM match_result
+                      WHERE tournament_id = %s;""",
+                  (tournament_id,))
+
+        matches = c.fetchone()[0]
+
+        if matches != expected:
+            problems.append("%d matches recorded, expected %d" %
+                            (matches, expected))
+
+        c.execute("""SELECT count(*) FROM tournament_round
+                      WHERE tournament_id = %s AND status = 'COMPLETE';""",
+                  (tournament_id,))
+
+        if c.fetchone()[0] != num_rounds:
+            problems.append("not every round is complete")
+
+        #  Each player's counters against a count of their matches
+        c.execute("""SELECT register.player_id
+                       FROM player_tournament_register AS register
+                  LEFT JOIN (SELECT player_id, count(*) AS matches,
+                                    SUM(CASE WHEN player_score >
+                                                  opponent_score
+                                             THEN 1 ELSE 0 END) AS wins
+                               FROM tournament_match
+                              WHERE tournament_id = %s
+                           GROUP BY player_id) AS played
+                         ON played.player_id = register.player_id
+                      WHERE register.tournament_id = %s
+                        AND (register.player_matches <>
+                                 coalesce(played.matches, 0)
+                             OR register.player_wins <>
+                                 coalesce(played.wins, 0)
+                             OR register.player_losses <>
+                                 coalesce(played.matches - played.wins,
+                                          0));""",
+                  (tournament_id, tournament_id,))
+
+        wrong = c.fetchall()
+
+        if wrong:
+            problems.append("%d players have the wrong wins or losses" %
+                            len(wrong))
+
+        c.execute("""SELECT count(*)
+                       FROM player_tournament_register AS register,
+                            opponent_match_wins
+                      WHERE register.tournament_id = %s
+                        AND opponent_match_wins.tournament_id = %s
+                        AND opponent_match_wins.player_id =
+                                register.player_id
+                        AND opponent_match_wins.sum <>
+                                register.opponent_wins;""",
+                  (tournament_id, tournament_id,))
+
+        wrong = c.fetchone()[0]
+
+        if wrong:
+            problems.append("%d players have the wrong opponent wins" %
+                            wrong)
+
+        #  Each snapshot against the matches recorded up to its round
+        c.execute("""SELECT count(*)
+                       FROM round_standings AS snapshot
+                      WHERE snapshot.tournament_id = %s
+                        AND snapshot.player_matches <>
+                                (SELECT count(*) FROM tournament_match
+                                  WHERE tournament_id = %s
+                                    AND player_id = snapshot.player_id
+                                    AND round_id <= snapshot.round_id);""",
+                  (tournament_id, tournament_id,))
+
+        wrong = c.fetchone()[0]
+
+        if wrong:
+            problems.append("%d snapshot records miss a match" % wrong)
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report results from many scorekeepers at once.")
+    parser.add_argument("--clients",
+                        default=",".join(str(n) for n in LOAD_CLIENTS),
+                        help="comma separated numbers of scorekeepers")
+    parser.add_argument("--players", type=int, default=LOAD_PLAYERS,
+                        help="players in each tournament")
+    parser.add_argument("--duplicates", type=int, default=LOAD_DUPLICATES,
+                        help="times each result is reported")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="seed for the pairings and scores")
+    args = parser.parse_args()
+
+    clients = [int(n) for n in args.clients.split(",") if n]
+    rng = random.Random(args.seed)
+
+    createDatabase()
+
+    tournament.registerPlayers("Player %d" % i
+                               for i in range(1, args.players + 1))
+
+    failures = 0
+
+    for racing in (False, True):
+        for count in clients:
+            (tournament_id, reports, seconds, matches) = playTournament(
+                count, args.players, args.duplicates, rng, racing)
+
+            #  Only a racing scorekeeper may have its results refused
+            if racing:
+                expected = matches
+            else:
+                expected = (tournament.getNumberOfRounds(tournament_id) *
+                            args.players // 2)
+
+            problems = checkTournament(tournament_id, expected)
+
+            print ("   %3d scorekeepers  %7d reports  %8.3f s  "
+                   "%9.1f reports/s  %s%s" %
+                   (count, reports, seconds, reports / seconds,
+                    "racing, " if racing else "",
+                    "; ".join(problems) or "consistent"))
+
+            failures += len(problems)
+
+    tournament.closePool()
+
+    if failures:
+        print "System Error: wins were lost or counted twice"
+
+        sys.exit(1)
+
+    print "Success!  Every result was counted once."
+
+
+if __name__ == '__main__':
+    main()
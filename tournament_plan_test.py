@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+# Query plan regression tests for tournament.py
+#
+# Loads a large synthetic data set into a scratch PostgreSQL database,
+# records every statement that the tournament.py functions run against it
+# and EXPLAINs each one.  The run fails if a statement on a hot path (the
+# functions called for every match or round) plans a sequential scan of a
+# tournament table.  Plans for the other functions are checked and listed
+# but do not fail the run.
+#
+# Needs a local PostgreSQL server on which the current user may create
+# databases.  The scratch database is dropped and recreated on every run:
+#
+#           python tournament_plan_test.py
+#
+
+import collections
+import json
+import re
+
+import psycopg2
+import psycopg2.extensions
+
+import tournament
+
+
+#  Scratch database and size of the synthetic data set
+PLAN_DATABASE = "tournament_plan_test"
+PLAN_PLAYERS = 200000
+PLAN_TOURNAMENTS = 400
+PLAN_FIELD = 256
+PLAN_ROUNDS = 8
+PLAN_ROUNDS_PLAYED = 5
+
+#  Tables that must never be scanned sequentially on a hot path.  A
+#  sequential scan of one tournament's partition of a partitioned table is
+#  allowed; scanning several partitions is not.
+HOT_TABLES = ("match_result", "tournament_round",
+              "player_tournament_register")
+
+#  Statements that can be EXPLAINed
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+class RecordingCursor(psycopg2.extensions.cursor):
+    """  Cursor that keeps a copy of every statement it executes while
+         RecordingCursor.statements is a list. """
+
+    statements = None
+
+    def execute(self, query, vars=None):
+        if RecordingCursor.statements is not None:
+            RecordingCursor.statements.append(self.mogrify(query, vars))
+
+        return super(RecordingCursor, self).execute(query, vars)
+
+
+def createDatabase():
+    """  Create the scratch database, load tournament.sql and the synthetic
+         data set, and point the tournament connection pool at it. """
+
+    conn = psycopg2.connect("dbname=postgres")
+    conn.autocommit = True
+    c = conn.cursor()
+    c.execute("""DROP DATABASE IF EXISTS %s;""" % PLAN_DATABASE)
+    c.execute("""CREATE DATABASE %s;""" % PLAN_DATABASE)
+    conn.close()
+
+    conn = psycopg2.connect("dbname=" + PLAN_DATABASE)
+    c = conn.cursor()
+
+    with open("tournament.sql") as schema:
+        c.execute(schema.read())
+
+    c.execute("""INSERT INTO player (name)
+                 SELECT 'Player ' || g FROM generate_series(1, %s) g;""",
+              (PLAN_PLAYERS,))
+
+    c.execute("""INSERT INTO tournament (name, num_players, num_rounds)
+                 SELECT 'Tournament ' || g, %s, %s
+                   FROM generate_series(1, %s) g;""",
+              (PLAN_FIELD, PLAN_ROUNDS, PLAN_TOURNAMENTS))
+
+    c.execute("""SELECT create_tournament_partitions(id) FROM tournament;""")
+
+    c.execute("""INSERT INTO tournament_round (id, tournament_id, status)
+                 SELECT r, tournament.id,
+                        CASE WHEN r <= %s THEN 'COMPLETE' ELSE 'READY' END
+                   FROM tournament, generate_series(1, %s) r;""",
+              (PLAN_ROUNDS_PLAYED, PLAN_ROUNDS))
+
+    #  Each tournament gets its own block of players.  Slot s meets slot
+    #  s XOR r in round r and the lower slot wins
+    c.execute("""INSERT INTO player_tournament_register
+                        (player_id, tournament_id)
+                 SELECT (tournament.id - 1) * %s + s + 1, tournament.id
+                   FROM tournament, generate_series(0, %s - 1) s;""",
+              (PLAN_FIELD, PLAN_FIELD))
+
+    #  The lower slot of each pair wins, so it is also the pairing_id
+    c.execute("""INSERT INTO match_result
+                 SELECT tournament.id, r,
+                        (tournament.id - 1) * %s + s + 1, 10,
+                        (tournament.id - 1) * %s + (s # r) + 1, 5,
+                        (tournament.id - 1) * %s + s + 1
+                   FROM tournament, generate_series(0, %s - 1) s,
+                        generate_series(1, %s) r
+                  WHERE s < (s # r);""",
+              (PLAN_FIELD, PLAN_FIELD, PLAN_FIELD, PLAN_FIELD,
+               PLAN_ROUNDS_PLAYED))
+
+    c.execute("""UPDATE player_tournament_register
+                    SET player_matches = totals.matches,
+                        player_wins = totals.wins,
+                        player_losses = totals.matches - totals.wins
+                   FROM (SELECT player_id, tournament_id,
+                                count(*) AS matches,
+                                SUM(CASE WHEN player_score > opponent_score
+                                         THEN 1 ELSE 0 END) AS wins
+                           FROM tournament_match
+                       GROUP BY player_id, tournament_id) AS totals
+                  WHERE player_tournament_register.player_id =
+                            totals.player_id
+                    AND player_tournament_register.tournament_id =
+                            totals.tournament_id;""")
+
+    c.execute("""UPDATE player_tournament_register
+                    SET opponent_wins = opponent_match_wins.sum
+                   FROM opponent_match_wins
+                  WHERE player_tournament_register.player_id =
+                            opponent_match_wins.player_id
+                    AND player_tournament_register.tournament_id =
+                            opponent_match_wins.tournament_id;""")
+
+    conn.commit()
+
+    conn.autocommit = True
+    conn.cursor().execute("""VACUUM ANALYZE;""")
+    conn.close()
+
+    tournament.configurePool(dsn="dbname=" + PLAN_DATABASE,
+                             cursor_factory=RecordingCursor)
+
+    #  Record the hot path statements themselves rather than EXECUTEs of
+    #  statements prepared on another connection
+    tournament.PREPARED_STATEMENTS = False
+
+
+def recordStatements(function, *args):
+    """  Call function and return the statements it executed. """
+
+    RecordingCursor.statements = []
+
+    try:
+        function(*args)
+
+        return RecordingCursor.statements
+    finally:
+        RecordingCursor.statements = None
+
+
+def sequentialScans(plan):
+    """  Return the names of the tables scanned sequentially in a plan. """
+
+    scans = []
+
+    if plan.get("Node Type") == "Seq Scan":
+        scans.append(plan.get("Relation Name"))
+
+    for child in plan.get("Plans", []):
+        scans.extend(sequentialScans(child))
+
+    return scans
+
+
+def hotScans(tables):
+    """  Return the hot tables among the tables scanned sequentially.  A
+         partitioned table counts only if more than one of its partitions
+         is scanned. """
+
+    scans = [table for table in tables if table in HOT_TABLES]
+    partitions = collections.defaultdict(set)
+
+    #  A self-join or UNION ALL scans the same partition more than once,
+    #  which is still one tournament's rows
+    for table in tables:
+        match = re.match(r"(\w+)_\d+$", table or "")
+
+        if match and match.group(1) in HOT_TABLES:
+            partitions[match.group(1)].add(table)
+
+    scans.extend("%s (%d partitions)" % (table, len(names))
+                 for (table, names) in sorted(partitions.items())
+                 if len(names) > 1)
+
+    return scans
+
+
+def explain(c, statement):
+    """  Return the tables scanned sequentially by a statement's plan. """
+
+    c.execute("EXPLAIN (FORMAT JSON) " + statement)
+
+    plan = c.fetchone()[0]
+
+    if not isinstance(plan, list):
+        plan = json.loads(plan)
+
+    return sequentialScans(plan[0]["Plan"])
+
+
+def pairFromDatabase(tournament_id):
+    """  swissPairings with the brackets read from the database rather
+         than the bracket index. """
+
+    tournament.clearBracketIndex()
+
+    return tournament.swissPairings(tournament_id)
+
+
+def workload():
+    """  Return (name, hot, function, args) for every tournament function
+         that touches the database, using the synthetic data set. """
+
+    tournament_id = 1
+    round_id = PLAN_ROUNDS_PLAYED + 1
+
+    pairings = tournament.swissPairings(tournament_id)
+    [(id1, name1, id2, name2)] = pairings[:1]
+    results = [(p1, 10, p2, 5) for (p1, n1, p2, n2) in pairings[1:]]
+
+    return [
+        ("getCurrentRound", True, tournament.getCurrentRound,
+         (tournament_id,)),
+        ("getNumberOfRounds", True, tournament.getNumberOfRounds,
+         (tournament_id,)),
+        ("getNumberOfPlayers", True, tournament.getNumberOfPlayers,
+         (tournament_id,)),
+        ("playerStandings", True, tournament.playerStandings,
+         (tournament_id,)),
+        ("swissPairings", True, pairFromDatabase, (tournament_id,)),
+        ("swissPairings (indexed)", True, tournament.swissPairings,
+         (tournament_id,)),
+        ("reportMatch", True, tournament.reportMatch,
+         (tournament_id, round_id, id1, 10, id2, 5)),
+        ("reportRound", True, tournament.reportRound,
+         (tournament_id, round_id, results)),
+        ("completeRound", True, tournament.completeRound,
+         (tournament_id,)),
+        ("runMatch", True, tournament.runMatch,
+         (2, id1 + PLAN_FIELD, id2 + PLAN_FIELD)),
+        ("countPlayers", False, tournament.countPlayers, ()),
+        ("getPlayersForTournament", False,
+         tournament.getPlayersForTournament, (PLAN_FIELD,)),
+        ("deleteMatches", False, tournament.deleteMatches,
+         (PLAN_TOURNAMENTS,)),
+    ]
+
+
+def testQueryPlans():
+    createDatabase()
+
+    conn = psycopg2.connect("dbname=" + PLAN_DATABASE)
+    c = conn.cursor()
+
+    failures = []
+
+    for (name, hot, function, args) in workload():
+        for statement in recordStatements(function, *args):
+            if not statement.lstrip().upper().startswith(EXPLAINABLE):
+                continue
+
+            scans = hotScans(explain(c, statement))
+
+            if not scans:
+                continue
+
+            print ("   %s%s: sequential scan of %s" %
+                   (name, "" if hot else " (not a hot path)",
+                    ", ".join(scans)))
+
+            if hot:
+                failures.append(name)
+
+    conn.close()
+    tournament.closePool()
+
+    if failures:
+        raise ValueError("Hot path queries should not use sequential scans: "
+                         + ", ".join(sorted(set(failures))))
+    print "1. No hot path query scans a tournament table sequentially."
+
+
+if __name__ == '__main__':
+    testQueryPlans()
+    print "Success!  All tests pass!"
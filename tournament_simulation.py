@@ -0,0 +1,233 @@
+""" Monte Carlo Simulation of Swiss System Tournaments """
+# !/usr/bin/env python
+#
+#  Description: Runs many complete Swiss tournaments in process with NumPy
+#               to estimate how tournaments of a given size tend to finish
+#               (eg. how many rounds until there is a unique leader).
+#
+#               Nothing is stored.  Matches are scored as MatchSimulator
+#               scores them for runTournament (a score from 1 to 10 for each
+#               player, with no ties), but pairing is simpler than
+#               runTournament's: players are paired with their neighbour in
+#               the standings (ties in wins are broken at random), without
+#               floaters or any check for rematches.  The results are an
+#               estimate of how stored tournaments finish, not a replay.
+#
+#               All the trials in a batch are played together: one round of
+#               every trial is paired with one sort, scored with array
+#               arithmetic and recorded with one array update.  Each trial
+#               draws its numbers from its own generator, seeded with the
+#               seed and the trial number, so the batch size does not change
+#               the results.
+#
+#                   results = simulateTournaments(64, 10000, seed=1)
+#                   results["rounds_to_unique_leader"]
+#
+#               MatchSimulator plays the rounds of a stored tournament for
+#               runTournament in the same way, from a seed.
+
+
+import random
+
+import numpy as np
+
+from tournament_engine import numberOfRounds
+
+
+#  Number of trials played together.  Memory use grows with
+#  batch size * players * rounds.
+SIMULATION_BATCH_SIZE = 1000
+
+
+def simulateTournaments(num_players, num_trials, num_rounds=None, seed=None,
+                        batch_size=SIMULATION_BATCH_SIZE):
+    """  Simulate complete Swiss tournaments and return the distributions of
+         their results.
+
+    Args:
+      num_players: number of players in each tournament (must be even)
+      num_trials: number of tournaments to simulate
+      num_rounds: rounds per tournament (default: as in createTournament)
+      seed: seed for the random number generators.  The same seed and
+            arguments always give the same results, whatever the
+            batch_size.
+      batch_size: number of tournaments simulated together
+
+    Returns:
+      A dict of NumPy arrays of counts over all trials:
+        final_wins: [w] number of players finishing with w wins
+        rank_wins: [k, w] number of times the player ranked k (0 = first,
+                   by wins then opponent match wins) finished with w wins
+        winner_wins: [w] number of tournaments won with w wins
+        leaders: [n] number of tournaments ending with n players tied on
+                 the most wins
+        rounds_to_unique_leader: [r] number of tournaments that first had a
+                 single leader after round r.  The last entry
+                 (num_rounds + 1) counts tournaments that never had one.
+    """
+
+    if num_players % 2 != 0:
+        raise ValueError("Odd number of players not allowed")
+
+    if num_rounds is None:
+        num_rounds = numberOfRounds(num_players)
+
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+
+    results = {
+        "final_wins": np.zeros(num_rounds + 1, dtype=np.int64),
+        "rank_wins": np.zeros((num_players, num_rounds + 1), dtype=np.int64),
+        "winner_wins": np.zeros(num_rounds + 1, dtype=np.int64),
+        "leaders": np.zeros(num_players + 1, dtype=np.int64),
+        "rounds_to_unique_leader": np.zeros(num_rounds + 2, dtype=np.int64),
+    }
+
+    for first_trial in range(0, num_trials, batch_size):
+        trials = min(batch_size, num_trials - first_trial)
+
+        _simulateBatch(seed, first_trial, trials, num_players, num_rounds,
+                       results)
+
+    return results
+
+
+def _simulateBatch(seed, first_trial, trials, num_players, num_rounds,
+                   results):
+    """  Play one batch of tournaments and add them to results. """
+
+    #  Row index of every trial, for indexing one entry per row
+    rows = np.arange(trials)[:, np.newaxis]
+
+    #  Every random number a trial uses, drawn up front from the trial's own
+    #  generator: a tie break for each player and one draw for each match
+    #  of every round
+    ties = np.empty((trials, num_rounds, num_players))
+    draws = np.empty((trials, num_rounds, num_players // 2), dtype=np.int64)
+
+    for trial in range(trials):
+        rng = np.random.RandomState([seed, first_trial + trial])
+        ties[trial] = rng.random_sample((num_rounds, num_players))
+        draws[trial] = rng.randint(0, 90, size=(num_rounds, num_players // 2))
+
+    wins = np.zeros((trials, num_players), dtype=np.int32)
+    opponents = np.zeros((trials, num_rounds, num_players), dtype=np.int32)
+
+    #  Round after which each trial first had a single leader
+    unique_leader = np.full(trials, num_rounds + 1, dtype=np.int32)
+
+    for round_index in range(num_rounds):
+
+        #  Order each trial by wins, breaking ties at random, and pair
+        #  neighbours
+        order = np.lexsort((ties[:, round_index], -wins), axis=-1)
+
+        player1 = order[:, 0::2]
+        player2 = order[:, 1::2]
+
+        #  Each draw from 0..89 is one ordered pair of different scores
+        #  from 1 to 10, as in MatchSimulator.simulateRound
+        score1 = draws[:, round_index] // 9 + 1
+        score2 = draws[:, round_index] % 9 + 1
+        score2 += score2 >= score1
+
+        winners = np.where(score1 > score2, player1, player2)
+
+        wins[rows, winners] += 1
+
+        opponents[rows, round_index, player1] = player2
+        opponents[rows, round_index, player2] = player1
+
+        most_wins = wins.max(axis=1)
+        single = (wins == most_wins[:, np.newaxis]).sum(axis=1) == 1
+        first = single & (unique_leader > num_rounds)
+        unique_leader[first] = round_index + 1
+
+    #  Final standings: wins, then total wins of the opponents faced
+    opponent_wins = wins[rows[:, :, np.newaxis], opponents].sum(axis=1)
+
+    ranking = np.lexsort((-opponent_wins, -wins), axis=-1)
+    ranked_wins = wins[rows, ranking]
+
+    results["final_wins"] += np.bincount(wins.ravel(),
+                                         minlength=num_rounds + 1)
+
+    for rank in range(num_players):
+        results["rank_wins"][rank] += np.bincount(
+            ranked_wins[:, rank], minlength=num_rounds + 1)
+
+    results["winner_wins"] += np.bincount(ranked_wins[:, 0],
+                                          minlength=num_rounds + 1)
+
+    leaders = (wins == ranked_wins[:, :1]).sum(axis=1)
+    results["leaders"] += np.bincount(leaders, minlength=num_players + 1)
+
+    results["rounds_to_unique_leader"] += np.bincount(
+        unique_leader, minlength=num_rounds + 2)
+
+
+class MatchSimulator(object):
+    """  Seeded simulation of the rounds of one tournament.
+
+    Each round's scores come from one call to the random number generator,
+    and the shuffling of score brackets for pairing comes from the same
+    generator, so a tournament run again with the same seed is paired and
+    scored identically.  The generator is seeded with both the seed and the
+    tournament id, so tournaments run with one seed are independent of each
+    other and of the order they are run in.  Further keys (such as a round
+    and pairing for a single match) give the match its own stream.
+    """
+
+    def __init__(self, seed=None, tournament_id=0, *keys):
+        if seed is None:
+            self.rng = np.random.RandomState()
+        else:
+            self.rng = np.random.RandomState([seed, tournament_id] +
+                                             list(keys))
+
+    def pairingRandom(self):
+        """  Return a random.Random for pairPlayers to shuffle brackets. """
+
+        return random.Random(int(self.rng.randint(2 ** 31)))
+
+    def simulateRound(self, pairings):
+        """  Score every match of a round.
+
+        Each match draws one number from 0..89, one for every ordered pair
+        of different scores from 1 to 10, so no match ever has to be
+        replayed to avoid a tie.
+
+        Args:
+          pairings: (id1, name1, id2, name2) tuples
+
+        Returns:
+          A list of (winner, winner_score, loser, loser_score) tuples, as
+          reportRound expects
+        """
+
+        if not pairings:
+            return []
+
+        player1 = np.array([pairing[0] for pairing in pairings])
+        player2 = np.array([pairing[2] for pairing in pairings])
+
+        draws = self.rng.randint(0, 90, size=len(pairings))
+
+        score1 = draws // 9 + 1
+        score2 = draws % 9 + 1
+        score2 += score2 >= score1
+
+        first = score1 > score2
+
+        return zip(np.where(first, player1, player2).tolist(),
+                   np.where(first, score1, score2).tolist(),
+                   np.where(first, player2, player1).tolist(),
+                   np.where(first, score2, score1).tolist())
+
+    def simulateMatch(self, player1, player2):
+        """  Score one match as simulateRound does and return its
+             (winner, winner_score, loser, loser_score) tuple. """
+
+        [result] = self.simulateRound([(player1, None, player2, None)])
+
+        return result
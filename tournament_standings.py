@@ -0,0 +1,150 @@
+""" Array Based Standings and Tiebreaks for Swiss System Tournaments """
+# !/usr/bin/env python
+#
+#  Description: Recomputes a tournament's standings, with tiebreaks, from
+#               its match list.  The players and matches are read in bulk
+#               and held in NumPy arrays; every tiebreak is a vectorized
+#               sum over the matches and the final order is a single
+#               lexsort, so full recomputation stays cheap for tens of
+#               thousands of players.
+#
+#               Players are ranked by, in order:
+#
+#                   wins              matches won
+#                   opponent_wins     total wins of every opponent played
+#                                     (the Buchholz score; there are no
+#                                     draws, so points are wins)
+#                   buchholz_cut1     opponent_wins without the weakest
+#                                     opponent
+#                   sonneborn_berger  total wins of every opponent beaten
+#                   score_difference  points scored less points conceded
+#                   id                lowest first, so the order is the
+#                                     same every time
+#
+#                   standings = detailedStandings(tournament_id)
+
+
+import numpy as np
+
+from tournament import TournamentSession
+
+
+#  Columns of computeStandings, in ranking order after id
+STANDINGS_COLUMNS = ("id", "wins", "matches", "opponent_wins",
+                     "buchholz_cut1", "sonneborn_berger", "score_difference")
+
+
+def computeStandings(player_ids, matches):
+    """  Rank players from their matches.
+
+    Args:
+      player_ids: ids of the players in the tournament
+      matches: (winner_id, winner_score, loser_id, loser_score) rows, one
+               for each match (as in match_result), as a sequence or an
+               (n, 4) array.  The winner is as recorded, whatever the
+               scores, so equal scores and forfeits count as reported.
+
+    Returns:
+      A dict of NumPy arrays, one per name in STANDINGS_COLUMNS, with the
+      players in ranked order
+    """
+
+    ids = np.unique(np.asarray(player_ids, dtype=np.int64))
+    size = len(ids)
+
+    matches = np.asarray(matches, dtype=np.int64).reshape(-1, 4)
+
+    #  Each match from both players' points of view, as in tournament_match
+    winner_ids = np.concatenate((matches[:, 0], matches[:, 0]))
+    player_ids = np.concatenate((matches[:, 0], matches[:, 2]))
+    opponent_ids = np.concatenate((matches[:, 2], matches[:, 0]))
+    scores = np.concatenate((matches[:, 1], matches[:, 3]))
+    opponent_scores = np.concatenate((matches[:, 3], matches[:, 1]))
+
+    #  Positions of each match's player and opponent in ids
+    player = np.searchsorted(ids, player_ids)
+    opponent = np.searchsorted(ids, opponent_ids)
+    won = player_ids == winner_ids
+
+    wins = np.bincount(player, weights=won, minlength=size)
+    played = np.bincount(player, minlength=size)
+
+    opponent_wins = wins[opponent]
+
+    buchholz = np.bincount(player, weights=opponent_wins, minlength=size)
+    sonneborn_berger = np.bincount(player, weights=opponent_wins * won,
+                                   minlength=size)
+    score_difference = np.bincount(player, weights=scores - opponent_scores,
+                                   minlength=size)
+
+    #  Weakest opponent of each player: sort the matches by player, then
+    #  opponent wins, and take each player's first match
+    weakest = np.zeros(size)
+
+    if len(player):
+        order = np.lexsort((opponent_wins, player))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = player[order][1:] != player[order][:-1]
+        weakest[player[order][first]] = opponent_wins[order][first]
+
+    columns = {
+        "id": ids,
+        "wins": wins.astype(np.int64),
+        "matches": played.astype(np.int64),
+        "opponent_wins": buchholz.astype(np.int64),
+        "buchholz_cut1": (buchholz - weakest).astype(np.int64),
+        "sonneborn_berger": sonneborn_berger.astype(np.int64),
+        "score_difference": score_difference.astype(np.int64),
+    }
+
+    #  lexsort sorts by the last key first
+    ranking = np.lexsort((ids,
+                          -columns["score_difference"],
+                          -columns["sonneborn_berger"],
+                          -columns["buchholz_cut1"],
+                          -columns["opponent_wins"],
+                          -columns["wins"]))
+
+    return dict((name, column[ranking]) for name, column in columns.items())
+
+
+def detailedStandings(tournament_id):
+    """  Return a tournament's standings with every tiebreak.
+
+    The players and the match list are each read with one query in one
+    transaction.
+
+    Args:
+      tournament_id: ID of the tournament to report
+
+    Returns:
+      A list of (id, name, wins, matches, opponent_wins, buchholz_cut1,
+      sonneborn_berger, score_difference) tuples, first place first
+    """
+
+    with TournamentSession() as session:
+        session.c.execute("""SELECT player.id, player.name
+                               FROM player, player_tournament_register
+                              WHERE player.id =
+                                        player_tournament_register.player_id
+                                AND player_tournament_register
+                                        .tournament_id = ( %s );""",
+                          (tournament_id,))
+
+        names = dict(session.c.fetchall())
+
+        session.c.execute("""SELECT winner_id, winner_score,
+                                    loser_id, loser_score
+                               FROM match_result
+                              WHERE tournament_id = ( %s );""",
+                          (tournament_id,))
+
+        matches = session.c.fetchall()
+
+    standings = computeStandings(list(names), matches)
+
+    return [(player_id, names[player_id]) + tuple(values)
+            for (player_id, values) in
+            zip(standings["id"].tolist(),
+                zip(*[standings[name].tolist()
+                      for name in STANDINGS_COLUMNS[1:]]))]
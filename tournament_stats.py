@@ -0,0 +1,364 @@
+""" Instrumentation for the Swiss System Tournament """
+# !/usr/bin/env python
+#
+#  Description: Counts what the tournament.py functions cost: wall time,
+#               SQL statements run, rows returned and database connections
+#               opened, per public function and per tournament.  Statements
+#               slower than a threshold are logged (to the "tournament"
+#               logger) and kept in a slow query log.
+#
+#               Instrumentation is off until enabled and then costs one
+#               check per call:
+#
+#                   enableInstrumentation(slow_query_seconds=0.1)
+#                   runTournament(tournament_id)
+#                   stats = instrumentationSnapshot()
+#                   stats["functions"]["runTournament"]["statements"]
+#                   resetInstrumentation()
+
+import collections
+import functools
+import inspect
+import logging
+import threading
+import timeit
+
+
+#  Number of slow statements kept in the slow query log
+SLOW_QUERY_LOG_SIZE = 100
+
+log = logging.getLogger("tournament")
+log.addHandler(logging.NullHandler())
+
+_stats = None
+
+#  The calls in progress in each thread, innermost last
+_local = threading.local()
+
+
+class _Counters(object):
+    """  Counts for a function, a tournament or everything. """
+
+    __slots__ = ("calls", "seconds", "statements", "rows", "connections")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.connections = 0
+
+    def add(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.statements += other.statements
+        self.rows += other.rows
+        self.connections += other.connections
+
+    def asDict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class _Stats(object):
+    """  Everything recorded since instrumentation was enabled or reset. """
+
+    def __init__(self, slow_query_seconds):
+        self.slow_query_seconds = slow_query_seconds
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = _Counters()
+            self.functions = collections.defaultdict(_Counters)
+            self.tournaments = collections.defaultdict(_Counters)
+            self.slow_queries = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def recordCall(self, name, call):
+        #  Work done by nested calls is already part of the outer call
+        enclosing = _calls()
+
+        with self.lock:
+            self.functions[name].add(call)
+
+            if not enclosing:
+                self.totals.calls += 1
+                self.totals.seconds += call.seconds
+
+            if call.tournament_id is not None and \
+                    all(outer.tournament_id != call.tournament_id
+                        for outer in enclosing):
+                self.tournaments[call.tournament_id].add(call)
+
+    def recordStatement(self, statement, seconds, rows):
+        calls = _calls()
+
+        with self.lock:
+            for counters in [self.totals] + calls:
+                counters.statements += 1
+                counters.rows += rows
+
+            if self.slow_query_seconds is None or \
+                    seconds < self.slow_query_seconds:
+                return
+
+            function = calls[-1].name if calls else None
+
+            self.slow_queries.append({"seconds": seconds,
+                                      "function": function,
+                                      "statement": statement})
+
+        log.warning("Slow query (%.3f s) in %s: %s",
+                    seconds, function, statement)
+
+    def recordRows(self, rows):
+        with self.lock:
+            for counters in [self.totals] + _calls():
+                counters.rows += rows
+
+    def recordConnection(self):
+        with self.lock:
+            for counters in [self.totals] + _calls():
+                counters.connections += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "totals": self.totals.asDict(),
+                "functions": dict((name, counters.asDict()) for
+                                  name, counters in self.functions.items()),
+                "tournaments": dict((tournament_id, counters.asDict()) for
+                                    tournament_id, counters in
+                                    self.tournaments.items()),
+                "slow_queries": list(self.slow_queries),
+            }
+
+
+class _Call(_Counters):
+    """  Counts for one call in progress. """
+
+    __slots__ = ("name", "tournament_id")
+
+    def __init__(self, name, tournament_id):
+        _Counters.__init__(self)
+        self.name = name
+        self.tournament_id = tournament_id
+        self.calls = 1
+
+
+def _calls():
+    """  Return the calls in progress in this thread. """
+
+    calls = getattr(_local, "calls", None)
+
+    if calls is None:
+        calls = _local.calls = []
+
+    return calls
+
+
+def enableInstrumentation(slow_query_seconds=None):
+    """  Start recording.  Anything recorded before is discarded.
+
+    Args:
+      slow_query_seconds: statements taking at least this long are logged
+                          and kept in the slow query log (default: none)
+    """
+
+    global _stats
+
+    _stats = _Stats(slow_query_seconds)
+
+
+def disableInstrumentation():
+    """  Stop recording and discard everything recorded. """
+
+    global _stats
+
+    _stats = None
+
+
+def resetInstrumentation():
+    """  Discard everything recorded so far and keep recording. """
+
+    if _stats is not None:
+        _stats.reset()
+
+
+def instrumentationSnapshot():
+    """  Return a copy of everything recorded so far.
+
+    Returns:
+      None if instrumentation is off, otherwise a dict of:
+        totals: counts for everything run
+        functions: counts for each public function by name
+        tournaments: counts for each tournament by id
+        slow_queries: the latest slow statements as dicts of seconds,
+                      function and statement
+      Counts are dicts of calls, seconds, statements, rows and connections.
+      A function's counts include the calls it makes to other functions;
+      the totals and each tournament count those only once.
+    """
+
+    if _stats is None:
+        return None
+
+    return _stats.snapshot()
+
+
+def instrumented(function):
+    """  Decorator that records the calls of a public function.  Calls are
+         also counted against their tournament_id argument, if any. """
+
+    name = function.__name__
+    argnames = inspect.getargspec(function).args
+
+    if "tournament_id" in argnames:
+        position = argnames.index("tournament_id")
+    else:
+        position = None
+
+    def tournamentOf(args, kwargs):
+        if position is None:
+            return None
+        if position < len(args):
+            return args[position]
+        return kwargs.get("tournament_id")
+
+    if inspect.isgeneratorfunction(function):
+
+        #  Count only the time spent producing each item
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = _stats
+
+            if stats is None:
+                for item in function(*args, **kwargs):
+                    yield item
+                return
+
+            call = _Call(name, tournamentOf(args, kwargs))
+            items = function(*args, **kwargs)
+
+            try:
+                while True:
+                    calls = _calls()
+                    calls.append(call)
+                    start = timeit.default_timer()
+
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        call.seconds += timeit.default_timer() - start
+                        calls.pop()
+
+                    yield item
+            finally:
+                items.close()
+
+                stats.recordCall(name, call)
+
+        return wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        stats = _stats
+
+        if stats is None:
+            return function(*args, **kwargs)
+
+        call = _Call(name, tournamentOf(args, kwargs))
+        calls = _calls()
+        calls.append(call)
+        start = timeit.default_timer()
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            call.seconds = timeit.default_timer() - start
+            calls.pop()
+
+            stats.recordCall(name, call)
+
+    return wrapper
+
+
+def recordConnection():
+    """  Count a new database connection. """
+
+    stats = _stats
+
+    if stats is not None:
+        stats.recordConnection()
+
+
+def instrumentCursor(cursor):
+    """  Return cursor, wrapped so that its statements are recorded if
+         instrumentation is on. """
+
+    if _stats is None:
+        return cursor
+
+    return _CursorProbe(cursor)
+
+
+class _CursorProbe(object):
+    """  Wraps a psycopg2 cursor and records each statement it runs.  Rows
+         are counted as the statement returns them, or as they are fetched
+         from a named (server-side) cursor. """
+
+    def __init__(self, cursor):
+        object.__setattr__(self, "_cursor", cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        if self._cursor.name is None:
+            return iter(self._cursor)
+
+        return self._iterNamed()
+
+    def _iterNamed(self):
+        for row in self._cursor:
+            stats = _stats
+
+            if stats is not None:
+                stats.recordRows(1)
+
+            yield row
+
+    def execute(self, query, vars=None):
+        return self._run(query, self._cursor.execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._run(query, self._cursor.executemany, query, vars_list)
+
+    def copy_from(self, file, table, *args, **kwargs):
+        return self._run("COPY %s FROM STDIN" % table, self._cursor.copy_from,
+                         file, table, *args, **kwargs)
+
+    def _run(self, statement, method, *args, **kwargs):
+        start = timeit.default_timer()
+
+        try:
+            return method(*args, **kwargs)
+        finally:
+            seconds = timeit.default_timer() - start
+
+            stats = _stats
+            cursor = self._cursor
+
+            if stats is not None:
+                if cursor.description is not None and cursor.name is None:
+                    rows = max(cursor.rowcount, 0)
+                else:
+                    rows = 0
+
+                stats.recordStatement(cursor.query or statement, seconds,
+                                      rows)
@@ -16,7 +16,21 @@
 #                   player as well as the winner and loser 
 #
 
+import random
+import threading
+from io import BytesIO
+
 from tournament import *
+from tournament_async import (async_countPlayers, async_deletePlayers,
+                              async_deleteTournaments, async_playerStandings,
+                              async_registerPlayers, async_reportRound,
+                              async_setupTournament, async_swissPairings, wait)
+from tournament_engine import (MemoryBackend, PostgresBackend, SQLiteBackend,
+                               pairPlayers)
+from tournament_simulation import simulateTournaments
+from tournament_standings import computeStandings, detailedStandings
+from tournament_stats import (disableInstrumentation, enableInstrumentation,
+                              instrumentationSnapshot, resetInstrumentation)
 
 def testDeleteTournaments():
     deleteTournaments()
@@ -151,6 +165,730 @@ def testPairings():
     print "8. After one match, players with one win are paired."
 
 
+def testConnectionPool():
+    deleteTournaments()
+    deletePlayers()
+    try:
+        with getConnection() as conn:
+            c = conn.cursor()
+            c.execute("""INSERT INTO player (name) VALUES ( %s );""",
+                      ("Rollback Ralph",))
+            raise RuntimeError("abort the block")
+    except RuntimeError:
+        pass
+    if countPlayers() != 0:
+        raise ValueError("A failed block should roll back its changes.")
+    with getConnection() as conn1:
+        pass
+    with getConnection() as conn2:
+        pass
+    if conn1 is not conn2:
+        raise ValueError("Connections should be reused from the pool.")
+    print "9. Pooled connections are reused and roll back on error."
+
+
+def testSession():
+    deleteTournaments()
+    deletePlayers()
+    with TournamentSession() as session:
+        session.registerPlayer("Ada Lovelace")
+        session.registerPlayer("Alan Turing")
+        tournament_id = session.createTournament("Session Tourney", 2)
+        session.setupTournament(tournament_id)
+        if session.countPlayers() != 2:
+            raise ValueError("A session should see its own uncommitted work.")
+        session.rollback()
+    if countPlayers() != 0:
+        raise ValueError("Rolled back session work should not be saved.")
+    with TournamentSession() as session:
+        session.registerPlayer("Ada Lovelace")
+        session.registerPlayer("Alan Turing")
+        tournament_id = session.createTournament("Session Tourney", 2)
+        session.setupTournament(tournament_id)
+        [(id1, n1, id2, n2)] = session.swissPairings(tournament_id)
+        session.reportMatch(tournament_id, 1, id1, 10, id2, 3)
+        session.completeRound(tournament_id)
+    standings = playerStandings(tournament_id)
+    if [row[0] for row in standings] != [id1, id2]:
+        raise ValueError("A committed session should save the whole round.")
+    print "10. A session commits or rolls back its operations as one unit."
+
+
+def testRegisterPlayers():
+    deleteTournaments()
+    deletePlayers()
+    names = ("Player %d" % i for i in range(1, 2501))
+    player_ids = registerPlayers(names, batch_size=1000)
+    if len(player_ids) != 2500 or countPlayers() != 2500:
+        raise ValueError("registerPlayers should register every name.")
+    if len(set(player_ids)) != 2500:
+        raise ValueError("registerPlayers should return unique player ids.")
+    [tab_id] = registerPlayers(["Tab\tBackslash\\Name"])
+    with getConnection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT id, name FROM player WHERE id IN ( %s, %s );""",
+                  (player_ids[1234], tab_id))
+        names = dict(c.fetchall())
+    if names[player_ids[1234]] != "Player 1235":
+        raise ValueError("registerPlayers should return ids in input order.")
+    if names[tab_id] != "Tab\tBackslash\\Name":
+        raise ValueError("registerPlayers should store names unchanged.")
+    print "11. Players can be registered in bulk."
+
+
+def testReportRound():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers(["Kirk", "Spock", "McCoy", "Uhura"])
+    tournament_id = createTournament("Test Tourney4", 4)
+    setupTournament(tournament_id)
+    standings = playerStandings(tournament_id)
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    reportRound(tournament_id, 1, [(id1, 10, id2, 9), (id3, 8, id4, 7)])
+    if getCurrentRound(tournament_id) != 2:
+        raise ValueError("reportRound should complete the round.")
+    standings = playerStandings(tournament_id)
+    for (i, n, w, m) in standings:
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if i in (id1, id3) and w != 1:
+            raise ValueError("Each match winner should have one win recorded.")
+        elif i in (id2, id4) and w != 0:
+            raise ValueError("Each match loser should have zero wins recorded.")
+    print "12. A whole round of results can be reported at once."
+
+
+def testBackends():
+    for backend in (MemoryBackend(), SQLiteBackend()):
+        backend.registerPlayers("Player %d" % i for i in range(1, 1025))
+        tournament_id = backend.createTournament("Backend Tourney", 1024)
+        backend.setupTournament(tournament_id)
+        backend.runTournament(tournament_id)
+        standings = backend.playerStandings(tournament_id)
+        if len(standings) != 1024:
+            raise ValueError("Every registered player should be in standings.")
+        if [m for (i, n, w, m) in standings] != [10] * 1024:
+            raise ValueError("Each player should play one match per round.")
+        if sum(w for (i, n, w, m) in standings) != 512 * 10:
+            raise ValueError("Each match should record exactly one win.")
+        if standings[0][2] < standings[-1][2]:
+            raise ValueError("Standings should be sorted by wins.")
+    print "13. Tournaments run on the in-memory and SQLite backends."
+
+
+def testOpponentWins():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_id = createTournament("Test Tourney5", 16)
+    setupTournament(tournament_id)
+    runTournament(tournament_id)
+    with getConnection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT count(*)
+                       FROM player_tournament_register
+                            LEFT JOIN opponent_match_wins ON
+                                player_tournament_register.tournament_id =
+                                    opponent_match_wins.tournament_id
+                            AND player_tournament_register.player_id =
+                                    opponent_match_wins.player_id
+                      WHERE player_tournament_register.tournament_id = %s
+                        AND player_tournament_register.opponent_wins <>
+                                coalesce(opponent_match_wins.sum, 0);""",
+                  (tournament_id,))
+        mismatches = c.fetchone()[0]
+    if mismatches != 0:
+        raise ValueError("Stored opponent wins should match the matches.")
+    print "14. Opponent wins are kept current as results are reported."
+
+
+def testNoRematches():
+    players = [(1, "A", 1), (2, "B", 1), (3, "C", 0), (4, "D", 0)]
+    opponents = {1: set([2]), 2: set([1]), 3: set([4]), 4: set([3])}
+    pairs = set(frozenset([id1, id2])
+                for (id1, n1, id2, n2) in pairPlayers(players, opponents))
+    if pairs & set([frozenset([1, 2]), frozenset([3, 4])]):
+        raise ValueError("Players should not be paired with a past opponent.")
+    for num_players in (6, 10, 32):
+        backend = MemoryBackend()
+        backend.registerPlayers("Player %d" % i for i in range(num_players))
+        tournament_id = backend.createTournament("Rematch Tourney",
+                                                 num_players)
+        backend.setupTournament(tournament_id)
+        backend.runTournament(tournament_id)
+        num_rounds = backend.getNumberOfRounds(tournament_id)
+        opponents = backend.getOpponents(tournament_id)
+        if [len(played) for played in opponents.values()] != \
+                [num_rounds] * num_players:
+            raise ValueError("No two players should meet twice.")
+    print "15. Pairings avoid rematches."
+
+
+def testSimulation():
+    results = simulateTournaments(24, 500, seed=7, batch_size=200)
+    again = simulateTournaments(24, 500, seed=7)
+    for name in results:
+        if (results[name] != again[name]).any():
+            raise ValueError("The same seed should give the same results.")
+    if results["final_wins"].sum() != 24 * 500:
+        raise ValueError("Every player of every trial should be counted.")
+    if (results["final_wins"] * range(6)).sum() != 12 * 5 * 500:
+        raise ValueError("Each simulated match should record one win.")
+    if results["winner_wins"].sum() != 500:
+        raise ValueError("Every trial should have one winner.")
+    print "16. Tournaments can be simulated in bulk."
+
+
+def testRunTournaments():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 33))
+    tournament_ids = [createTournament("Flight %d" % i, 32)
+                      for i in range(1, 4)]
+    for tournament_id in tournament_ids:
+        setupTournament(tournament_id)
+    missing_id = max(tournament_ids) + 1
+    results = runTournaments(tournament_ids + [missing_id], workers=2)
+    if [tournament_id for (tournament_id, error) in results] != \
+            tournament_ids + [missing_id]:
+        raise ValueError("runTournaments should report every tournament.")
+    if [error for (tournament_id, error) in results[:3]] != [None] * 3:
+        raise ValueError("Independent tournaments should all complete.")
+    if results[3][1] is None:
+        raise ValueError("A failed tournament should report its error.")
+    for tournament_id in tournament_ids:
+        if [m for (i, n, w, m) in playerStandings(tournament_id)] != [5] * 32:
+            raise ValueError("Every round of each tournament should be run.")
+    print "17. Independent tournaments can run in parallel."
+
+
+def testAsync():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_ids = [createTournament("Table %d" % i, 16)
+                      for i in range(1, 11)]
+    for tournament_id in tournament_ids:
+        setupTournament(tournament_id)
+    [count] = wait([async_countPlayers()])
+    if count != 16:
+        raise ValueError("async_countPlayers should match countPlayers.")
+    pairings = wait(async_swissPairings(tournament_id)
+                    for tournament_id in tournament_ids)
+    wait(async_reportRound(tournament_id, 1,
+                           [(id1, 10, id2, 5)
+                            for (id1, name1, id2, name2) in pairs])
+         for tournament_id, pairs in zip(tournament_ids, pairings))
+    standings = wait(async_playerStandings(tournament_id)
+                     for tournament_id in tournament_ids)
+    for tournament_id, table in zip(tournament_ids, standings):
+        if table != playerStandings(tournament_id):
+            raise ValueError("Async standings should match playerStandings.")
+        if sorted(w for (i, n, w, m) in table) != [0] * 8 + [1] * 8:
+            raise ValueError("Each async round should record 8 winners.")
+        if getCurrentRound(tournament_id) != 2:
+            raise ValueError("async_reportRound should complete the round.")
+    print "18. Concurrent tournaments can be served asynchronously."
+
+
+def testStandingsCache():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 9))
+    tournament_id = createTournament("Cached", 8)
+    setupTournament(tournament_id)
+    clearStandingsCache()
+    if playerStandings(tournament_id) != playerStandings(tournament_id):
+        raise ValueError("Cached standings should match the database.")
+    info = standingsCacheInfo()
+    if (info["hits"], info["misses"]) != (1, 1):
+        raise ValueError("Repeated standings should be served from cache.")
+    [(id1, name1, id2, name2)] = swissPairings(tournament_id)[:1]
+    reportMatch(tournament_id, 1, id1, 10, id2, 5)
+    standings = playerStandings(tournament_id)
+    if standings[0][0] != id1 or standingsCacheInfo()["misses"] != 2:
+        raise ValueError("reportMatch should invalidate cached standings.")
+    deleteMatches(tournament_id)
+    if [w for (i, n, w, m) in playerStandings(tournament_id)] != [0] * 8:
+        raise ValueError("deleteMatches should invalidate cached standings.")
+    print "19. Standings are cached until results change."
+
+
+def testStreaming():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_id = createTournament("Streamed", 16)
+    setupTournament(tournament_id)
+    for (id1, name1, id2, name2) in swissPairings(tournament_id):
+        reportMatch(tournament_id, 1, id1, 10, id2, 5)
+    if list(iterPlayerStandings(tournament_id, 3)) != \
+            playerStandings(tournament_id):
+        raise ValueError("Streamed standings should match playerStandings.")
+    out = BytesIO()
+    reportPlayerStandings(iterPlayerStandings(tournament_id, 3), out=out)
+    if len(out.getvalue().splitlines()) != 2 + 16:
+        raise ValueError("reportPlayerStandings should write every player.")
+    pairings = list(iterSwissPairings(tournament_id, 3))
+    paired = [p for (id1, n1, id2, n2) in pairings for p in (id1, id2)]
+    if sorted(paired) != sorted(i for (i, n, w, m) in
+                                playerStandings(tournament_id)):
+        raise ValueError("Streamed pairings should pair every player once.")
+    print "20. Standings and pairings can be streamed."
+
+
+def testInstrumentation():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 9))
+    tournament_id = createTournament("Measured", 8)
+    setupTournament(tournament_id)
+    clearStandingsCache()
+    enableInstrumentation(slow_query_seconds=0)
+    try:
+        playerStandings(tournament_id)
+        playerStandings(tournament_id)
+        runTournament(tournament_id)
+        stats = instrumentationSnapshot()
+    finally:
+        disableInstrumentation()
+    standings = stats["functions"]["playerStandings"]
+    if standings["calls"] != 2 or standings["statements"] != 1:
+        raise ValueError("Only the uncached standings should run a query.")
+    if standings["rows"] != 8:
+        raise ValueError("The rows returned by each call should be counted.")
+    run = stats["tournaments"][tournament_id]
+    if run["calls"] != 3 or run["statements"] <= standings["statements"]:
+        raise ValueError("Calls should be counted for their tournament.")
+    if not stats["slow_queries"]:
+        raise ValueError("Statements over the threshold should be logged.")
+    print "21. Calls, statements and rows are instrumented."
+
+
+def testPreparedStatements():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 9))
+    tournament_id = createTournament("Prepared", 8)
+    setupTournament(tournament_id)
+    #  getCurrentRound reads the round with a prepared statement
+    pairings = swissPairings(tournament_id)
+    round_id = getCurrentRound(tournament_id)
+    for (id1, name1, id2, name2) in pairings[:2]:
+        reportMatch(tournament_id, round_id, id1, 10, id2, 5)
+    with TournamentSession() as session:
+        session.c.execute("""SELECT name FROM pg_prepared_statements;""")
+        prepared = set(row[0] for row in session.c.fetchall())
+    if not set(["tournament_current_round",
+                "tournament_record_matches"]) <= prepared:
+        raise ValueError("Hot path statements should be prepared.")
+    #  New connections must prepare the statements again
+    closePool()
+    for (id1, name1, id2, name2) in pairings[2:]:
+        reportMatch(tournament_id, round_id, id1, 10, id2, 5)
+    if sorted(w for (i, n, w, m) in playerStandings(tournament_id)) != \
+            [0] * 4 + [1] * 4:
+        raise ValueError("Prepared statements should record every match.")
+    print "22. Hot path statements are prepared once per connection."
+
+
+def testTournamentHandle():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 9))
+    tournament = getTournament(createTournament("Handled", 8))
+    if (tournament.name, tournament.num_players, tournament.num_rounds,
+            tournament.current_round) != ("Handled", 8, 3, 1):
+        raise ValueError("The handle should load the tournament details.")
+    tournament.setup()
+    for (id1, name1, id2, name2) in tournament.swissPairings():
+        tournament.runMatch(id1, id2)
+    tournament.completeRound()
+    if tournament.current_round != 2 or \
+            getCurrentRound(tournament.id) != 2:
+        raise ValueError("Completing a round should move the handle on.")
+    tournament.reportRound([(id1, 10, id2, 5) for (id1, n1, id2, n2)
+                            in tournament.swissPairings()])
+    tournament.completeRound()
+    if tournament.current_round is not None:
+        raise ValueError("The handle should know the last round is done.")
+    try:
+        tournament.completeRound()
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A finished tournament should refuse more rounds.")
+    if [m for (i, n, w, m) in tournament.playerStandings()] != [2] * 8:
+        raise ValueError("Matches should be played in the handle's rounds.")
+    if getTournament(tournament.id + 1) is not None:
+        raise ValueError("getTournament should return None if not found.")
+    print "23. A tournament handle tracks the current round."
+
+
+def testTiebreaks():
+    results = [(1, 10, 2, 5), (3, 7, 4, 6), (1, 8, 3, 2), (4, 9, 2, 1)]
+    standings = computeStandings([1, 2, 3, 4], results)
+    if standings["id"].tolist() != [1, 3, 4, 2]:
+        raise ValueError("Ties should be broken by opponent match wins.")
+    if standings["buchholz_cut1"].tolist() != [1, 2, 1, 2] or \
+            standings["sonneborn_berger"].tolist() != [1, 1, 0, 0] or \
+            standings["score_difference"].tolist() != [11, -5, 7, -13]:
+        raise ValueError("Tiebreaks should be computed from the matches.")
+    tied = computeStandings([1, 2], [(2, 5, 1, 5)])
+    if tied["id"].tolist() != [2, 1] or tied["wins"].tolist() != [1, 0]:
+        raise ValueError("The recorded winner should win a tied score.")
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_id = createTournament("Tiebreaks", 16)
+    setupTournament(tournament_id)
+    runTournament(tournament_id)
+    detailed = detailedStandings(tournament_id)
+    if sorted(row[:4] for row in detailed) != \
+            sorted(playerStandings(tournament_id)):
+        raise ValueError("Detailed standings should match playerStandings.")
+    keys = [(-row[2], -row[4], -row[5], -row[6], -row[7], row[0])
+            for row in detailed]
+    if keys != sorted(keys):
+        raise ValueError("Detailed standings should be in tiebreak order.")
+    print "24. Tiebreaks are computed from the match list."
+
+
+def testSeededSimulation():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 33))
+    tournament_id = createTournament("Seeded", 32)
+    setupTournament(tournament_id)
+    runs = []
+    for seed in (7, 7, 8):
+        deleteMatches(tournament_id)
+        runTournament(tournament_id, seed=seed)
+        with TournamentSession() as session:
+            session.c.execute("""SELECT * FROM tournament_match
+                                  WHERE tournament_id = %s
+                               ORDER BY round_id, player_id;""",
+                              (tournament_id,))
+            runs.append(session.c.fetchall())
+    if runs[0] != runs[1]:
+        raise ValueError("Runs with the same seed should be identical.")
+    if runs[0] == runs[2]:
+        raise ValueError("Runs with different seeds should differ.")
+    if any(row[3] == row[5] for row in runs[0]):
+        raise ValueError("Simulated matches should never be tied.")
+    matches = []
+    for seed in (7, 7):
+        deleteMatches(tournament_id)
+        runMatch(tournament_id, runs[0][0][0], runs[0][0][4], seed)
+        with TournamentSession() as session:
+            session.c.execute("""SELECT * FROM match_result
+                                  WHERE tournament_id = %s;""",
+                              (tournament_id,))
+            matches.append(session.c.fetchall())
+    if len(matches[0]) != 1 or matches[0] != matches[1]:
+        raise ValueError("A seeded match should be played reproducibly.")
+    print "25. Seeded tournaments are simulated reproducibly."
+
+
+def testSingleRowMatches():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 9))
+    tournament_id = createTournament("Single Row", 8)
+    setupTournament(tournament_id)
+    runTournament(tournament_id)
+    with TournamentSession() as session:
+        session.c.execute("""SELECT count(*) FROM match_result
+                              WHERE tournament_id = %s
+                                AND winner_score > loser_score;""",
+                          (tournament_id,))
+        stored = session.c.fetchone()[0]
+        session.c.execute("""SELECT count(*) FROM tournament_match
+                              WHERE tournament_id = %s;""",
+                          (tournament_id,))
+        projected = session.c.fetchone()[0]
+    if stored != 12:
+        raise ValueError("Each match should be stored once, winner first.")
+    if projected != 24:
+        raise ValueError("tournament_match should show each match twice.")
+    if [m for (i, n, w, m) in playerStandings(tournament_id)] != [3] * 8:
+        raise ValueError("Standings should count both sides of a match.")
+    print "26. Each match is stored once and viewed from both sides."
+
+
+def testStandingsHistory():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_id = createTournament("History", 16)
+    setupTournament(tournament_id)
+    runTournament(tournament_id, seed=3)
+    history = [sorted(standingsAsOf(tournament_id, k)) for k in range(5)]
+    if [set(m for (i, n, w, m) in standings) for standings in history] != \
+            [set([k]) for k in range(5)]:
+        raise ValueError("standingsAsOf should stop at the round asked for.")
+    if history[4] != sorted(playerStandings(tournament_id)):
+        raise ValueError("Standings as of the last round should be current.")
+    with TournamentSession() as session:
+        session.c.execute("""DELETE FROM round_standings
+                              WHERE tournament_id = %s AND round_id > 1;""",
+                          (tournament_id,))
+    if [sorted(standingsAsOf(tournament_id, k)) for k in range(5)] != \
+            history:
+        raise ValueError("Rounds after a snapshot should be replayed.")
+    if undoRound(tournament_id) != 4 or getCurrentRound(tournament_id) != 4:
+        raise ValueError("undoRound should take back the last round.")
+    if sorted(playerStandings(tournament_id)) != history[3]:
+        raise ValueError("Undoing a round should restore the standings.")
+    with TournamentSession() as session:
+        session.c.execute("""UPDATE player_tournament_register
+                                SET player_wins = 0, opponent_wins = 0
+                              WHERE tournament_id = %s;""",
+                          (tournament_id,))
+    rebuildStandings(tournament_id)
+    if sorted(playerStandings(tournament_id)) != history[3]:
+        raise ValueError("rebuildStandings should repair the records.")
+    print "27. Standings can be replayed, undone and rebuilt by round."
+
+
+def partitionsOf(tournament_id):
+    with TournamentSession() as session:
+        session.c.execute("""SELECT inhrelid::regclass::text
+                               FROM pg_inherits
+                              WHERE inhrelid::regclass::text ~ %s
+                           ORDER BY 1;""",
+                          ("_%d$" % tournament_id,))
+        return [row[0] for row in session.c.fetchall()]
+
+
+def testPartitions():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 9))
+    tournament_id = createTournament("Partitioned", 8)
+    if partitionsOf(tournament_id) != \
+            ["match_result_%d" % tournament_id,
+             "player_tournament_register_%d" % tournament_id,
+             "round_standings_%d" % tournament_id]:
+        raise ValueError("createTournament should create its partitions.")
+    setupTournament(tournament_id)
+    runTournament(tournament_id)
+    deleteMatches(tournament_id)
+    if getOpponents(tournament_id) or \
+            standingsAsOf(tournament_id, 3) != \
+            standingsAsOf(tournament_id, 0):
+        raise ValueError("deleteMatches should empty the partitions.")
+    if [(w, m) for (i, n, w, m) in playerStandings(tournament_id)] != \
+            [(0, 0)] * 8:
+        raise ValueError("deleteMatches should reset the standings.")
+    deleteMatches(tournament_id + 1000)
+    deleteTournaments()
+    if partitionsOf(tournament_id):
+        raise ValueError("deleteTournaments should drop the partitions.")
+    print "28. Each tournament has its own partitions."
+
+
+def testSetupStrategies():
+    deleteTournaments()
+    deletePlayers()
+    player_ids = registerPlayers("Player %d" % i for i in range(1, 41))
+    fields = []
+    for (name, strategy, seed) in (("By id", "id", None),
+                                   ("Random", "random", 11),
+                                   ("Random again", "random", 11),
+                                   ("Other seed", "random", 12)):
+        tournament_id = createTournament(name, 16)
+        setupTournament(tournament_id, strategy, seed)
+        fields.append(sorted(i for (i, n, w, m)
+                             in playerStandings(tournament_id)))
+    if fields[0] != player_ids[:16]:
+        raise ValueError("The id strategy should take the first players.")
+    if any(len(set(field)) != 16 or not set(field) <= set(player_ids)
+           for field in fields):
+        raise ValueError("Every strategy should register a full field.")
+    if fields[1] != fields[2] or fields[1] == fields[3]:
+        raise ValueError("Random fields should depend only on the seed.")
+    try:
+        setupTournament(createTournament("Unknown", 16), "rating")
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Unknown setup strategies should be refused.")
+    print "29. Players can be chosen for a tournament in one statement."
+
+
+def testConcurrentReporting():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_id = createTournament("Scorekeepers", 16)
+    setupTournament(tournament_id)
+    results = [(id1, 10, id2, 5) for (id1, n1, id2, n2)
+               in swissPairings(tournament_id)]
+    reportMatch(tournament_id, 1, *results[0])
+    reportMatch(tournament_id, 1, *results[0])
+    try:
+        reportMatch(tournament_id, 1, results[0][2], 10, results[0][0], 5)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("A different result for a match should be refused.")
+    judges = [threading.Thread(target=reportRound,
+                               args=(tournament_id, 1, results))
+              for x in range(4)]
+    for judge in judges:
+        judge.start()
+    for judge in judges:
+        judge.join()
+    completeRound(tournament_id, 1)
+    if sorted(w for (i, n, w, m) in playerStandings(tournament_id)) != \
+            [0] * 8 + [1] * 8:
+        raise ValueError("Each result should be counted once.")
+    if getCurrentRound(tournament_id) != 2:
+        raise ValueError("Completing a round twice should complete it once.")
+    print "30. Results reported more than once are counted once."
+
+
+def testBracketIndex():
+    deleteTournaments()
+    deletePlayers()
+    registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_id = createTournament("Bracketed", 16)
+    setupTournament(tournament_id)
+    clearBracketIndex()
+    enableInstrumentation()
+    try:
+        pairings = swissPairings(tournament_id)
+        resetInstrumentation()
+        paired = [p for (id1, n1, id2, n2) in swissPairings(tournament_id)
+                  for p in (id1, id2)]
+        stats = instrumentationSnapshot()
+    finally:
+        disableInstrumentation()
+    if sorted(paired) != sorted(i for (i, n, w, m) in
+                                playerStandings(tournament_id)):
+        raise ValueError("Indexed pairings should pair every player once.")
+    if stats["totals"]["statements"] != 1:
+        raise ValueError("Indexed pairings should only tally the matches.")
+    for (id1, name1, id2, name2) in pairings + pairings[:1]:
+        reportMatch(tournament_id, 1, id1, 10, id2, 5)
+    completeRound(tournament_id)
+    try:
+        reportMatch(tournament_id, 1, pairings[0][0], 10, pairings[1][0], 5)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Results for a complete round should be refused.")
+    wins = dict((i, w) for (i, n, w, m) in playerStandings(tournament_id))
+    with TournamentSession() as session:
+        indexed = session.swissPairings(tournament_id, random.Random(5))
+    clearBracketIndex()
+    with TournamentSession() as session:
+        rebuilt = session.swissPairings(tournament_id, random.Random(5))
+    if indexed != rebuilt:
+        raise ValueError("The index should match the database after results.")
+    if any(wins[id1] != wins[id2] for (id1, n1, id2, n2) in indexed):
+        raise ValueError("Players should be paired inside their bracket.")
+    undoRound(tournament_id)
+    if getCurrentRound(tournament_id) != 1 or \
+            set(w for (i, n, w, m) in playerStandings(tournament_id)) != \
+            set([0]):
+        raise ValueError("undoRound should reset the brackets.")
+    pairings = swissPairings(tournament_id)
+    for (id1, name1, id2, name2) in pairings:
+        reportMatch(tournament_id, 1, id1, 10, id2, 5)
+    #  Remove a match behind the index's back, as another process would
+    with TournamentSession() as session:
+        session.c.execute("""DELETE FROM match_result
+                              WHERE tournament_id = %s AND round_id = 1
+                                AND winner_id = %s;""",
+                          (tournament_id, pairings[0][0]))
+    with TournamentSession() as session:
+        checked = session.swissPairings(tournament_id, random.Random(5))
+    clearBracketIndex()
+    with TournamentSession() as session:
+        rebuilt = session.swissPairings(tournament_id, random.Random(5))
+    if checked != rebuilt:
+        raise ValueError("The index should see other processes' changes.")
+    print "31. Score brackets are kept in step with the results."
+
+
+def testOddField():
+    players = [(1, "A", 1), (2, "B", 1), (3, "C", 0), (4, "D", 0),
+               (5, "E", 0)]
+    opponents = {1: set([3]), 2: set([4]), 3: set([1]), 4: set([2])}
+    pairs = list(pairPlayers(players, opponents))
+    paired = [p for (id1, n1, id2, n2) in pairs for p in (id1, id2)]
+    if len(pairs) != 2 or len(set(paired)) != 4:
+        raise ValueError("An odd field should leave one player unpaired.")
+    if 5 not in paired:
+        raise ValueError("The bye should go to a player yet to have one.")
+    for backend in (MemoryBackend(), SQLiteBackend()):
+        backend.registerPlayers("Player %d" % i for i in range(1, 8))
+        tournament_id = backend.createTournament("Odd Tourney", 8)
+        backend.setupTournament(tournament_id)
+        backend.runTournament(tournament_id)
+        standings = backend.playerStandings(tournament_id)
+        num_rounds = backend.getNumberOfRounds(tournament_id)
+        if sum(m for (i, n, w, m) in standings) != 3 * 2 * num_rounds:
+            raise ValueError("Each round should pair all but one player.")
+    print "32. Odd fields give one player a bye each round."
+
+
+def testPostgresBackend():
+    deleteTournaments()
+    deletePlayers()
+    backend = PostgresBackend()
+    backend.registerPlayers("Player %d" % i for i in range(1, 17))
+    tournament_id = backend.createTournament("Engine Tourney", 16)
+    backend.setupTournament(tournament_id)
+    backend.runTournament(tournament_id)
+    standings = backend.playerStandings(tournament_id)
+    if [m for (i, n, w, m) in standings] != [4] * 16:
+        raise ValueError("Each player should play one match per round.")
+    if getCurrentRound(tournament_id) is not None:
+        raise ValueError("Every round should be complete.")
+    if [(i, w, m) for (i, n, w, m) in standings] != \
+            [(i, w, m) for (i, n, w, m) in playerStandings(tournament_id)]:
+        raise ValueError("The engine should order standings as the SQL.")
+    backend.deleteMatches(tournament_id)
+    if countPlayers() != 16 or \
+            backend.getCurrentRound(tournament_id) != 1:
+        raise ValueError("deleteMatches should reset the tournament.")
+    print "33. The engine runs its operations on PostgreSQL."
+
+
+def testAsyncSetup():
+    wait([async_deleteTournaments()])
+    wait([async_deletePlayers()])
+    if wait([async_countPlayers()]) != [0]:
+        raise ValueError("async_deletePlayers should remove every player.")
+    [player_ids] = wait([async_registerPlayers(
+        ("Player %d" % i for i in range(1, 33)), batch_size=10)])
+    if len(player_ids) != 32 or player_ids != sorted(player_ids) or \
+            countPlayers() != 32:
+        raise ValueError("async_registerPlayers should return every id.")
+    tournament_id = createTournament("Async Setup", 16)
+    random_id = createTournament("Async Random", 16)
+    wait([async_setupTournament(tournament_id),
+          async_setupTournament(random_id, "random", 7)])
+    if sorted(i for (i, n, w, m) in playerStandings(tournament_id)) != \
+            player_ids[:16]:
+        raise ValueError("The id strategy should register the first players.")
+    if len(set(i for (i, n, w, m) in playerStandings(random_id))) != 16:
+        raise ValueError("The random strategy should fill the field.")
+    try:
+        wait([async_setupTournament(tournament_id, "strongest")])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("An unknown setup strategy should be refused.")
+    wait([async_deleteTournaments()])
+    if getTournament(tournament_id) is not None:
+        raise ValueError("async_deleteTournaments should remove every one.")
+    print "34. Players and tournaments can be set up asynchronously."
+
+
 if __name__ == '__main__':
     testDeleteTournaments()
     testDelete()
@@ -160,6 +898,32 @@ if __name__ == '__main__':
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
+    testConnectionPool()
+    testSession()
+    testRegisterPlayers()
+    testReportRound()
+    testBackends()
+    testOpponentWins()
+    testNoRematches()
+    testSimulation()
+    testRunTournaments()
+    testAsync()
+    testStandingsCache()
+    testStreaming()
+    testInstrumentation()
+    testPreparedStatements()
+    testTournamentHandle()
+    testTiebreaks()
+    testSeededSimulation()
+    testSingleRowMatches()
+    testStandingsHistory()
+    testPartitions()
+    testSetupStrategies()
+    testConcurrentReporting()
+    testBracketIndex()
+    testOddField()
+    testPostgresBackend()
+    testAsyncSetup()
     print "Success!  All tests pass!"
 
 